@@ -0,0 +1,754 @@
+# https://github.com/xhdndmm/miaobox
+
+"""
+MiaoBox 下载性能基准测试
+
+在本地启动一个支持范围请求的 HTTP 测试服务器，可以模拟网络延迟、带宽上限、
+不支持 Accept-Ranges 以及传输中断，然后用 Downloader.download、
+single_thread_download 和 batch_download 下载不同大小的文件，
+以 JSON 格式输出吞吐量、峰值内存、CPU 时间和连接数。
+
+--classify 改为测试 URL 分类：生成指定数量的URL，比较 url_classifier 与
+逐条 re.search 的旧做法的耗时，并检查两者的结果是否一致。
+
+--chunks 改为测试分段下载热路径上每个数据块的开销：不经过网络，多个线程按
+--threads 和 --block-sizes 反复执行 download_chunk 对每个数据块做的处理
+（FileWriter.write_at、ProgressTracker.add、流量统计和限速），与只写文件以及
+旧版逐块加锁汇总、格式化进度的做法对比。
+
+每个场景都在单独的子进程中运行，峰值内存和 CPU 时间互不影响；
+测试服务器运行在父进程中，不计入下载端的开销。
+
+用法：
+    python benchmark.py
+    python benchmark.py --sizes 1M,64M --threads 1,8 --profiles fast,latency
+    python benchmark.py --modes download --block-sizes 64K,256K,1M --output bench.json
+    python benchmark.py --classify 100000
+    python benchmark.py --chunks 200000 --threads 1,8 --block-sizes 8K,256K
+"""
+
+import argparse
+import collections
+import hashlib
+import http.server
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# 服务器配置：latency 为每个请求响应前的延迟（秒），bandwidth 为每个连接的带宽上限（字节/秒），
+# accept_ranges 为是否支持范围请求，fail_every 为每隔多少个分段请求中断一次
+PROFILES = {
+    "fast": {},
+    "latency": {"latency": 0.05},
+    "capped": {"bandwidth": 4 * 1024 * 1024},
+    "no-ranges": {"accept_ranges": False},
+    "flaky": {"fail_every": 5},
+}
+
+# 旧版 is_video_url 中的规则，原样保留，作为 --classify 的对照：测试URL和对照结果都不依赖
+# url_classifier 使用的 VIDEO_SITES，两者不一致说明分类结果与旧版不同
+LEGACY_VIDEO_PATTERNS = (
+    # 国内视频平台
+    r'bilibili\.com/video/',
+    r'b23\.tv/',
+    r'douyin\.com/',
+    r'ixigua\.com/',
+    r'kuaishou\.com/',
+    r'weibo\.com/',
+    r'qq\.com/x/cover/',
+    r'v\.qq\.com/',
+    r'mgtv\.com/',
+    r'iqiyi\.com/',
+    r'youku\.com/',
+    r'acfun\.cn/',
+    r'huya\.com/',
+    r'douyu\.com/',
+    r'haokan\.baidu\.com/',
+    r'pan\.baidu\.com/',
+    r'zhihu\.com/zvideo/',
+    r'xiaohongshu\.com/',
+    r'pipix\.com/',
+    r'ximalaya\.com/',
+    r'music\.163\.com/',
+    r'y\.qq\.com/',
+    r'kugou\.com/',
+    r'kuwo\.cn/',
+    r'dongchedi\.com/',
+    r'live\.bilibili\.com/',
+    r'live\.douyin\.com/',
+    r'panda\.tv/',
+    r'yy\.com/',
+
+    # 国外视频平台
+    r'youtube\.com/watch\?v=',
+    r'youtu\.be/',
+    r'vimeo\.com/',
+    r'dailymotion\.com/',
+    r'facebook\.com/.*?/videos/',
+    r'fb\.watch/',
+    r'instagram\.com/.*?/video/',
+    r'twitter\.com/.*/status/',
+    r'x\.com/.*/status/',
+    r'tiktok\.com/',
+    r'twitch\.tv/',
+    r'nicovideo\.jp/watch/',
+    r'reddit\.com/r/.*/comments/',
+    r'pornhub\.com/',
+    r'xvideos\.com/',
+    r'xhamster\.com/',
+    r'soundcloud\.com/',
+    r'spotify\.com/track/',
+    r'mixcloud\.com/',
+    r'vk\.com/video',
+    r'ok\.ru/video/',
+    r'rutube\.ru/',
+    r'metacafe\.com/',
+    r'vlive\.tv/',
+    r'naver\.com/video/',
+    r'line\.me/share/video/',
+    r'linkedin\.com/posts/',
+    r'tumblr\.com/post/',
+    r'pinterest\.com/pin/',
+    r'flickr\.com/photos/',
+    r'streamable\.com/',
+    r'streamja\.com/',
+    r'streamye\.com/',
+    r'streamvi\.com/',
+    r'clippituser\.tv/',
+    r'gfycat\.com/',
+    r'imgur\.com/',
+    r'9gag\.com/',
+    r'bitchute\.com/',
+    r'odysee\.com/',
+    r'rumble\.com/',
+    r'archive\.org/details/',
+
+    # 教育平台
+    r'coursera\.org/',
+    r'edx\.org/course/',
+    r'udemy\.com/course/',
+    r'skillshare\.com/',
+    r'lynda\.com/',
+    r'pluralsight\.com/',
+    r'brilliant\.org/',
+    r'masterclass\.com/',
+
+    # 通用视频格式
+    r'\.mp4$',
+    r'\.m3u8$',
+    r'\.flv$',
+    r'\.mkv$',
+    r'\.webm$',
+    r'\.avi$',
+    r'\.mov$',
+    r'\.wmv$',
+    r'\.m4v$',
+    r'\.mpg$',
+    r'\.mpeg$',
+    r'\.3gp$',
+    r'\.ts$',
+    r'\.vob$',
+    r'\.ogv$',
+    r'\.mxf$',
+    r'\.f4v$',
+    r'\.rmvb$',
+    r'\.rm$',
+    r'\.asf$',
+    r'\.divx$',
+)
+
+MODES = ("download", "single", "batch")
+RESULT_MARKER = "BENCHMARK_RESULT "
+SEND_BLOCK_SIZE = 64 * 1024
+
+
+def parse_size(text):
+    """把 "64K"、"16M"、"1G" 这样的大小转换为字节数"""
+    match = re.fullmatch(r"\s*(\d+)\s*([KMG]?)B?\s*", text, re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"无效的大小：{text}")
+    unit = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}[match.group(2).upper()]
+    return int(match.group(1)) * unit
+
+
+def parse_list(text, convert=str):
+    return [convert(item) for item in text.split(",") if item.strip()]
+
+
+class FixtureHandler(http.server.BaseHTTPRequestHandler):
+    """测试服务器的请求处理"""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        fixture = self.server
+        data = fixture.files.get(self.path.split("?")[0].lstrip("/"))
+        if data is None:
+            self.send_error(404)
+            return
+        if fixture.latency:
+            time.sleep(fixture.latency)
+
+        start, end, status = 0, len(data) - 1, 200
+        range_header = self.headers.get("Range") if fixture.accept_ranges else None
+        if range_header:
+            match = re.fullmatch(r"bytes=(\d+)-(\d*)", range_header.strip())
+            if not match or int(match.group(1)) >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", fixture.etags[self.path.split("?")[0].lstrip("/")])
+        if fixture.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.end_headers()
+        fixture.count("requests")
+
+        # 只中断分段请求（不包括从 0 开始的探测请求），模拟传输到一半连接断开
+        fail = status == 206 and start > 0 and fixture.should_fail()
+        body = memoryview(data)[start:end + 1]
+        if fail:
+            body = body[:len(body) // 2]
+        self.send_body(body, fixture.bandwidth)
+        if fail:
+            self.close_connection = True
+            self.connection.shutdown(2)
+
+    def send_body(self, body, bandwidth):
+        """按块发送响应体，设置了带宽上限时按时间节流"""
+        started = time.perf_counter()
+        sent = 0
+        for offset in range(0, len(body), SEND_BLOCK_SIZE):
+            if bandwidth:
+                delay = sent / bandwidth - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            block = body[offset:offset + SEND_BLOCK_SIZE]
+            try:
+                self.wfile.write(block)
+            except OSError:
+                return
+            sent += len(block)
+            self.server.count("bytes_sent", len(block))
+
+
+class FixtureServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """支持范围请求的本地测试服务器，文件内容保存在内存中"""
+
+    daemon_threads = True
+
+    def __init__(self, files):
+        super().__init__(("127.0.0.1", 0), FixtureHandler)
+        self.files = files
+        self.etags = {name: f'"{hashlib.md5(data[:4096]).hexdigest()}-{len(data)}"'
+                      for name, data in files.items()}
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.configure({})
+
+    def configure(self, profile):
+        self.latency = profile.get("latency", 0)
+        self.bandwidth = profile.get("bandwidth", 0)
+        self.accept_ranges = profile.get("accept_ranges", True)
+        self.fail_every = profile.get("fail_every", 0)
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"connections": 0, "requests": 0, "bytes_sent": 0, "failures_injected": 0}
+            self.segment_requests = 0
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def should_fail(self):
+        if not self.fail_every:
+            return False
+        with self.lock:
+            self.segment_requests += 1
+            if self.segment_requests % self.fail_every:
+                return False
+            self.stats["failures_injected"] += 1
+            return True
+
+    def handle_error(self, request, client_address):
+        # 客户端提前关闭连接（例如分段被拆分后）是正常情况，不输出异常堆栈
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def peak_rss_mb():
+    """当前进程的峰值内存（MB）"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位是 KB，macOS 上是字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def import_download(db_file=None):
+    """导入 download 模块
+
+    download 在导入时就会打开历史记录数据库（以及去重索引和视频归档），并迁移
+    旧版 JSON 历史记录，所以要在第一次导入前通过 MIAOBOX_HISTORY_DB 换成临时
+    数据库，不影响真实的下载历史。
+    """
+    if "download" not in sys.modules:
+        os.environ["MIAOBOX_HISTORY_DB"] = db_file or os.path.join(
+            tempfile.mkdtemp(prefix="miaobox-bench-"), "history.db")
+    import download
+    return download
+
+
+def run_scenario(scenario):
+    """在子进程中执行一个场景，返回下载端的测量结果"""
+    save_path = scenario["save_path"]
+    download = import_download(os.path.join(save_path, "history.db"))
+    download.app.config.update(
+        SAVE_PATH=save_path,
+        MAX_THREADS=scenario["threads"],
+        IO_BLOCK_SIZE=scenario["block_size"],
+        ADAPTIVE_THREADS=scenario["adaptive"],
+        DEDUP_ENABLED=False,
+    )
+
+    baseline_rss = peak_rss_mb()
+    cpu_start = os.times()
+    started = time.perf_counter()
+    error = None
+    files = []
+    try:
+        if scenario["mode"] == "batch":
+            results = download.Downloader.batch_download(scenario["urls"], save_path)
+            error = next((result["error"] for result in results if result["status"] != "success"), None)
+            files = [result.get("file") for result in results]
+        else:
+            downloader = download.Downloader(scenario["urls"][0], save_path)
+            if scenario["mode"] == "single":
+                files = [downloader.single_thread_download()]
+            else:
+                files = [downloader.download()]
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    elapsed = time.perf_counter() - started
+    cpu_end = os.times()
+
+    verified = error is None and all(
+        name and file_sha256(os.path.join(save_path, name)) == expected
+        for name, expected in zip(files, scenario["sha256"])
+    )
+    return {
+        "elapsed": elapsed,
+        "cpu_seconds": (cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system),
+        "peak_rss_mb": peak_rss_mb(),
+        "baseline_rss_mb": baseline_rss,
+        "verified": verified,
+        "error": error,
+    }
+
+
+def build_url_corpus(count, seed="urls"):
+    """生成分类测试用的URL：视频网站、带扩展名的文件和普通网页各占一部分"""
+    rng = random.Random(seed)
+    site_patterns = [pattern for pattern in LEGACY_VIDEO_PATTERNS if not pattern.endswith("$")]
+    extensions = [pattern[2:-1] for pattern in LEGACY_VIDEO_PATTERNS if pattern.endswith("$")]
+    extensions += ["zip", "pdf", "exe", "iso", "html"]
+    urls = []
+    for _ in range(count):
+        token = f"{rng.getrandbits(48):012x}"
+        kind = rng.random()
+        if kind < 0.4:
+            # 把旧版规则还原成一个示例地址
+            sample = re.sub(r"\.\*\??", "user", rng.choice(site_patterns)).replace("\\", "")
+            urls.append(f"https://{rng.choice(('', 'www.', 'm.'))}{sample}{token}")
+        elif kind < 0.6:
+            urls.append(f"https://cdn{rng.randrange(100)}.example.net/files/{token}.{rng.choice(extensions)}")
+        else:
+            urls.append(f"https://site{rng.randrange(10000)}.example.{rng.choice(('com', 'org', 'cn'))}"
+                        f"/page/{token}?ref={rng.randrange(1000)}")
+    return urls
+
+
+def linear_is_video_url(url):
+    """旧版 is_video_url 的做法：逐条 re.search"""
+    return any(re.search(pattern, url, re.I) for pattern in LEGACY_VIDEO_PATTERNS)
+
+
+def run_classify_benchmark(count):
+    """URL 分类基准测试"""
+    download = import_download()
+
+    urls = build_url_corpus(count)
+    classifier = download.url_classifier
+
+    started = time.perf_counter()
+    results = [classifier.classify(url) for url in urls]
+    classifier_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    expected = [linear_is_video_url(url) for url in urls]
+    linear_seconds = time.perf_counter() - started
+
+    mismatches = [url for url, result, video in zip(urls, results, expected) if result.is_video != video]
+    profiles = collections.Counter(result.profile or "none" for result in results)
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "urls": count,
+        "video_urls": sum(result.is_video for result in results),
+        "profiles": dict(profiles),
+        "classifier_seconds": classifier_seconds,
+        "classifier_urls_per_second": count / classifier_seconds if classifier_seconds else None,
+        "linear_scan_seconds": linear_seconds,
+        "linear_scan_urls_per_second": count / linear_seconds if linear_seconds else None,
+        "speedup": linear_seconds / classifier_seconds if classifier_seconds else None,
+        "mismatches": len(mismatches),
+        "mismatch_examples": mismatches[:10],
+    }
+
+
+class LegacyProgress:
+    """旧版 download_chunk 的进度记录：每个数据块都加锁、重新求和并格式化所有线程的进度"""
+
+    def __init__(self, download, chunk_ranges):
+        self.download = download
+        self.chunk_ranges = chunk_ranges
+        self.total_size = sum(end - start + 1 for start, end in chunk_ranges.values())
+        self.downloaded_chunks = {}
+        self.progress_lock = threading.Lock()
+        self.last_update_time = time.time()
+        self.last_downloaded_size = 0
+        self.progress = None
+
+    def add(self, chunk_id, size):
+        format_size = self.download.format_size
+        with self.progress_lock:
+            self.downloaded_chunks[chunk_id] = self.downloaded_chunks.get(chunk_id, 0) + size
+            downloaded = sum(self.downloaded_chunks.values())
+            now = time.time()
+            time_diff = now - self.last_update_time
+            speed = (downloaded - self.last_downloaded_size) / time_diff if time_diff > 0 else 0
+            eta = (self.total_size - downloaded) / speed if speed > 0 else 0
+            thread_progress = []
+            for thread_id in sorted(self.downloaded_chunks):
+                start, end = self.chunk_ranges[thread_id]
+                thread_progress.append({
+                    'thread_id': thread_id + 1,
+                    'percentage': self.downloaded_chunks[thread_id] / (end - start + 1) * 100,
+                    'downloaded': format_size(self.downloaded_chunks[thread_id]),
+                    'total': format_size(end - start + 1),
+                    'range': f"{format_size(start)}-{format_size(end)}",
+                })
+            self.progress = {
+                'percentage': downloaded / self.total_size * 100,
+                'downloaded': format_size(downloaded),
+                'total': format_size(self.total_size),
+                'speed': format_size(speed) + '/s',
+                'eta': self.download.format_time(eta),
+                'threads': thread_progress,
+            }
+            self.last_update_time = now
+            self.last_downloaded_size = downloaded
+
+
+# 每个线程循环写入的区域大小（块数），文件保持在页缓存中，测得的是 Python 层的开销
+CHUNK_REGION_BLOCKS = 64
+
+
+def time_chunk_path(download, path, writer, thread_count, block_size, blocks):
+    """多个线程各处理 blocks 个数据块，返回总耗时（秒）"""
+    # download_chunk 拿到的是读取缓冲区的 memoryview
+    data = memoryview(bytearray(block_size))
+    region = CHUNK_REGION_BLOCKS * block_size
+    chunk_ranges = {i: (i * blocks * block_size, (i + 1) * blocks * block_size - 1) for i in range(thread_count)}
+    tracker = download.ProgressTracker()
+    tracker.reset(thread_count * blocks * block_size, thread_count)
+    legacy = LegacyProgress(download, chunk_ranges)
+    job_bucket = download.TokenBucket()
+    host = "127.0.0.1"
+
+    def worker(worker_id):
+        segment = download.Segment(*chunk_ranges[worker_id])
+        base = worker_id * region
+        for _ in range(blocks):
+            offset = base + (segment.current - segment.start) % region
+            if path == "write":
+                writer.write_at(data, offset)
+                segment.current += block_size
+            elif path == "legacy":
+                writer.write_at(data, offset)
+                segment.current += block_size
+                legacy.add(worker_id, block_size)
+            else:
+                # 与 download_chunk 中每个数据块的处理相同
+                with segment.lock:
+                    size = min(block_size, segment.remaining)
+                    writer.write_at(data[:size], offset)
+                    segment.current += size
+                    finished = segment.remaining <= 0
+                tracker.add(worker_id, size)
+                download.metrics.bytes_downloaded.inc(host, amount=size)
+                download.bandwidth_limiter.acquire(size, host, job_bucket)
+                if finished:
+                    break
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(thread_count)]
+    started = time.perf_counter()
+    if path == "current":
+        tracker.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if path == "current":
+        tracker.stop()
+    return time.perf_counter() - started
+
+
+def run_chunk_benchmark(args):
+    """分段下载热路径基准测试"""
+    download = import_download()
+
+    results = []
+    save_path = tempfile.mkdtemp(prefix="miaobox-bench-")
+    try:
+        for thread_count in args.threads:
+            for block_size in args.block_sizes:
+                # 每个线程处理的块数，总块数约为 --chunks
+                blocks = max(1, args.chunks // thread_count)
+                total_blocks = blocks * thread_count
+                file_path = os.path.join(save_path, f"chunks-{thread_count}-{block_size}.bin")
+                download.FileWriter.create(file_path, thread_count * CHUNK_REGION_BLOCKS * block_size)
+                writer = download.FileWriter(file_path)
+                try:
+                    seconds = {path: time_chunk_path(download, path, writer, thread_count, block_size, blocks)
+                               for path in ("write", "current", "legacy")}
+                finally:
+                    writer.close()
+                    os.remove(file_path)
+
+                result = {
+                    "threads": thread_count,
+                    "block_size": block_size,
+                    "chunks": total_blocks,
+                }
+                for path, elapsed in seconds.items():
+                    result[f"{path}_seconds"] = elapsed
+                    result[f"{path}_us_per_chunk"] = elapsed / total_blocks * 1e6
+                # 去掉写文件本身的耗时，剩下的就是每个数据块的记账开销
+                result["overhead_us_per_chunk"] = (seconds["current"] - seconds["write"]) / total_blocks * 1e6
+                result["legacy_overhead_us_per_chunk"] = (seconds["legacy"] - seconds["write"]) / total_blocks * 1e6
+                results.append(result)
+                print(f"threads={thread_count} block={block_size} -> "
+                      f"{result['overhead_us_per_chunk']:.2f} us/chunk overhead "
+                      f"(legacy {result['legacy_overhead_us_per_chunk']:.2f})",
+                      file=sys.stderr)
+    finally:
+        shutil.rmtree(save_path, ignore_errors=True)
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def build_scenarios(args):
+    """生成 (服务器配置, 场景) 列表"""
+    scenarios = []
+    for profile in args.profiles:
+        for mode in args.modes:
+            sizes = [args.batch_size] if mode == "batch" else args.sizes
+            threads = [1] if mode == "single" else args.threads
+            for size in sizes:
+                for thread_count in threads:
+                    for block_size in args.block_sizes:
+                        for repeat in range(args.repeat):
+                            scenarios.append({
+                                "profile": profile,
+                                "mode": mode,
+                                "size": size,
+                                "files": args.batch_files if mode == "batch" else 1,
+                                "threads": thread_count,
+                                "block_size": block_size,
+                                "adaptive": args.adaptive,
+                                "repeat": repeat,
+                            })
+    return scenarios
+
+
+def run_benchmarks(args):
+    names = {}
+    files = {}
+    for size in set(args.sizes) | {args.batch_size}:
+        count = args.batch_files if size == args.batch_size and "batch" in args.modes else 1
+        for i in range(count):
+            name = f"file-{size}-{i}.bin"
+            # 固定随机种子，每次运行的文件内容相同
+            files[name] = random.Random(f"{size}-{i}").randbytes(size)
+            names.setdefault(size, []).append(name)
+    digests = {name: hashlib.sha256(data).hexdigest() for name, data in files.items()}
+
+    server = FixtureServer(files)
+    server.start()
+    script = os.path.abspath(__file__)
+    results = []
+    scenarios = build_scenarios(args)
+    try:
+        for index, scenario in enumerate(scenarios, 1):
+            server.configure(PROFILES[scenario["profile"]])
+            file_names = names[scenario["size"]][:scenario["files"]]
+            save_path = tempfile.mkdtemp(prefix="miaobox-bench-")
+            child = dict(scenario,
+                         save_path=save_path,
+                         urls=[f"{server.base_url}/{name}" for name in file_names],
+                         sha256=[digests[name] for name in file_names])
+            try:
+                process = subprocess.run(
+                    [sys.executable, script, "--run-scenario", json.dumps(child)],
+                    cwd=save_path, capture_output=True, text=True, timeout=args.timeout
+                )
+                lines = [line for line in process.stdout.splitlines() if line.startswith(RESULT_MARKER)]
+                if lines:
+                    measured = json.loads(lines[-1][len(RESULT_MARKER):])
+                else:
+                    measured = {"error": process.stderr.strip().splitlines()[-1:] or "子进程没有输出结果"}
+            except subprocess.TimeoutExpired:
+                measured = {"error": f"超过 {args.timeout} 秒未完成"}
+            finally:
+                shutil.rmtree(save_path, ignore_errors=True)
+
+            total_bytes = scenario["size"] * scenario["files"]
+            result = dict(scenario, total_bytes=total_bytes, **measured, **server.stats)
+            if measured.get("elapsed"):
+                result["throughput_mb_s"] = total_bytes / measured["elapsed"] / (1024 * 1024)
+                result["cpu_seconds_per_gb"] = measured["cpu_seconds"] / (total_bytes / 1024 ** 3)
+            result["transfer_overhead"] = server.stats["bytes_sent"] / total_bytes
+            results.append(result)
+            print(f"[{index}/{len(scenarios)}] {scenario['profile']:>9} {scenario['mode']:>8} "
+                  f"size={scenario['size']} threads={scenario['threads']} block={scenario['block_size']} "
+                  f"adaptive={scenario['adaptive']} "
+                  f"-> {result.get('throughput_mb_s', 0):.1f} MB/s, "
+                  f"{server.stats['connections']} conns, "
+                  f"{'ok' if result.get('verified') else 'FAILED'}",
+                  file=sys.stderr)
+    finally:
+        server.shutdown()
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MiaoBox 下载性能基准测试")
+    parser.add_argument("--sizes", type=lambda text: parse_list(text, parse_size), default="1M,16M,64M",
+                        help="download/single 模式的文件大小，逗号分隔（默认 1M,16M,64M）")
+    parser.add_argument("--threads", type=lambda text: parse_list(text, int), default="1,4,8",
+                        help="MAX_THREADS 取值，逗号分隔（默认 1,4,8）")
+    parser.add_argument("--block-sizes", type=lambda text: parse_list(text, parse_size), default="256K",
+                        help="IO_BLOCK_SIZE 取值，逗号分隔（默认 256K）")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="开启 ADAPTIVE_THREADS，线程数从初始值开始自动调整，最多 MAX_THREADS；"
+                             "默认关闭，按 --threads 固定线程数")
+    parser.add_argument("--modes", type=parse_list, default=",".join(MODES),
+                        help="要测试的方法：download、single、batch")
+    parser.add_argument("--profiles", type=parse_list, default="fast,latency,flaky",
+                        help=f"服务器配置，可选 {', '.join(PROFILES)}（默认 fast,latency,flaky）")
+    parser.add_argument("--batch-files", type=int, default=20, help="batch 模式的文件数（默认 20）")
+    parser.add_argument("--batch-size", type=parse_size, default="1M", help="batch 模式每个文件的大小（默认 1M）")
+    parser.add_argument("--repeat", type=int, default=1, help="每个场景的重复次数")
+    parser.add_argument("--timeout", type=int, default=300, help="单个场景的超时时间（秒）")
+    parser.add_argument("--output", help="结果写入的 JSON 文件，默认输出到标准输出")
+    parser.add_argument("--classify", type=int, metavar="N", help="改为测试 N 个URL的分类速度")
+    parser.add_argument("--chunks", type=int, metavar="N",
+                        help="改为测试分段下载热路径上每个数据块的开销，共处理约 N 个数据块")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        print(RESULT_MARKER + json.dumps(run_scenario(json.loads(args.run_scenario))), flush=True)
+        return
+
+    unknown = [name for name in args.profiles if name not in PROFILES]
+    unknown += [name for name in args.modes if name not in MODES]
+    if unknown:
+        parser.error(f"未知的配置或模式：{', '.join(unknown)}")
+
+    if args.classify:
+        result = run_classify_benchmark(args.classify)
+    elif args.chunks:
+        result = run_chunk_benchmark(args)
+    else:
+        result = run_benchmarks(args)
+    report = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
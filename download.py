@@ -11,12 +11,21 @@ MiaoBox - 一个简单的文件和视频下载器
 """
 
 import json
+import copy
+import mimetypes
 import time
+import sqlite3
 from datetime import datetime
 import hashlib
 import re
 import os
 import sys
+import shutil
+import queue
+import uuid
+import itertools
+import collections
+import contextlib
 import threading
 import logging
 import webbrowser
@@ -24,8 +33,11 @@ from urllib.parse import urlparse
 from pathvalidate import sanitize_filename
 import magic
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
 import browser_cookie3
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 
 
 # 检查并添加虚拟环境路径
@@ -46,8 +58,7 @@ except ImportError as e:
 
 
 app = Flask(__name__)
-download_thread = None
-downloader = None
+batch_thread = None
 lock = threading.Lock()
 
 
@@ -56,14 +67,67 @@ class Config:
     # 文件和路径配置
     LOG_FILE = "miaobox_log.log"
     SAVE_PATH = os.path.join(os.path.expanduser("~"), "Downloads")
-    HISTORY_FILE = "download_history.json"
+    HISTORY_FILE = "download_history.json"  # 旧版历史记录文件（与数据库在同一目录），启动时会迁移到数据库
+    # 历史记录、去重索引和视频归档共用的数据库，可用环境变量 MIAOBOX_HISTORY_DB 指定（例如测试时使用临时文件）
+    HISTORY_DB = os.environ.get("MIAOBOX_HISTORY_DB", "download_history.db")
+    HISTORY_PAGE_SIZE = 50  # 历史记录默认每页条数
+    HISTORY_MAX_PAGE_SIZE = 200
 
     # 下载配置
     MAX_RETRIES = 3
     DOWNLOAD_TIMEOUT = 30  # 下载超时时间（秒）
     PROGRESS_UPDATE_INTERVAL = 0.1  # 进度更新间隔（秒）
     MAX_THREADS = 8  # 最大线程数
+    HOST_MAX_THREADS = {}  # 每个主机的最大线程数，例如 {"example.com": 4}
+    ADAPTIVE_THREADS = True  # 根据实测吞吐量自动调整线程数
+    ADAPTIVE_INITIAL_THREADS = 2  # 没有历史记录的主机的初始线程数
+    ADAPTIVE_INTERVAL = 1.0  # 每次调整线程数前测量吞吐量的时间（秒）
+    ADAPTIVE_MIN_GAIN = 0.1  # 增加一个线程至少要带来的吞吐量提升比例
     MIN_CHUNK_SIZE = 1024 * 1024  # 最小分块大小（1MB）
+    MAX_SEGMENT_SIZE = 16 * 1024 * 1024  # 最大分段大小（16MB）
+    SEGMENTS_PER_THREAD = 4  # 每个线程平均分到的初始分段数
+    MIN_SPLIT_SIZE = 256 * 1024  # 拆分进行中分段时，新旧两段各自的最小大小
+    RESUME_BLOCK_SIZE = 1024 * 1024  # 断点续传位图中每一位对应的字节数（1MB）
+    RESUME_FLUSH_INTERVAL = 2  # 断点续传控制文件的写入间隔（秒）
+    IO_BLOCK_SIZE = 256 * 1024  # 每次从网络读取并写入磁盘的块大小（256KB）
+    IO_PREALLOCATE = False  # 是否在下载前用 fallocate 预分配磁盘空间
+
+    # 连接池配置
+    HTTP_POOL_SIZE = 16  # 每个主机保持的最大连接数
+    HTTP_KEEP_ALIVE = True  # 是否复用连接
+    HTTP_RETRIES = 2  # 建立连接失败或返回 502/503/504 时的自动重试次数
+
+    # 带宽限制（字节/秒，0 表示不限制），运行时可通过 /rate_limit 调整
+    GLOBAL_RATE_LIMIT = 0
+    HOST_RATE_LIMITS = {}  # 例如 {"example.com": 1024 * 1024}
+    MAX_CONCURRENT_JOBS = 3  # 同时进行的下载任务数
+    FINISHED_JOB_TTL = 3600  # 已结束的任务保留多久（秒），之后不再能查询状态
+    MAX_FINISHED_JOBS = 200  # 最多保留的已结束任务数，超出时先移除最早结束的
+    BATCH_CONCURRENCY = 8  # 批量下载同时进行的文件数
+    BATCH_PER_HOST_LIMIT = 4  # 批量下载时同一主机同时进行的文件数
+    PROBE_SIZE = 8192  # 探测请求读取的字节数（用于文件名哈希和类型检测）
+    MIRROR_MAX_FAILURES = 3  # 镜像连续失败达到该次数后停止使用（至少保留一个镜像）
+    PROGRESS_STREAM_INTERVAL = 0.5  # /progress_stream 推送进度的最小间隔（秒）
+    PROGRESS_STREAM_KEEPALIVE = 15  # 没有进度变化时发送心跳的间隔（秒）
+    PROGRESS_LOG_INTERVAL = 10  # 视频下载进度在 DEBUG 级别下的日志间隔（秒）
+    ALLOWED_MIME_TYPES = None  # 允许下载的MIME类型列表，None表示不限制
+
+    # 视频提取配置
+    EXTRACT_CACHE_TTL = 300  # yt-dlp 提取结果的缓存时间（秒），视频地址通常带有过期时间的签名
+    EXTRACT_CACHE_SIZE = 256  # 最多缓存的提取结果数
+    YTDLP_POOL_SIZE = 3  # 每种站点配置保留的空闲 YoutubeDL 实例数
+    PLAYLIST_CONCURRENCY = 3  # 播放列表同时下载的视频数
+    MEDIA_PLANNER = True  # 合并容器转换、元数据、缩略图和字幕等后处理，只调用一次 ffmpeg，能封装时不转码
+    ARCHIVE_BREAK_AFTER = 0  # 播放列表中连续遇到多少个已下载的视频后停止枚举，0 表示枚举全部
+    # 站点配置，按配置名覆盖 DEFAULT_SITE_PROFILES 中的字段或添加新的站点，例如
+    # {"youtube": {"concurrent_fragments": 16}, "example": {"domains": ["example.com"], "rate_limit": 1048576}}
+    SITE_PROFILES = {}
+    SITE_PROFILES_FILE = "site_profiles.json"  # 存在时其中的站点配置也会合并进来，格式同 SITE_PROFILES
+
+    # 去重配置
+    DEDUP_ENABLED = True  # URL、校验值和大小都与已下载文件相同时跳过下载
+    DEDUP_HASH = False  # 下载完成后计算 SHA-256，内容相同的文件改为硬链接
+    DEDUP_HASH_BLOCK_SIZE = 1024 * 1024  # 计算文件哈希时每次读取的字节数
 
     # 请求头配置
     USER_AGENT = (
@@ -81,11 +145,924 @@ logging.basicConfig(
     encoding="utf-8"
 )
 
+# 任务尚未上报进度时使用的默认进度
+DEFAULT_PROGRESS = {
+    'percentage': 0,
+    'downloaded': '0B',
+    'total': '0B',
+    'speed': '0B/s',
+    'eta': '未知'
+}
+
+
+class RemoteFileInfo:
+    """远程文件元数据
+
+    由一次 bytes=0-(PROBE_SIZE-1) 的范围请求得到，文件名、大小、
+    是否支持范围请求以及内容样本都来自同一个响应。服务器忽略范围请求
+    时，body 为 (响应, 样本之后多读出的部分, 剩余数据块的迭代器)，
+    单线程下载继续读取它，不再重新请求。
+    """
+
+    def __init__(self, filename, total_size, accept_ranges, sample, headers, body=None):
+        self.filename = filename
+        self.total_size = total_size
+        self.accept_ranges = accept_ranges
+        self.sample = sample
+        self.headers = headers
+        self.body = body
+
+    def take_body(self):
+        """取走未读完的响应，只能取走一次"""
+        body, self.body = self.body, None
+        return body
+
+    def close(self):
+        """关闭没有被取走的响应"""
+        body = self.take_body()
+        if body:
+            body[0].close()
+
+    @property
+    def is_complete(self):
+        """样本是否已包含整个文件"""
+        return 0 < self.total_size <= len(self.sample)
+
+    @property
+    def validator(self):
+        """用于 If-Range 的校验值，优先使用强 ETag，其次使用 Last-Modified"""
+        etag = self.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return self.headers.get('Last-Modified')
+
+
+class Counter:
+    """Prometheus 计数器，按标签值分别计数"""
+
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.lock = threading.Lock()
+        self.values = collections.defaultdict(float)
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] += amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, labels, value) for labels, value in self.values.items()]
+
+
+class Gauge(Counter):
+    """Prometheus 仪表盘，值可以任意设置"""
+
+    type_name = "gauge"
+
+    def set(self, *labels, value):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram:
+    """Prometheus 直方图"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = sorted(buckets)
+        self.labelnames = labelnames
+        self.lock = threading.Lock()
+        self.values = {}  # 标签值 -> [各桶计数, 总和, 次数]
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+                    break
+            counts[1] += value
+            counts[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        """统计代码块的耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self):
+        with self.lock:
+            values = [(labels, list(counts[0]), counts[1], counts[2]) for labels, counts in self.values.items()]
+        samples = []
+        for labels, buckets, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, buckets):
+                cumulative += bucket_count
+                samples.append((self.name + "_bucket", labels + (("le", repr(float(bound))),), cumulative))
+            samples.append((self.name + "_bucket", labels + (("le", "+Inf"),), count))
+            samples.append((self.name + "_sum", labels, total))
+            samples.append((self.name + "_count", labels, count))
+        return samples
+
+
+class Metrics:
+    """运行指标，通过 /metrics 以 Prometheus 文本格式导出
+
+    热路径上只做一次加锁累加，格式化只在抓取时进行。
+    """
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    THROUGHPUT_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(7))  # 64KB/s - 256MB/s
+    STAGE_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+    def __init__(self):
+        self.bytes_downloaded = Counter(
+            "miaobox_downloaded_bytes_total", "Bytes received from remote hosts", ("host",))
+        self.throughput = Histogram(
+            "miaobox_host_throughput_bytes_per_second", "Throughput of each HTTP transfer",
+            self.THROUGHPUT_BUCKETS, ("host",))
+        self.ttfb = Histogram(
+            "miaobox_time_to_first_byte_seconds", "Time until response headers are received",
+            self.LATENCY_BUCKETS, ("host",))
+        self.segment_retries = Counter(
+            "miaobox_segment_retries_total", "Segment requests that failed and were retried", ("host",))
+        self.jobs_finished = Counter(
+            "miaobox_jobs_finished_total", "Finished download jobs", ("type", "status"))
+        self.jobs = Gauge("miaobox_jobs", "Current download jobs", ("status",))
+        self.history_latency = Histogram(
+            "miaobox_history_operation_seconds", "Latency of download history operations",
+            self.LATENCY_BUCKETS, ("operation",))
+        self.extract_cache = Counter(
+            "miaobox_extract_cache_requests_total", "Video extraction cache lookups", ("result",))
+        self.video_stages = Histogram(
+            "miaobox_video_stage_seconds", "Time spent downloading and postprocessing each video",
+            self.STAGE_BUCKETS, ("stage",))
+        self.all = [self.bytes_downloaded, self.throughput, self.ttfb, self.segment_retries,
+                    self.jobs_finished, self.jobs, self.history_latency, self.extract_cache,
+                    self.video_stages]
+
+    def observe_transfer(self, host, size, elapsed):
+        """记录一次 HTTP 传输的吞吐量"""
+        if size > 0 and elapsed > 0:
+            self.throughput.observe(size / elapsed, host)
+
+    def render(self):
+        """生成 Prometheus 文本格式"""
+        lines = []
+        for metric in self.all:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                count = len(metric.labelnames)
+                pairs = list(zip(metric.labelnames, labels[:count])) + list(labels[count:])
+                label_text = ",".join(
+                    '{}="{}"'.format(key, str(val).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for key, val in pairs
+                )
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class Mirror:
+    """同一文件的一个下载地址"""
+
+    def __init__(self, url):
+        self.url = url
+        self.host = urlparse(url).hostname
+        self.validator = None  # 该镜像的 If-Range 校验值
+        self.speed = 0  # 单个连接的实测速度（字节/秒），0 表示尚未测量
+        self.active = 0  # 正在使用该镜像的连接数
+        self.failures = 0  # 连续失败次数
+        self.disabled = False
+
+
+class MirrorSet:
+    """多个镜像之间的分段分配
+
+    每个分段请求选择 (连接数 + 1) / 单连接速度 最小的镜像，各镜像的连接数
+    与其速度成正比；尚未测速的镜像按当前最快的速度估计，保证每个镜像都会被尝试。
+    镜像连续失败 MIRROR_MAX_FAILURES 次后停止使用，失败的分段由调度器重试，
+    下一次请求自动换到其他镜像。
+    """
+
+    def __init__(self, urls, max_failures):
+        self.mirrors = [Mirror(url) for url in urls]
+        self.max_failures = max_failures
+        self.lock = threading.Lock()
+
+    @property
+    def primary(self):
+        return self.mirrors[0]
+
+    def enabled(self):
+        return [mirror for mirror in self.mirrors if not mirror.disabled]
+
+    def disable(self, mirror, reason):
+        with self.lock:
+            if mirror.disabled or len(self.enabled()) <= 1:
+                return
+            mirror.disabled = True
+        logging.warning("停止使用镜像 %s：%s", mirror.url, reason)
+
+    def acquire(self):
+        """选择下一个分段使用的镜像"""
+        with self.lock:
+            candidates = self.enabled()
+            fastest = max((mirror.speed for mirror in candidates), default=0) or 1
+            mirror = min(candidates, key=lambda m: (m.active + 1) / (m.speed or fastest))
+            mirror.active += 1
+            return mirror
+
+    def release(self, mirror, size, elapsed, error=None):
+        """归还镜像并更新其速度和失败次数"""
+        with self.lock:
+            mirror.active -= 1
+            if error is None:
+                mirror.failures = 0
+                if size > 0 and elapsed > 0:
+                    speed = size / elapsed
+                    mirror.speed = speed if not mirror.speed else 0.7 * mirror.speed + 0.3 * speed
+                return
+            mirror.failures += 1
+            failures = mirror.failures
+        if failures >= self.max_failures:
+            self.disable(mirror, f"连续失败 {failures} 次（{error}）")
+
+
+class SessionPool:
+    """按主机复用的 HTTP 会话池
+
+    每个主机（scheme + host:port）对应一个 requests.Session，探测请求、分段下载
+    和批量下载共用其中的连接，避免每个请求都重新进行 TCP/TLS 握手。
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        """获取 URL 所在主机的会话"""
+        parsed = urlparse(url)
+        key = f"{parsed.scheme}://{parsed.netloc.lower()}"
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.create_session()
+                self.sessions[key] = session
+            return session
+
+    def create_session(self):
+        """创建带连接池和自动重试的会话"""
+        session = requests.Session()
+        retries = Retry(
+            total=app.config['HTTP_RETRIES'],
+            backoff_factor=0.5,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=app.config['HTTP_POOL_SIZE'],
+            max_retries=retries
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not app.config['HTTP_KEEP_ALIVE']:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def close(self):
+        """关闭所有会话"""
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+
+
+# 创建全局HTTP会话池
+http_sessions = SessionPool()
+
+
+class TokenBucket:
+    """令牌桶
+
+    桶容量为一秒的流量。取走的令牌超过桶内余量时记为欠额，调用方按欠额等待，
+    因此一次取走一个大块也能把长期速度限制在 rate 以内。rate 为 0 表示不限制。
+    """
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.tokens = rate
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        """修改速度上限"""
+        with self.lock:
+            self.rate = rate
+            self.tokens = min(self.tokens, rate)
+            self.last_time = time.monotonic()
+
+    def consume(self, size):
+        """取走 size 个令牌，返回需要等待的秒数"""
+        if not self.rate:
+            return 0
+        with self.lock:
+            if not self.rate:
+                return 0
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last_time) * self.rate)
+            self.last_time = now
+            self.tokens -= size
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class BandwidthLimiter:
+    """带宽限制器
+
+    全局、按主机和按任务三级令牌桶。普通下载的每个工作线程和视频下载的进度回调
+    都从同一组令牌桶中取令牌，按三者中最长的等待时间休眠。
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(app.config['GLOBAL_RATE_LIMIT'])
+        self.host_buckets = {host: TokenBucket(rate) for host, rate in app.config['HOST_RATE_LIMITS'].items()}
+        self.lock = threading.Lock()
+
+    def set_global_limit(self, rate):
+        """设置全局速度上限"""
+        self.global_bucket.set_rate(rate)
+
+    def set_host_limit(self, host, rate):
+        """设置某个主机的速度上限"""
+        with self.lock:
+            bucket = self.host_buckets.get(host)
+            if bucket is None:
+                self.host_buckets[host] = TokenBucket(rate)
+            else:
+                bucket.set_rate(rate)
+
+    def get_limits(self):
+        """当前的全局和主机速度上限"""
+        with self.lock:
+            hosts = {host: bucket.rate for host, bucket in self.host_buckets.items() if bucket.rate}
+        return {'global': self.global_bucket.rate, 'hosts': hosts}
+
+    def effective_rate(self, host, job_bucket=None):
+        """某个任务可用的最大速度（0 表示不限制）"""
+        host_bucket = self.host_buckets.get(host)
+        rates = [self.global_bucket.rate, host_bucket.rate if host_bucket else 0,
+                 job_bucket.rate if job_bucket else 0]
+        rates = [rate for rate in rates if rate]
+        return min(rates) if rates else 0
+
+    def acquire(self, size, host, job_bucket=None):
+        """消耗 size 字节的额度，超出速度上限时阻塞等待"""
+        host_bucket = self.host_buckets.get(host)
+        wait = self.global_bucket.consume(size)
+        if host_bucket:
+            wait = max(wait, host_bucket.consume(size))
+        if job_bucket:
+            wait = max(wait, job_bucket.consume(size))
+        if wait > 0:
+            time.sleep(wait)
+
+
+# 创建全局带宽限制器
+bandwidth_limiter = BandwidthLimiter()
+
+# 所有下载器共用的文件类型检测器（python-magic 内部有锁，可以跨线程使用）
+mime_detector = magic.Magic(mime=True)
+
+
+class Segment:
+    """下载分段，[current, end] 为尚未下载的字节范围"""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.current = start
+        self.retries = 0
+        self.started_time = None
+        self.started_position = start
+        self.lock = threading.Lock()
+
+    @property
+    def remaining(self):
+        """剩余字节数"""
+        return self.end - self.current + 1
+
+    def speed(self):
+        """本次分配以来的下载速度（字节/秒）"""
+        elapsed = time.time() - (self.started_time or time.time())
+        downloaded = self.current - self.started_position
+        return downloaded / elapsed if elapsed > 0 else 0
+
+
+class SegmentScheduler:
+    """分段调度器
+
+    文件被划分为多个小分段放入共享队列，工作线程依次领取。队列为空时，
+    空闲线程从预计完成时间最长（剩余最多、速度最慢）的进行中分段切走后半段，
+    与 aria2 的分段策略相同。分段失败只重试该分段，并从已下载的位置继续。
+    """
+
+    def __init__(self, ranges, max_retries, min_split_size, alignment=1):
+        self.pending = collections.deque(Segment(start, end) for start, end in ranges)
+        self.active = set()
+        self.max_retries = max_retries
+        self.min_split_size = min_split_size
+        self.alignment = alignment
+        self.lock = threading.Lock()
+        self.error = None
+
+    def next_segment(self):
+        """领取下一个分段，没有可下载的内容时返回 None"""
+        with self.lock:
+            if self.error:
+                return None
+            segment = self.pending.popleft() if self.pending else self._split_slowest()
+            if segment is None:
+                return None
+            segment.started_time = time.time()
+            segment.started_position = segment.current
+            self.active.add(segment)
+            return segment
+
+    def _split_slowest(self):
+        """拆分预计完成时间最长的进行中分段，返回新分段"""
+        def eta(segment):
+            return segment.remaining / max(segment.speed(), 1)
+
+        candidates = [seg for seg in self.active if seg.remaining >= 2 * self.min_split_size]
+        if not candidates:
+            return None
+        slowest = max(candidates, key=eta)
+        with slowest.lock:
+            remaining = slowest.remaining
+            if remaining < 2 * self.min_split_size:
+                return None
+            middle = slowest.current + remaining // 2
+            aligned = middle - middle % self.alignment
+            if aligned - slowest.current >= self.min_split_size:
+                middle = aligned
+            new_segment = Segment(middle, slowest.end)
+            slowest.end = middle - 1
+        logging.info("拆分分段：%s-%s，新分段：%s-%s",
+                     format_size(slowest.current), format_size(slowest.end),
+                     format_size(new_segment.start), format_size(new_segment.end))
+        return new_segment
+
+    def remaining_ranges(self):
+        """所有尚未下载的字节范围（排队中和进行中的分段）"""
+        with self.lock:
+            segments = list(self.pending) + list(self.active)
+        ranges = []
+        for segment in segments:
+            with segment.lock:
+                if segment.remaining > 0:
+                    ranges.append((segment.current, segment.end))
+        return sorted(ranges)
+
+    def completed_offset(self, total_size):
+        """从文件开头起已经连续下载完成的字节数"""
+        ranges = self.remaining_ranges()
+        return ranges[0][0] if ranges else total_size
+
+    def finish(self, segment):
+        """标记分段完成"""
+        with self.lock:
+            self.active.discard(segment)
+
+    def fail(self, error):
+        """终止整个下载"""
+        with self.lock:
+            if self.error is None:
+                self.error = error
+
+    def retry(self, segment, error):
+        """分段失败后重新排队，超过重试次数则终止整个下载并返回 False"""
+        with self.lock:
+            self.active.discard(segment)
+            segment.retries += 1
+            if segment.retries > self.max_retries:
+                self.error = error
+                return False
+            self.pending.append(segment)
+            return True
+
+
+class ConcurrencyController:
+    """根据实测吞吐量调整下载线程数
+
+    从较少的线程开始，每个测量周期比较增加一个线程前后的吞吐量：
+    提升不低于 ADAPTIVE_MIN_GAIN 时保留并继续增加，否则撤回并稳定下来。
+    稳定后吞吐量明显下降（例如被服务器限流）时尝试减少一个线程，
+    吞吐量没有变差就保持较少的线程。
+    """
+
+    def __init__(self, initial, min_workers, max_workers, min_gain):
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.min_gain = min_gain
+        self.target = min(max(initial, min_workers), max_workers)
+        self.previous = None  # 上一次调整前的 (线程数, 吞吐量)
+        self.settled_throughput = None  # 稳定后的吞吐量，None 表示仍在向上探测
+        self.measurements = 0
+
+    def update(self, throughput):
+        """根据最近一个周期的吞吐量调整 target，返回新的线程数"""
+        self.measurements += 1
+        if self.previous is not None:
+            previous_target, previous_throughput = self.previous
+            self.previous = None
+            if self.target > previous_target:
+                if throughput >= previous_throughput * (1 + self.min_gain):
+                    self._step_up(throughput)
+                else:
+                    self._settle(previous_target, previous_throughput)
+            elif throughput >= previous_throughput * (1 - self.min_gain):
+                # 减少线程后吞吐量没有明显下降，保持较少的线程
+                self._settle(self.target, throughput)
+            else:
+                self._settle(previous_target, previous_throughput)
+        elif self.settled_throughput is None:
+            self._step_up(throughput)
+        elif throughput < self.settled_throughput * (1 - self.min_gain) and self.target > self.min_workers:
+            self.previous = (self.target, throughput)
+            self.target -= 1
+            logging.info("吞吐量下降到 %s/s，尝试减少到 %d 个线程", format_size(throughput), self.target)
+        return self.target
+
+    def _step_up(self, throughput):
+        if self.target < self.max_workers:
+            self.previous = (self.target, throughput)
+            self.target += 1
+        else:
+            self._settle(self.target, throughput)
+
+    def _settle(self, target, throughput):
+        if target != self.target or self.settled_throughput is None:
+            logging.info("线程数稳定在 %d 个，吞吐量 %s/s", target, format_size(throughput))
+        self.target = target
+        self.settled_throughput = throughput
+
+
+class HostConcurrency:
+    """记住每个主机上效果最好的线程数，下一个任务直接从这个值开始"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.best = {}
+
+    def max_workers(self, host):
+        """主机允许的最大线程数"""
+        return min(app.config['MAX_THREADS'], app.config['HOST_MAX_THREADS'].get(host, app.config['MAX_THREADS']))
+
+    def initial_workers(self, host):
+        with self.lock:
+            best = self.best.get(host)
+        return best or app.config['ADAPTIVE_INITIAL_THREADS']
+
+    def record(self, host, workers):
+        with self.lock:
+            self.best[host] = workers
+
+
+host_concurrency = HostConcurrency()
+
+
+class FileWriter:
+    """分段写入引擎
+
+    所有工作线程共享同一个文件描述符，用 os.pwrite 按偏移写入，不需要每个分段
+    各自打开文件和 seek。没有 pwrite 的平台（Windows）退回到加锁的 lseek + write。
+    写入不经过缓冲区，返回时数据已交给操作系统。
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.fd = os.open(file_path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+        self.use_pwrite = hasattr(os, 'pwrite')
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def create(file_path, total_size, preallocate=False):
+        """创建指定大小的文件，可选预分配磁盘空间"""
+        with open(file_path, 'wb') as f:
+            f.truncate(total_size)
+            if preallocate and hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, total_size)
+                except OSError as e:
+                    logging.warning("预分配磁盘空间失败：%s", e)
+
+    def write_at(self, data, offset):
+        """把 data 写入文件的 offset 位置"""
+        view = memoryview(data)
+        if self.use_pwrite:
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+            return
+        with self.lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            while view:
+                written = os.write(self.fd, view)
+                view = view[written:]
+
+    def close(self):
+        """关闭文件"""
+        os.close(self.fd)
+
+
+CHECKSUM_ALGORITHMS = ("md5", "sha1", "sha256", "sha512")
+CHECKSUM_LENGTHS = {32: "md5", 40: "sha1", 64: "sha256", 128: "sha512"}
+
+
+class StreamingHasher:
+    """按文件顺序计算哈希
+
+    顺序写入时直接用 update 传入写入的数据；分段乱序写入时，由 advance
+    从文件中按顺序读取已经连续下载完成的部分。下载过程中定期推进，
+    刚写入的数据通常还在页缓存中，不需要在下载结束后重新读取整个文件。
+    """
+
+    def __init__(self, algorithm):
+        self.algorithm = algorithm
+        self.hash = hashlib.new(algorithm)
+        self.offset = 0
+        self.file = None
+        self.buffer = None
+
+    def update(self, data):
+        self.hash.update(data)
+        self.offset += len(data)
+
+    def advance(self, file_path, end):
+        """从文件中读取 [offset, end) 并计算哈希"""
+        if end <= self.offset:
+            return
+        if self.file is None:
+            self.file = open(file_path, 'rb')
+            self.buffer = bytearray(app.config['DEDUP_HASH_BLOCK_SIZE'])
+        view = memoryview(self.buffer)
+        self.file.seek(self.offset)
+        while self.offset < end:
+            size = self.file.readinto(view[:min(len(view), end - self.offset)])
+            if not size:
+                raise IOError(f"读取文件失败：{file_path} 在 {self.offset} 处提前结束")
+            self.update(view[:size])
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+class ProgressTracker:
+    """下载进度统计
+
+    每个工作线程只累加属于自己的计数器，热路径上不加锁、不汇总、不格式化；
+    采样线程每隔 PROGRESS_UPDATE_INTERVAL 秒汇总一次并计算速度，
+    格式化只在查询进度时进行。
+    """
+
+    def __init__(self):
+        self.total_size = 0
+        self.base = 0
+        self.counters = [0]
+        self.segments = {}  # 每个线程当前正在下载的分段
+        self.samples = collections.deque()
+        self.downloaded = 0
+        self.speed = 0
+        self.stop_event = None
+        self.sampler = None
+
+    def reset(self, total_size, num_workers=1, already_downloaded=0):
+        """开始新的一轮下载"""
+        self.total_size = total_size
+        self.base = already_downloaded
+        self.counters = [0] * num_workers
+        self.segments = {}
+        self.samples.clear()
+        self.downloaded = already_downloaded
+        self.speed = 0
+
+    def add(self, worker_id, size):
+        """累加工作线程的下载字节数（每个计数器只有一个线程写入）"""
+        self.counters[worker_id] += size
+
+    def downloaded_now(self):
+        """当前已下载的字节数（不等待采样线程）"""
+        return self.base + sum(self.counters)
+
+    def sample(self):
+        """汇总计数器，根据最近约一秒的采样计算速度"""
+        now = time.time()
+        downloaded = self.base + sum(self.counters)
+        self.samples.append((now, downloaded))
+        while len(self.samples) > 2 and now - self.samples[0][0] > 1:
+            self.samples.popleft()
+        first_time, first_downloaded = self.samples[0]
+        if now > first_time:
+            self.speed = (downloaded - first_downloaded) / (now - first_time)
+        self.downloaded = downloaded
+
+    def _sample_loop(self, stop_event):
+        """采样线程"""
+        interval = app.config['PROGRESS_UPDATE_INTERVAL']
+        while not stop_event.wait(interval):
+            self.sample()
+
+    def start(self):
+        """启动采样线程"""
+        self.stop_event = threading.Event()
+        self.sampler = threading.Thread(target=self._sample_loop, args=(self.stop_event,), daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        """停止采样线程并做最后一次汇总"""
+        if self.sampler:
+            self.stop_event.set()
+            self.sampler.join()
+            self.sampler = None
+        self.sample()
+
+    def to_dict(self):
+        """格式化当前进度"""
+        downloaded, total_size, speed = self.downloaded, self.total_size, self.speed
+        remaining_size = total_size - downloaded
+        if remaining_size <= 0:
+            eta = format_time(0)
+        else:
+            eta = format_time(remaining_size / speed) if speed > 0 else '计算中...'
+
+        # 计算每个线程的进度
+        thread_progress = []
+        for worker_id, segment in sorted(self.segments.items()):
+            chunk_start, chunk_end = segment.start, segment.end
+            chunk_downloaded = segment.current - segment.start
+            chunk_total = chunk_end - chunk_start + 1
+            chunk_percentage = 0
+            if chunk_total > 0:
+                chunk_percentage = (chunk_downloaded / chunk_total) * 100
+            thread_progress.append({
+                'thread_id': worker_id + 1,
+                'percentage': chunk_percentage,
+                'downloaded': format_size(chunk_downloaded),
+                'total': format_size(chunk_total),
+                'range': f"{format_size(chunk_start)}-{format_size(chunk_end)}"
+            })
+
+        return {
+            'percentage': (downloaded / total_size) * 100 if total_size > 0 else 0,
+            'downloaded': format_size(downloaded),
+            'total': format_size(total_size),
+            'speed': format_size(speed) + '/s',
+            'eta': eta,
+            'threads': thread_progress
+        }
+
+
+class ResumeJournal:
+    """断点续传控制文件
+
+    保存在下载目录中，以URL的哈希命名。记录URL、文件名、文件大小、
+    ETag/Last-Modified 以及按 RESUME_BLOCK_SIZE 划分的完成位图。
+    同一URL同时有多个下载时，只有第一个使用控制文件，其余的不续传也不保存进度，
+    避免写入同一个文件。
+    """
+
+    active = set()  # 正在使用的控制文件
+    active_lock = threading.Lock()
+
+    def __init__(self, save_path, url):
+        url_hash = hashlib.md5(url.encode('utf-8')).hexdigest()
+        self.path = os.path.join(save_path, f".{url_hash}.miaobox")
+        self.url = url
+        with self.active_lock:
+            self.owned = self.path not in self.active
+            if self.owned:
+                self.active.add(self.path)
+
+    def release(self):
+        """下载结束后释放控制文件"""
+        with self.active_lock:
+            if self.owned:
+                self.active.discard(self.path)
+                self.owned = False
+
+    def load(self):
+        """读取控制文件，不存在或损坏时返回 None"""
+        if not self.owned:
+            return None
+        try:
+            if not os.path.exists(self.path):
+                return None
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            return state if state.get('url') == self.url else None
+        except Exception as e:
+            logging.error("读取断点续传文件失败：%s", e)
+            return None
+
+    def save(self, file_name, info, remaining_ranges):
+        """写入控制文件（先写临时文件再替换，避免写到一半时崩溃）"""
+        if not self.owned:
+            return
+        block_size = app.config['RESUME_BLOCK_SIZE']
+        state = {
+            'url': self.url,
+            'file_name': file_name,
+            'total_size': info.total_size,
+            'etag': info.headers.get('ETag'),
+            'last_modified': info.headers.get('Last-Modified'),
+            'block_size': block_size,
+            'bitmap': self.build_bitmap(info.total_size, block_size, remaining_ranges),
+            'updated_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logging.error("保存断点续传文件失败：%s", e)
+
+    @staticmethod
+    def validator(state):
+        """控制文件中可用于 If-Range 的校验值，规则与 RemoteFileInfo.validator 相同"""
+        etag = state.get('etag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return state.get('last_modified')
+
+    def remove(self):
+        """删除控制文件"""
+        if not self.owned:
+            return
+        try:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        except Exception as e:
+            logging.error("删除断点续传文件失败：%s", e)
+
+    @staticmethod
+    def build_bitmap(total_size, block_size, remaining_ranges):
+        """生成完成位图（十六进制字符串），块内没有剩余字节时该位为 1"""
+        num_blocks = (total_size + block_size - 1) // block_size
+        bitmap = bytearray(b'\xff' * ((num_blocks + 7) // 8))
+        for start, end in remaining_ranges:
+            for block in range(start // block_size, end // block_size + 1):
+                bitmap[block // 8] &= ~(1 << (block % 8)) & 0xff
+        return bitmap.hex()
+
+    @staticmethod
+    def missing_ranges(state):
+        """根据完成位图计算需要重新下载的字节范围"""
+        total_size = state['total_size']
+        block_size = state['block_size']
+        bitmap = bytes.fromhex(state['bitmap'])
+        num_blocks = (total_size + block_size - 1) // block_size
+        ranges = []
+        for block in range(num_blocks):
+            if bitmap[block // 8] & (1 << (block % 8)):
+                continue
+            start = block * block_size
+            end = min(start + block_size, total_size) - 1
+            if ranges and ranges[-1][1] == start - 1:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+
 
 class Downloader:
     """下载器类"""
 
-    def __init__(self, url, save_path=None, max_retries=3, user_agent=None):
+    def __init__(self, url, save_path=None, max_retries=3, user_agent=None, mirrors=None,
+                 checksum=None, checksum_url=None):
         self.url = url
         self.save_path = os.path.abspath(save_path or app.config["SAVE_PATH"])
         if not os.path.exists(self.save_path):
@@ -93,15 +1070,25 @@ class Downloader:
         self.max_retries = max_retries
         self.cancelled = False
         self.user_agent = user_agent or app.config["USER_AGENT"]
-        self.mime = magic.Magic(mime=True)
+        self.mime = mime_detector
         # 初始化进度相关变量
-        self.last_update_time = time.time()
-        self.last_downloaded_size = 0
-        self.downloaded_chunks = {}
-        self.chunk_ranges = {}  # 存储每个线程的下载范围
         self.total_size = 0
-        self.chunk_locks = {}
-        self.progress_lock = threading.Lock()
+        self.progress_tracker = ProgressTracker()
+        self.host = urlparse(url).hostname
+        self.rate_bucket = TokenBucket()
+        self.remote_info = None
+        # 同一文件的所有下载地址，第一个是 url；历史记录、去重和断点续传都以 url 为准
+        self.mirrors = MirrorSet([url] + [mirror for mirror in mirrors or [] if mirror != url],
+                                 app.config['MIRROR_MAX_FAILURES'])
+        # 期望的校验值 (算法, 十六进制值)，也可以从 checksum_url（例如 .sha256 文件）获取
+        self.expected_checksum = parse_checksum(checksum) if checksum else None
+        self.checksum_url = checksum_url
+        self.hasher = None
+
+    @property
+    def progress(self):
+        """当前下载进度（查询时才格式化）"""
+        return self.progress_tracker.to_dict()
 
     def is_safe_path(self, path):
         """验证保存路径的安全性"""
@@ -114,20 +1101,36 @@ class Downloader:
 
     def is_allowed_file_type(self, file_content):
         """检查文件类型是否允许下载"""
+        allowed_types = app.config.get('ALLOWED_MIME_TYPES')
+        if allowed_types is None:
+            return True
         try:
             mime_type = self.mime.from_buffer(file_content[:2048])
-            return mime_type in app.config['ALLOWED_MIME_TYPES']
+            return mime_type in allowed_types
         except (magic.MagicException, KeyError) as e:
             logging.error("文件类型检查失败: %s", e)
             return False
 
     def generate_safe_filename(self, original_name, content):
-        """生成安全的文件名，包含内容哈希"""
+        """生成安全的文件名，包含内容哈希
+
+        同一秒内下载同一个文件时名称会相同，因此用 O_EXCL 创建空文件占用
+        名称，已存在时加上序号，调用方随后覆盖写入这个空文件。
+        """
         name, ext = os.path.splitext(original_name)
         content_hash = hashlib.md5(content[:8192]).hexdigest()[:8]
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        safe_name = sanitize_filename(f"{name}_{timestamp}_{content_hash}{ext}")
-        return safe_name
+        for number in itertools.count():
+            suffix = f"_{number}" if number else ""
+            safe_name = sanitize_filename(f"{name}_{timestamp}_{content_hash}{suffix}{ext}")
+            file_path = os.path.join(self.save_path, safe_name)
+            if not self.is_safe_path(file_path):
+                return safe_name
+            try:
+                os.close(os.open(file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+                return safe_name
+            except FileExistsError:
+                continue
 
     def extract_filename(self, response, default_name="downloaded_file"):
         """从响应头中提取文件名"""
@@ -154,170 +1157,555 @@ class Downloader:
                     else os.path.basename(url.split('?')[0]))
         return self.sanitize_filename(filename)
 
-    def download_chunk(self, start, end, chunk_id, file_path):
-        """下载指定范围的文件块"""
-        if self.cancelled:
-            return
+    def url_filename(self):
+        """从URL路径中获取默认文件名"""
+        return os.path.basename(urlparse(self.url).path) or "downloaded_file"
 
+    def read_sample(self, chunks, size):
+        """从数据块迭代器中读取前 size 个字节，返回样本和多读出的部分"""
+        sample = bytearray()
+        for chunk in chunks:
+            sample.extend(chunk)
+            if len(sample) >= size:
+                break
+        return bytes(sample[:size]), bytes(sample[size:])
+
+    def read_blocks(self, response, block_size, limit=None):
+        """按块读取响应内容
+
+        响应未压缩时直接 readinto 到预先分配的缓冲区，每次返回同一缓冲区的
+        memoryview（下一次迭代前有效）；压缩响应需要解码，退回到 iter_content。
+        limit 为可选的回调，返回本次最多还能读取的字节数。
+        """
+        encoding = response.headers.get('Content-Encoding', 'identity').lower()
+        if encoding != 'identity':
+            yield from response.iter_content(chunk_size=block_size)
+            return
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
+        while True:
+            size = block_size if limit is None else min(block_size, limit())
+            if size <= 0:
+                return
+            # 与 iter_content 一致，把 urllib3 的异常转换为 requests 的异常
+            try:
+                size = response.raw.readinto(view[:size])
+            except ProtocolError as e:
+                raise requests.exceptions.ChunkedEncodingError(e) from e
+            except ReadTimeoutError as e:
+                raise requests.exceptions.ConnectionError(e) from e
+            if not size:
+                return
+            yield view[:size]
+
+    def probe(self, if_range=None, url=None):
+        """发送一次小范围请求，探测文件名、大小、范围请求支持和内容样本
+
+        url 为镜像地址时只返回探测结果，不更新 remote_info。
+        """
+        mirror_url = url
+        url = url or self.url
+        host = urlparse(url).hostname
+        probe_size = app.config['PROBE_SIZE']
         headers = {
             "User-Agent": self.user_agent,
-            "Range": f"bytes={start}-{end}"
+            "Range": f"bytes=0-{probe_size - 1}",
+            "Accept-Encoding": "identity"
         }
-
+        if if_range:
+            headers["If-Range"] = if_range
+        session = http_sessions.get(url)
+        request_start = time.perf_counter()
+        response = session.get(url,
+                               stream=True,
+                               headers=headers,
+                               timeout=app.config['DOWNLOAD_TIMEOUT'])
+        body = info = None
         try:
-            response = requests.get(self.url, headers=headers, stream=True, timeout=app.config['DOWNLOAD_TIMEOUT'])
+            metrics.ttfb.observe(time.perf_counter() - request_start, host)
+            if response.status_code == 416 and response.headers.get('Content-Range', '').strip() == 'bytes */0':
+                # 空文件无法满足任何范围请求，按不支持范围请求的空文件处理，由单线程下载完整请求
+                info = RemoteFileInfo(self.extract_filename(response, self.url_filename()), 0, False, b'',
+                                      response.headers)
+                if mirror_url is None:
+                    self.remote_info = info
+                return info
             response.raise_for_status()
+            accept_ranges = response.status_code == 206
+            if accept_ranges:
+                # 范围响应最多 probe_size 字节，完整读取后连接可以放回连接池
+                sample = response.content[:probe_size]
+                received = len(sample)
+            else:
+                chunks = self.read_blocks(response, app.config['IO_BLOCK_SIZE'])
+                sample, remainder = self.read_sample(chunks, probe_size)
+                received = len(sample) + len(remainder)
+                if mirror_url is None:
+                    # 服务器返回了完整内容，留给单线程下载继续读取
+                    body = (response, remainder, chunks)
+            metrics.bytes_downloaded.inc(host, amount=received)
+
+            total_size = int(response.headers.get('content-length', 0))
+            content_range = response.headers.get('Content-Range', '')
+            if accept_ranges and '/' in content_range:
+                total = content_range.rsplit('/', 1)[1]
+                total_size = int(total) if total.isdigit() else 0
+
+            info = RemoteFileInfo(
+                filename=self.extract_filename(response, self.url_filename()),
+                total_size=total_size,
+                accept_ranges=accept_ranges,
+                sample=sample,
+                headers=response.headers,
+                body=body
+            )
+        finally:
+            if info is None or info.body is None:
+                response.close()
+        if mirror_url is None:
+            self.remote_info = info
+        return info
+
+    def verify_mirrors(self, info):
+        """探测各镜像，大小、ETag 或内容开头与主地址不一致的镜像不参与下载"""
+        etag = info.headers.get('ETag')
+        for mirror in self.mirrors.mirrors[1:]:
+            try:
+                mirror_info = self.retry(lambda: self.probe(url=mirror.url))
+            except requests.RequestException as e:
+                self.mirrors.disable(mirror, f"探测失败（{e}）")
+                continue
+            mirror_etag = mirror_info.headers.get('ETag')
+            if not mirror_info.accept_ranges:
+                reason = "不支持范围请求"
+            elif mirror_info.total_size != info.total_size:
+                reason = f"文件大小不一致（{mirror_info.total_size} != {info.total_size}）"
+            elif etag and mirror_etag and etag != mirror_etag:
+                reason = f"ETag 不一致（{mirror_etag} != {etag}）"
+            elif mirror_info.sample != info.sample:
+                reason = "文件内容不一致"
+            else:
+                mirror.validator = mirror_info.validator
+                continue
+            self.mirrors.disable(mirror, reason)
+        logging.info("使用 %d 个镜像下载：%s", len(self.mirrors.enabled()),
+                     ", ".join(mirror.host for mirror in self.mirrors.enabled()))
+
+    def plan_chunks(self, info, missing_ranges, num_workers):
+        """根据探测结果把待下载的字节范围划分为初始分段"""
+        segment_size = info.total_size // (num_workers * app.config['SEGMENTS_PER_THREAD'])
+        segment_size = min(max(segment_size, app.config['MIN_CHUNK_SIZE']), app.config['MAX_SEGMENT_SIZE'])
+        # 分段边界对齐到续传位图的块，中断时进行中的分段最多只损失一个块
+        block_size = app.config['RESUME_BLOCK_SIZE']
+        segment_size = max(segment_size // block_size, 1) * block_size
+        ranges = []
+        for start, end in missing_ranges:
+            while start <= end:
+                boundary = (start // segment_size + 1) * segment_size
+                ranges.append((start, min(boundary, end + 1) - 1))
+                start = boundary
+        return ranges
+
+    def can_resume(self, state, info, file_path):
+        """检查控制文件记录的下载是否可以继续"""
+        if not state or not info.accept_ranges or not info.validator:
+            return False
+        if state.get('total_size') != info.total_size:
+            return False
+        if info.validator not in (state.get('etag'), state.get('last_modified')):
+            return False
+        return os.path.exists(file_path) and os.path.getsize(file_path) == info.total_size
+
+    def flush_journal(self, journal, file_name, info, scheduler, stop_event):
+        """定期把未完成的范围写入断点续传控制文件"""
+        while not stop_event.wait(app.config['RESUME_FLUSH_INTERVAL']):
+            journal.save(file_name, info, scheduler.remaining_ranges())
+
+    def download_worker(self, worker_id, scheduler, writer, controller=None):
+        """工作线程：不断领取分段下载，直到没有剩余分段或线程数被调低"""
+        while not self.cancelled:
+            if controller and worker_id >= controller.target:
+                self.progress_tracker.segments.pop(worker_id, None)
+                return
+            segment = scheduler.next_segment()
+            if segment is None:
+                return
+            self.progress_tracker.segments[worker_id] = segment
+            # 每个分段请求选择一个镜像，失败计入该镜像所在的主机
+            mirror = self.mirrors.acquire()
+            try:
+                self.download_chunk(segment, worker_id, writer, mirror)
+                scheduler.finish(segment)
+            except requests.RequestException as e:
+                metrics.segment_retries.inc(mirror.host)
+                logging.error("分段 %s-%s 从 %s 下载失败（第 %d 次重试）：%s",
+                              format_size(segment.current), format_size(segment.end), mirror.host,
+                              segment.retries + 1, e)
+                if not scheduler.retry(segment, e):
+                    return
+                time.sleep(min(segment.retries, 5))
+            except Exception as e:
+                logging.error("分段 %s-%s 下载出错：%s",
+                              format_size(segment.current), format_size(segment.end), e)
+                scheduler.fail(e)
+                return
 
-            with self.chunk_locks[chunk_id]:
-                with open(file_path, 'rb+') as f:
-                    f.seek(start)
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if self.cancelled:
-                            return
-                        if chunk:
-                            f.write(chunk)
-                            with self.progress_lock:
-                                current_size = self.downloaded_chunks.get(chunk_id, 0)
-                                self.downloaded_chunks[chunk_id] = current_size + len(chunk)
-                                total_downloaded = sum(self.downloaded_chunks.values())
-                                self.update_progress(total_downloaded, self.total_size)
+    def download_chunk(self, segment, worker_id, writer, mirror):
+        """从 mirror 下载一个分段，从 segment.current 继续直到 segment.end（可能被拆分缩短）
 
-        except Exception as e:
-            logging.error("下载块 %d 失败: %s", chunk_id, e)
-            raise
+        无论成功与否都会释放 mirror。
+        """
+        headers = {
+            "User-Agent": self.user_agent,
+            "Range": f"bytes={segment.current}-{segment.end}",
+            "Accept-Encoding": "identity"
+        }
+        if mirror.validator:
+            headers["If-Range"] = mirror.validator
 
-    def update_progress(self, downloaded_size, total_size):
-        """更新下载进度"""
+        session = http_sessions.get(mirror.url)
+        request_start = time.perf_counter()
+        received = 0
+        error = None
         try:
-            progress_percentage = (downloaded_size / total_size) * 100 if total_size > 0 else 0
+            with session.get(mirror.url, headers=headers, stream=True,
+                             timeout=app.config['DOWNLOAD_TIMEOUT']) as response:
+                metrics.ttfb.observe(time.perf_counter() - request_start, mirror.host)
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise requests.RequestException("服务器未返回分段内容")
 
-            # 计算下载速度
-            current_time = time.time()
-            if hasattr(self, 'last_update_time') and hasattr(self, 'last_downloaded_size'):
-                time_diff = current_time - self.last_update_time
-                size_diff = downloaded_size - self.last_downloaded_size
-                speed = size_diff / time_diff if time_diff > 0 else 0
-
-                # 计算剩余时间
-                remaining_size = total_size - downloaded_size
-                eta = remaining_size / speed if speed > 0 else 0
-
-                # 计算每个线程的进度
-                thread_progress = []
-                for chunk_id in sorted(self.downloaded_chunks.keys()):
-                    chunk_downloaded = self.downloaded_chunks.get(chunk_id, 0)
-                    chunk_start, chunk_end = self.chunk_ranges.get(chunk_id, (0, 0))
-                    chunk_total = chunk_end - chunk_start + 1
-                    chunk_percentage = 0
-                    if chunk_total > 0:
-                        chunk_percentage = (chunk_downloaded / chunk_total) * 100
-                    thread_progress.append({
-                        'thread_id': chunk_id + 1,
-                        'percentage': chunk_percentage,
-                        'downloaded': format_size(chunk_downloaded),
-                        'total': format_size(chunk_total),
-                        'range': f"{format_size(chunk_start)}-{format_size(chunk_end)}"
-                    })
+                blocks = self.read_blocks(response, app.config['IO_BLOCK_SIZE'], lambda: segment.remaining)
+                for block in blocks:
+                    if self.cancelled:
+                        return
+                    # 持锁写入，避免写入过程中分段被拆分导致越界
+                    with segment.lock:
+                        size = min(len(block), segment.remaining)
+                        writer.write_at(block[:size], segment.current)
+                        segment.current += size
+                        finished = segment.remaining <= 0
+                    received += size
+                    self.progress_tracker.add(worker_id, size)
+                    metrics.bytes_downloaded.inc(mirror.host, amount=size)
+                    bandwidth_limiter.acquire(size, mirror.host, self.rate_bucket)
+                    if finished:
+                        return
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - request_start
+            metrics.observe_transfer(mirror.host, received, elapsed)
+            self.mirrors.release(mirror, received, elapsed, error)
+
+        if segment.remaining > 0:
+            raise requests.RequestException("分段数据不完整")
+
+    def find_duplicate(self, info):
+        """查找与远程文件相同的已下载文件，找到时返回本次下载的文件名，否则返回 None
+
+        同一目录中已有相同文件时直接复用；在其他目录中时硬链接过来，
+        无法硬链接（例如跨文件系统）时在本地复制，都不需要重新下载。
+        """
+        if not app.config['DEDUP_ENABLED'] or not info.validator or info.total_size <= 0:
+            return None
+        existing = dedup_index.lookup(self.url, info.validator, info.total_size)
+        if existing is None:
+            return None
+        if self.expected_checksum and file_hash(existing, self.expected_checksum[0]) != self.expected_checksum[1]:
+            logging.info("已下载的文件与期望的校验值不一致，重新下载：%s", existing)
+            return None
+
+        if os.path.dirname(existing) == self.save_path:
+            file_path = existing
+        else:
+            file_path = os.path.join(self.save_path, self.generate_safe_filename(info.filename, info.sample))
+            if not self.is_safe_path(file_path):
+                raise ValueError("不安全的文件路径")
+            try:
+                # 文件名已被占用，先链接到临时名称再替换
+                os.link(existing, file_path + ".link")
+                os.replace(file_path + ".link", file_path)
+            except OSError:
+                shutil.copyfile(existing, file_path)
+            dedup_index.add(self.url, info.validator, info.total_size, file_path)
+
+        self.progress_tracker.reset(info.total_size, already_downloaded=info.total_size)
+        logging.info("文件未变化，复用已下载的文件：%s", existing)
+        download_history.add_record(self.url, file_path, status="deduplicated")
+        return os.path.basename(file_path)
+
+    def resolve_checksum(self, filename):
+        """从 checksum_url 获取 filename 的期望校验值
+
+        支持 sha256sum 等工具生成的 "<hex>  文件名" 格式（可以包含多个文件），
+        算法由扩展名或长度判断。
+        """
+        if self.expected_checksum or not self.checksum_url:
+            return
+        session = http_sessions.get(self.checksum_url)
+        response = self.retry(lambda: session.get(
+            self.checksum_url,
+            headers={"User-Agent": self.user_agent},
+            timeout=app.config['DOWNLOAD_TIMEOUT']
+        ))
+        response.raise_for_status()
+        extension = os.path.splitext(urlparse(self.checksum_url).path)[1].lstrip('.').lower()
+        names = {filename, requests.utils.unquote(os.path.basename(urlparse(self.url).path))}
+        self.expected_checksum = parse_checksum(
+            find_checksum_entry(response.text, names), extension if extension in CHECKSUM_ALGORITHMS else None
+        )
+
+    def create_hasher(self):
+        """需要校验或计算内容哈希时，创建边下载边计算的哈希"""
+        if self.expected_checksum:
+            self.hasher = StreamingHasher(self.expected_checksum[0])
+        elif app.config['DEDUP_ENABLED'] and app.config['DEDUP_HASH']:
+            self.hasher = StreamingHasher("sha256")
+        else:
+            self.hasher = None
+        return self.hasher
+
+    def verify_checksum(self, file_path):
+        """检查下载结果的哈希，返回 (记录用的校验值, 是否经过校验)，不一致时抛出异常"""
+        if self.hasher is None:
+            return None, None
+        self.hasher.close()
+        digest = self.hasher.hexdigest()
+        checksum = f"{self.hasher.algorithm}:{digest}"
+        if self.expected_checksum is None:
+            return checksum, None
+        if digest != self.expected_checksum[1]:
+            logging.error("文件校验失败：%s，期望 %s:%s，实际 %s", file_path,
+                          self.expected_checksum[0], self.expected_checksum[1], checksum)
+            download_history.add_record(self.url, file_path, status="checksum_failed",
+                                        checksum=checksum, checksum_verified=False)
+            raise ValueError(f"文件校验失败：期望 {self.expected_checksum[0]}:{self.expected_checksum[1]}")
+        logging.info("文件校验通过：%s", checksum)
+        return checksum, True
+
+    def record_download(self, file_path, validator):
+        """校验下载完成的文件，写入历史记录和去重索引"""
+        checksum, verified = self.verify_checksum(file_path)
+        download_history.add_record(self.url, file_path, checksum=checksum, checksum_verified=verified)
+        if not app.config['DEDUP_ENABLED']:
+            return
+        size = os.path.getsize(file_path)
+        sha256 = None
+        if app.config['DEDUP_HASH']:
+            # 边下载边计算的哈希是 sha256 时直接使用，不再重新读取文件
+            sha256 = checksum.split(':', 1)[1] if checksum and checksum.startswith("sha256:") else file_hash(file_path)
+            existing = dedup_index.find_by_hash(sha256, size)
+            if existing and not os.path.samefile(existing, file_path):
+                # 内容相同的文件已存在，用硬链接替换新文件以节省磁盘空间
+                temp_path = file_path + ".link"
+                try:
+                    os.link(existing, temp_path)
+                    os.replace(temp_path, file_path)
+                    logging.info("内容与 %s 相同，已改为硬链接：%s", existing, file_path)
+                except OSError as e:
+                    logging.warning("创建硬链接失败：%s", e)
+        if validator or sha256:
+            dedup_index.add(self.url, validator, size, file_path, sha256)
+
+    def hash_completed(self, file_path, scheduler, stop_event):
+        """定期对已经连续下载完成的部分计算哈希"""
+        while not stop_event.wait(app.config['PROGRESS_UPDATE_INTERVAL'] * 5):
+            self.hasher.advance(file_path, scheduler.completed_offset(self.total_size))
+
+    def run_workers(self, scheduler, writer, num_workers, max_workers, num_ranges):
+        """启动下载线程并等待全部完成
+
+        开启 ADAPTIVE_THREADS 时从 num_workers（该主机上次效果最好的线程数或
+        ADAPTIVE_INITIAL_THREADS）开始，每个 ADAPTIVE_INTERVAL 周期根据吞吐量
+        增减线程，结束后记住稳定的线程数。
+        """
+        controller = None
+        if app.config['ADAPTIVE_THREADS']:
+            controller = ConcurrencyController(num_workers, 1, max_workers, app.config['ADAPTIVE_MIN_GAIN'])
+
+        threads = {}
+
+        def start_workers(count):
+            for worker_id in range(count):
+                if worker_id not in threads or not threads[worker_id].is_alive():
+                    thread = threading.Thread(
+                        target=self.download_worker,
+                        args=(worker_id, scheduler, writer, controller)
+                    )
+                    threads[worker_id] = thread
+                    thread.start()
+
+        start_workers(num_workers)
+        logging.info("启动 %d 个线程，共 %d 个分段", num_workers, num_ranges)
+
+        interval = app.config['ADAPTIVE_INTERVAL']
+        last_time, last_bytes = time.time(), self.progress_tracker.downloaded_now()
+        while True:
+            deadline = time.time() + interval
+            for thread in list(threads.values()):
+                thread.join(max(0, deadline - time.time()))
+            if not any(thread.is_alive() for thread in threads.values()):
+                break
+            if controller is None or self.cancelled:
+                continue
 
-                # 更新进度信息
-                with app.app_context():
-                    app.config['PROGRESS'] = {
-                        'percentage': progress_percentage,
-                        'downloaded': format_size(downloaded_size),
-                        'total': format_size(total_size),
-                        'speed': format_size(speed) + '/s',
-                        'eta': format_time(eta),
-                        'threads': thread_progress
-                    }
-
-            # 保存当前状态用于下次计算
-            self.last_update_time = current_time
-            self.last_downloaded_size = downloaded_size
+            now, downloaded = time.time(), self.progress_tracker.downloaded_now()
+            throughput = (downloaded - last_bytes) / max(now - last_time, 1e-6)
+            last_time, last_bytes = now, downloaded
+            previous_target = controller.target
+            target = controller.update(throughput)
+            if target > previous_target:
+                logging.info("吞吐量 %s/s，增加到 %d 个线程", format_size(throughput), target)
+                start_workers(target)
 
-        except Exception as e:
-            logging.error("更新进度时出错：%s", e)
+        if controller and controller.measurements >= 2 and not self.cancelled:
+            host_concurrency.record(self.host, controller.target)
 
     def download(self):
-        """使用多线程下载文件"""
-        headers = {"User-Agent": self.user_agent}
+        """使用多线程下载文件，支持断点续传"""
+        info = journal = None
         try:
-            # 发送HEAD请求获取文件大小
-            response = requests.head(
-                self.url,
-                headers=headers,
-                timeout=app.config['DOWNLOAD_TIMEOUT']
-            )
-            response.raise_for_status()
-            self.total_size = int(response.headers.get('content-length', 0))
+            # 同一URL存在未完成的下载时，用 If-Range 校验远程文件是否变化
+            journal = ResumeJournal(self.save_path, self.url)
+            state = journal.load()
+            if_range = ResumeJournal.validator(state) if state else None
+            if state and not if_range:
+                # 只有弱 ETag 且没有 Last-Modified，无法用 If-Range 确认远程文件未变化，重新下载
+                journal.remove()
+                state = None
+
+            # 一次小范围请求获取文件名、大小、范围支持和内容样本
+            info = self.retry(lambda: self.probe(if_range))
+            if if_range and not info.accept_ranges:
+                # 远程文件已变化，服务器返回了完整内容，重新探测
+                info.close()
+                info = self.retry(self.probe)
+            self.total_size = info.total_size
+            # 分段请求携带 If-Range，远程文件变化时服务器会返回完整内容
+            self.mirrors.primary.validator = info.validator
+
+            if not self.is_allowed_file_type(info.sample):
+                raise ValueError("不允许下载的文件类型")
+            self.resolve_checksum(info.filename)
+
+            duplicate = self.find_duplicate(info)
+            if duplicate is not None:
+                return duplicate
 
             # 检查文件大小和是否支持范围请求
             is_small_file = self.total_size < app.config['MIN_CHUNK_SIZE']
-            no_range_support = 'accept-ranges' not in response.headers
-            if is_small_file or no_range_support:
-                return self.single_thread_download()
-
-            # 计算分块大小和线程数
-            min_chunk = app.config['MIN_CHUNK_SIZE']
-            max_threads = app.config['MAX_THREADS']
-            chunk_size = max(self.total_size // max_threads, min_chunk)
-            num_chunks = min(max_threads, self.total_size // chunk_size)
-
-            # 生成安全的文件名
-            kwargs = {
-                'url': self.url,
-                'stream': True,
-                'headers': headers,
-                'timeout': app.config['DOWNLOAD_TIMEOUT']
-            }
-            with requests.get(**kwargs) as response:
-                response.raise_for_status()
+            if (is_small_file or not info.accept_ranges) and not info.is_complete:
+                journal.remove()
+                return self.retry(lambda: self.single_thread_download(info))
 
-            original_filename = self.extract_filename(response)
-            content_sample = response.content[:8192]
-            safe_filename = self.generate_safe_filename(
-                original_filename,
-                content_sample
+            resumed = bool(state) and self.can_resume(
+                state, info, os.path.join(self.save_path, state.get('file_name', ''))
             )
-            file_path = os.path.join(self.save_path, safe_filename)
+            if resumed:
+                safe_filename = state['file_name']
+                file_path = os.path.join(self.save_path, safe_filename)
+                missing_ranges = ResumeJournal.missing_ranges(state)
+                logging.info("继续未完成的下载：%s", file_path)
+            else:
+                if state:
+                    journal.remove()
+                    logging.info("远程文件已变化或本地文件不完整，重新下载：%s", self.url)
+                # 生成安全的文件名
+                safe_filename = self.generate_safe_filename(info.filename, info.sample)
+                file_path = os.path.join(self.save_path, safe_filename)
+                missing_ranges = [(len(info.sample), self.total_size - 1)]
 
             if not self.is_safe_path(file_path):
                 raise ValueError("不安全的文件路径")
 
-            # 创建空文件
-            with open(file_path, 'wb') as f:
-                f.truncate(self.total_size)
+            # 探测样本已包含整个文件，直接写入
+            if info.is_complete:
+                with open(file_path, 'wb') as f:
+                    f.write(info.sample[:self.total_size])
+                if self.create_hasher():
+                    self.hasher.update(info.sample[:self.total_size])
+                self.progress_tracker.reset(self.total_size, already_downloaded=self.total_size)
+                logging.info("下载完成：%s", file_path)
+                self.record_download(file_path, info.validator)
+                return safe_filename
+
+            if not resumed:
+                FileWriter.create(file_path, self.total_size, app.config['IO_PREALLOCATE'])
+            writer = FileWriter(file_path)
+            if not resumed:
+                # 探测样本就是文件开头，直接写入
+                writer.write_at(info.sample, 0)
+
+            if len(self.mirrors.mirrors) > 1:
+                self.verify_mirrors(info)
+
+            # 自适应时按该主机的初始线程数划分分段，之后增加的线程通过拆分分段获得任务
+            max_workers = min(app.config['MAX_THREADS'], sum(
+                host_concurrency.max_workers(mirror.host) for mirror in self.mirrors.enabled()
+            ))
+            num_workers = max_workers
+            if app.config['ADAPTIVE_THREADS']:
+                num_workers = min(host_concurrency.initial_workers(self.host), max_workers)
+            ranges = self.plan_chunks(info, missing_ranges, num_workers)
+            num_workers = min(num_workers, len(ranges))
+            scheduler = SegmentScheduler(ranges, self.max_retries, app.config['MIN_SPLIT_SIZE'],
+                                         app.config['RESUME_BLOCK_SIZE'])
+            journal.save(safe_filename, info, scheduler.remaining_ranges())
 
             # 初始化进度追踪
-            self.downloaded_chunks = {}
-            self.chunk_locks = {i: threading.Lock() for i in range(num_chunks)}
-            self.chunk_ranges = {}
-
-            # 创建并启动下载线程
-            threads = []
-            for i in range(num_chunks):
-                start = i * chunk_size
-                end = start + chunk_size - 1 if i < num_chunks - 1 else self.total_size - 1
-                self.chunk_ranges[i] = (start, end)  # 记录每个线程的下载范围
-                thread = threading.Thread(
-                    target=self.download_chunk,
-                    args=(start, end, i, file_path)
+            already_downloaded = self.total_size - sum(end - start + 1 for start, end in ranges)
+            self.progress_tracker.reset(self.total_size, max_workers, already_downloaded)
+            self.progress_tracker.start()
+
+            # 创建并启动下载线程和控制文件写入线程
+            stop_flush = threading.Event()
+            flusher = threading.Thread(
+                target=self.flush_journal,
+                args=(journal, safe_filename, info, scheduler, stop_flush),
+                daemon=True
+            )
+            flusher.start()
+            hashing = None
+            if self.create_hasher():
+                hashing = threading.Thread(
+                    target=self.hash_completed,
+                    args=(file_path, scheduler, stop_flush),
+                    daemon=True
                 )
-                threads.append(thread)
-                thread.start()
-                logging.info("启动线程 %d/%d，下载范围：%s-%s",
-                             i+1, num_chunks, format_size(start), format_size(end))
+                hashing.start()
 
             # 等待所有线程完成
-            for thread in threads:
-                thread.join()
+            try:
+                self.run_workers(scheduler, writer, num_workers, max_workers, len(ranges))
+            finally:
+                stop_flush.set()
+                flusher.join()
+                if hashing:
+                    hashing.join()
+                self.progress_tracker.stop()
+                writer.close()
 
             if self.cancelled:
+                journal.remove()
                 if os.path.exists(file_path):
                     os.remove(file_path)
                 return None
 
+            if scheduler.error is not None:
+                journal.save(safe_filename, info, scheduler.remaining_ranges())
+                raise scheduler.error
+            if scheduler.remaining_ranges():
+                journal.save(safe_filename, info, scheduler.remaining_ranges())
+                raise RuntimeError("下载未完成，部分分段没有下载")
+
+            journal.remove()
+            if self.hasher:
+                # 只剩最后还没有计算哈希的部分
+                self.hasher.advance(file_path, self.total_size)
             logging.info("下载完成：%s", file_path)
-            download_history.add_record(self.url, file_path)
+            self.record_download(file_path, info.validator)
             return safe_filename
 
         except requests.Timeout as exc:
@@ -329,82 +1717,644 @@ class Downloader:
         except Exception as e:
             logging.error("下载错误：%s", e)
             raise
-
-    def single_thread_download(self):
-        """单线程下载方法"""
+        finally:
+            if info:
+                info.close()
+            if journal:
+                journal.release()
+            if self.hasher:
+                self.hasher.close()
+
+    def open_stream(self, info):
+        """打开单线程下载的响应流，返回 (响应, 样本, 样本之后多读出的部分, 数据块迭代器, 文件大小)
+
+        探测时服务器返回了完整内容，就继续读取那个响应；支持范围请求时与分段下载
+        一样从样本之后开始请求，服务器仍返回完整内容（例如 If-Range 校验失败）时
+        重新读取样本。
+        """
+        body = info.take_body() if info else None
+        if body:
+            response, remainder, chunks = body
+            return response, info.sample, remainder, chunks, info.total_size
         headers = {"User-Agent": self.user_agent}
+        ranged = bool(info and info.accept_ranges and info.sample)
+        if ranged:
+            headers.update({"Range": f"bytes={len(info.sample)}-", "Accept-Encoding": "identity"})
+            if info.validator:
+                headers["If-Range"] = info.validator
+        session = http_sessions.get(self.url)
+        request_start = time.perf_counter()
+        response = session.get(self.url,
+                               stream=True,
+                               headers=headers,
+                               timeout=app.config['DOWNLOAD_TIMEOUT'])
         try:
-            with requests.get(self.url,
-                              stream=True,
-                              headers=headers,
-                              timeout=app.config['DOWNLOAD_TIMEOUT']) as response:
-                response.raise_for_status()
+            metrics.ttfb.observe(time.perf_counter() - request_start, self.host)
+            response.raise_for_status()
+            chunks = self.read_blocks(response, app.config['IO_BLOCK_SIZE'])
+            if ranged and response.status_code == 206:
+                return response, info.sample, b'', chunks, info.total_size
+            content_sample, remainder = self.read_sample(chunks, app.config['PROBE_SIZE'])
+            metrics.bytes_downloaded.inc(self.host, amount=len(content_sample) + len(remainder))
+            return response, content_sample, remainder, chunks, int(response.headers.get('content-length', 0))
+        except BaseException:
+            response.close()
+            raise
+
+    def single_thread_download(self, info=None):
+        """单线程流式下载方法
 
-                original_filename = self.extract_filename(response)
-                content_sample = response.content[:8192]
+        先取得开头的样本用于命名和类型检测，然后继续消费同一个流，边下载边写入
+        磁盘，内存占用与文件大小无关。info 为探测结果时，探测已读到的字节不再重新下载。
+        """
+        partial_path = None
+        try:
+            request_start = time.perf_counter()
+            response, content_sample, remainder, chunks, content_length = self.open_stream(info)
+            with response:
+                if not self.is_allowed_file_type(content_sample):
+                    raise ValueError("不允许下载的文件类型")
+
+                original_filename = self.extract_filename(response, self.url_filename())
                 safe_filename = self.generate_safe_filename(
                     original_filename,
                     content_sample
                 )
                 file_path = os.path.join(self.save_path, safe_filename)
 
-            if not self.is_safe_path(file_path):
-                raise ValueError("不安全的文件路径")
+                if not self.is_safe_path(file_path):
+                    raise ValueError("不安全的文件路径")
+                partial_path = file_path
 
-            content_length = int(response.headers.get('content-length', 0))
-            downloaded_size = 0
+                validator = RemoteFileInfo(original_filename, content_length, False, b'', response.headers).validator
 
-            with open(file_path, 'wb') as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if self.cancelled:
-                        logging.info("下载取消：%s", file_path)
-                        download_history.add_record(self.url, file_path, status="cancelled")
-                        return
-                    if chunk:
-                        file.write(chunk)
-                        downloaded_size += len(chunk)
-                        self.update_progress(downloaded_size, content_length)
+                hasher = self.create_hasher()
+                if hasher:
+                    hasher.update(content_sample)
+                    hasher.update(remainder)
+                tracker = self.progress_tracker
+                received = len(content_sample) + len(remainder)
+                tracker.reset(content_length, already_downloaded=received)
+                tracker.start()
+                try:
+                    with open(file_path, 'wb') as file:
+                        file.write(content_sample)
+                        file.write(remainder)
+                        for chunk in chunks:
+                            if self.cancelled:
+                                logging.info("下载取消：%s", file_path)
+                                download_history.add_record(self.url, file_path, status="cancelled")
+                                return None
+                            if chunk:
+                                file.write(chunk)
+                                if hasher:
+                                    hasher.update(chunk)
+                                received += len(chunk)
+                                tracker.add(0, len(chunk))
+                                metrics.bytes_downloaded.inc(self.host, amount=len(chunk))
+                                bandwidth_limiter.acquire(len(chunk), self.host, self.rate_bucket)
+                finally:
+                    tracker.stop()
+                    metrics.observe_transfer(self.host, received, time.perf_counter() - request_start)
 
             logging.info("下载完成：%s", file_path)
-            download_history.add_record(self.url, file_path)
+            self.record_download(file_path, validator)
             return safe_filename
 
         except Exception as e:
             logging.error("单线程下载失败：%s", e)
+            # 删除本次占用的文件名和写了一半的文件，重试时不会留下残缺的文件
+            if partial_path:
+                with contextlib.suppress(OSError):
+                    os.remove(partial_path)
             raise
 
-    def start_download(self):
-        """启动下载，支持多次重试"""
+    def retry(self, func):
+        """网络错误时重试 func，超过 max_retries 次后抛出最后一次的异常"""
         attempts = 0
-        while attempts < self.max_retries:
+        while True:
             try:
-                self.download()
-                break
+                return func()
             except requests.exceptions.RequestException as e:
                 attempts += 1
                 logging.error("网络错误（尝试 %d/%d）：%s", attempts, self.max_retries, e)
-            except Exception as e:
-                logging.error("未知错误：%s", e)
-                raise
+                if attempts >= self.max_retries or self.cancelled:
+                    raise
+
+    def start_download(self):
+        """启动下载
+
+        多线程下载的失败由分段调度器按分段重试，不会重新下载整个文件。
+        """
+        return self.download()
 
     def cancel_download(self):
         """取消当前下载任务"""
         self.cancelled = True
 
+    def set_rate_limit(self, rate):
+        """设置本任务的速度上限（字节/秒，0 表示不限制）"""
+        self.rate_bucket.set_rate(rate)
+
     @classmethod
-    def batch_download(cls, urls, save_path=None, max_retries=3, user_agent=None):
-        """批量下载多个文件"""
-        results = []
-        for url in urls:
-            try:
-                downloader = cls(url, save_path, max_retries, user_agent)
-                downloader.start_download()
-                results.append({"url": url, "status": "success"})
-            except Exception as e:
-                results.append({"url": url, "status": "failed", "error": str(e)})
+    def batch_download(cls, urls, save_path=None, max_retries=3, user_agent=None, on_result=None):
+        """批量下载多个文件
+
+        BATCH_CONCURRENCY 个线程并发下载，同一主机同时最多 BATCH_PER_HOST_LIMIT 个。
+        列表中重复的URL只下载一次，结果共用。
+        每个URL完成后立即调用 on_result(result)，返回值按输入顺序排列。
+        """
+        duplicates = collections.defaultdict(list)
+        for index, url in enumerate(urls):
+            duplicates[url].append(index)
+        concurrency = max(1, min(app.config['BATCH_CONCURRENCY'], len(duplicates)))
+        per_host_limit = app.config['BATCH_PER_HOST_LIMIT']
+        pending = [(indexes[0], url) for url, indexes in duplicates.items()]
+        host_active = collections.Counter()
+        condition = threading.Condition()
+        results = [None] * len(urls)
+
+        def take():
+            """取出下一个所在主机还有空闲名额的URL，没有剩余URL时返回 None"""
+            with condition:
+                while pending:
+                    for i, (index, url) in enumerate(pending):
+                        host = urlparse(url).hostname
+                        if host_active[host] < per_host_limit:
+                            del pending[i]
+                            host_active[host] += 1
+                            return index, url, host
+                    condition.wait()
+                return None
+
+        def worker():
+            while True:
+                item = take()
+                if item is None:
+                    return
+                index, url, host = item
+                try:
+                    downloader = cls(url, save_path, max_retries, user_agent)
+                    file_name = downloader.start_download()
+                    result = {"url": url, "status": "success", "file": file_name}
+                except Exception as e:
+                    result = {"url": url, "status": "failed", "error": str(e)}
+                finally:
+                    with condition:
+                        host_active[host] -= 1
+                        condition.notify_all()
+                for duplicate_index in duplicates[url]:
+                    results[duplicate_index] = result
+                    if on_result:
+                        on_result(result)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
         return results
 
 
+class ExtractionCache:
+    """yt-dlp 提取结果缓存
+
+    以 URL 为键保存 extract_info 的结果，超过 ttl 秒或超出 max_size 时淘汰
+    最久未使用的记录。存入和取出时都复制一份，调用方可以直接交给
+    process_ie_result 修改。
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()  # url -> (过期时间, 提取结果)
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        """返回缓存的提取结果，不存在或已过期时返回 None"""
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[url]
+                metrics.extract_cache.inc("miss")
+                return None
+            self.entries.move_to_end(url)
+            info = entry[1]
+        metrics.extract_cache.inc("hit")
+        return copy.deepcopy(info)
+
+    def put(self, url, info):
+        """缓存提取结果"""
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        info = copy.deepcopy(info)
+        with self.lock:
+            self.entries[url] = (time.monotonic() + self.ttl, info)
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, url):
+        """删除缓存，例如视频地址过期需要重新提取时"""
+        with self.lock:
+            self.entries.pop(url, None)
+
+
+# 各容器可以直接封装（不需要转码）的编码，None 表示不限制
+CONTAINER_CODECS = {
+    "mp4": ({"h264", "hevc", "av1", "vp9", "mpeg4"}, {"aac", "mp3", "opus", "ac3", "eac3", "flac", "alac"}),
+    "m4a": (set(), {"aac", "alac", "mp3", "opus", "ac3", "eac3", "flac"}),
+    "mov": ({"h264", "hevc", "mpeg4"}, {"aac", "mp3", "alac", "ac3"}),
+    "webm": ({"vp8", "vp9", "av1"}, {"opus", "vorbis"}),
+    "mkv": (None, None),
+    "mp3": (set(), {"mp3"}),
+}
+# 编码不兼容时使用的编码器：容器 -> (视频, 音频)
+CONTAINER_ENCODERS = {
+    "mp4": ("libx264", "aac"), "m4a": (None, "aac"), "mov": ("libx264", "aac"),
+    "webm": ("libvpx-vp9", "libopus"), "mkv": ("libx264", "aac"), "mp3": (None, "libmp3lame"),
+}
+# 提取音频：preferredcodec -> (扩展名, 编码, 编码器)
+AUDIO_TARGETS = {
+    "aac": ("m4a", "aac", "aac"), "m4a": ("m4a", "aac", "aac"), "mp3": ("mp3", "mp3", "libmp3lame"),
+    "opus": ("opus", "opus", "libopus"), "vorbis": ("ogg", "vorbis", "libvorbis"), "flac": ("flac", "flac", "flac"),
+}
+CODEC_FAMILIES = {
+    "avc1": "h264", "avc3": "h264", "h264": "h264", "hev1": "hevc", "hvc1": "hevc", "hevc": "hevc",
+    "h265": "hevc", "av01": "av1", "av1": "av1", "vp09": "vp9", "vp9": "vp9", "vp08": "vp8", "vp8": "vp8",
+    "mp4v": "mpeg4", "mpeg4": "mpeg4", "mp4a": "aac", "aac": "aac", "mp3": "mp3", "opus": "opus",
+    "vorbis": "vorbis", "ac-3": "ac3", "ac3": "ac3", "ec-3": "eac3", "eac3": "eac3", "flac": "flac", "alac": "alac",
+}
+
+
+def codec_family(codec):
+    """把 yt-dlp 或 ffprobe 给出的编码名归一化，例如 avc1.640028 -> h264；无法识别时返回 None"""
+    if not codec or codec == "none":
+        return None
+    return CODEC_FAMILIES.get(codec.split(".")[0].lower())
+
+
+def plan_postprocessors(postprocessors):
+    """把站点配置中的后处理器列表拆成 (仍由 yt-dlp 执行的后处理器, 合并执行的媒体处理配置)
+
+    转换容器、写入元数据、嵌入缩略图和字幕，以及转换容器之后的提取音频，都改由
+    MediaPostProcessor 在一次 ffmpeg 调用中完成；其他后处理器保持不变，在它之前执行。
+    """
+    remaining = []
+    media = {}
+    for pp in postprocessors:
+        key = pp.get("key")
+        if (key in ("FFmpegVideoConvertor", "FFmpegVideoRemuxer") and "container" not in media
+                and re.fullmatch(r"\w+", pp.get("preferedformat", ""))):
+            media["container"] = pp["preferedformat"].lower()
+            media["transcode"] = key == "FFmpegVideoConvertor"
+        elif key == "FFmpegMetadata":
+            media["metadata"] = pp.get("add_metadata", True)
+            media["chapters"] = pp.get("add_chapters", True)
+        elif key == "EmbedThumbnail":
+            media["thumbnail"] = True
+        elif key == "FFmpegEmbedSubtitle":
+            media["subtitles"] = True
+        elif key == "FFmpegExtractAudio" and "container" in media and pp.get("preferredcodec") in AUDIO_TARGETS:
+            media["extract_audio"] = {"codec": pp["preferredcodec"], "quality": pp.get("preferredquality")}
+        else:
+            remaining.append(pp)
+    return remaining, media or None
+
+
+def ffmetadata_escape(value):
+    return re.sub(r"([=;#\\\n])", r"\\\1", str(value))
+
+
+if YTDLP_AVAILABLE:
+    class MediaPostProcessor(yt_dlp.postprocessor.FFmpegPostProcessor):
+        """合并后的媒体处理：一次 ffmpeg 调用完成容器转换、元数据、缩略图、字幕和音频提取
+
+        根据所选格式的编码（未知时用 ffprobe 探测）判断能否直接封装到目标容器，
+        兼容的流只复制不转码，只有不兼容的流才重新编码。
+        """
+
+        def __init__(self, downloader=None, container=None, transcode=True, metadata=False,
+                     chapters=False, thumbnail=False, subtitles=False, extract_audio=None):
+            super().__init__(downloader)
+            self.container = container
+            self.transcode = transcode
+            self.metadata = metadata
+            self.chapters = chapters
+            self.thumbnail = thumbnail
+            self.subtitles = subtitles
+            self.extract_audio = extract_audio
+
+        @classmethod
+        def pp_key(cls):
+            return "MediaPlan"
+
+        def source_codecs(self, info):
+            """返回 (视频编码, 音频编码)，没有该类型的流时为 None；格式信息中没有编码时用 ffprobe 探测"""
+            formats = info.get('requested_formats') or [info]
+            codecs = []
+            for key in ('vcodec', 'acodec'):
+                values = [f.get(key) for f in formats]
+                known = [value for value in values if value not in (None, 'none')]
+                codecs.append(known[0] if known else 'none' if values and all(v == 'none' for v in values) else None)
+            if None in codecs:
+                try:
+                    streams = [stream for stream in self.get_metadata_object(info['filepath'])['streams']
+                               if not (stream.get('disposition') or {}).get('attached_pic')]
+                    codecs = [next((stream.get('codec_name') for stream in streams
+                                    if stream.get('codec_type') == codec_type), 'none')
+                              for codec_type in ('video', 'audio')]
+                except (yt_dlp.utils.PostProcessingError, ValueError) as e:
+                    self.report_warning(f"无法探测编码：{e}")
+            return tuple(None if codec in (None, 'none') else codec_family(codec) or codec.lower()
+                         for codec in codecs)
+
+        @staticmethod
+        def stream_action(target, kind, codec):
+            """流的处理方式：None 表示没有该流，copy 表示直接复制，否则为使用的编码器"""
+            if codec is None:
+                return None
+            allowed = CONTAINER_CODECS.get(target, (None, None))[kind]
+            if allowed is None or codec in allowed:
+                return 'copy'
+            return CONTAINER_ENCODERS[target][kind] or 'copy'
+
+        def plan(self, info, codecs):
+            """生成处理计划，不需要处理时返回 None"""
+            filepath = info['filepath']
+            source_ext = info['ext'].lower()
+            vcodec, acodec = codecs
+            audio_target = AUDIO_TARGETS[self.extract_audio['codec']] if self.extract_audio and acodec else None
+            # 只转换视频的容器；纯音频只在需要提取音频时转换为对应格式，否则保持原格式
+            if vcodec:
+                target = self.container or source_ext
+            else:
+                target = audio_target[0] if audio_target else source_ext
+            video_action = self.stream_action(target, 0, vcodec) if target != source_ext else vcodec and 'copy'
+            audio_action = self.stream_action(target, 1, acodec) if target != source_ext else acodec and 'copy'
+            if audio_target and not vcodec:
+                audio_action = 'copy' if acodec == audio_target[1] else audio_target[2]
+            needs_encoding = (video_action or 'copy') != 'copy' or (audio_action or 'copy') != 'copy'
+            if needs_encoding and not self.transcode and vcodec:
+                # 只允许封装（FFmpegVideoRemuxer）时，编码不兼容就保留原格式
+                self.report_warning(f"{vcodec}/{acodec} 无法直接封装为 {target}，保留 {source_ext}")
+                target, video_action, audio_action = source_ext, vcodec and 'copy', acodec and 'copy'
+
+            plan = {
+                'target': target,
+                'video': video_action,
+                'audio': audio_action,
+                'output': yt_dlp.utils.replace_extension(filepath, target, source_ext),
+                'thumbnail': None,
+                'subtitles': [],
+                'subtitle_codec': None,
+                'metadata': self.ffmetadata(info) if self.metadata else None,
+                'audio_output': None,
+            }
+            if self.thumbnail and target in ('mp4', 'm4a', 'mov', 'mp3', 'mkv'):
+                thumbnails = [t['filepath'] for t in info.get('thumbnails') or []
+                              if t.get('filepath') and os.path.exists(t['filepath'])]
+                plan['thumbnail'] = thumbnails[-1] if thumbnails else None
+            plan['subtitle_codec'] = {'mp4': 'mov_text', 'mov': 'mov_text', 'mkv': 'copy', 'webm': 'webvtt'}.get(target)
+            if self.subtitles and plan['subtitle_codec'] and vcodec:
+                plan['subtitles'] = [
+                    (lang, sub['filepath'])
+                    for lang, sub in (info.get('requested_subtitles') or {}).items()
+                    if sub.get('filepath') and os.path.exists(sub['filepath'])
+                    and (target != 'webm' or sub.get('ext') == 'vtt')
+                ]
+            if audio_target and vcodec:
+                ext, family, encoder = audio_target
+                plan['audio_output'] = (yt_dlp.utils.replace_extension(filepath, ext, source_ext),
+                                        'copy' if acodec == family else encoder,
+                                        self.extract_audio.get('quality'))
+            if (target == source_ext and not (plan['thumbnail'] or plan['subtitles']
+                                              or plan['metadata'] or plan['audio_output'])):
+                return None
+            return plan
+
+        def ffmetadata(self, info):
+            """生成 ffmetadata 格式的标签和章节"""
+            tags = {
+                'title': info.get('track') or info.get('title'),
+                'artist': info.get('artist') or info.get('creator') or info.get('uploader'),
+                'album': info.get('album'),
+                'genre': info.get('genre'),
+                'date': info.get('upload_date'),
+                'description': info.get('description'),
+                'comment': info.get('webpage_url'),
+            }
+            lines = [";FFMETADATA1"]
+            lines += [f"{key}={ffmetadata_escape(value)}" for key, value in tags.items() if value]
+            for chapter in (info.get('chapters') or []) if self.chapters else []:
+                if chapter.get('end_time') is None:
+                    continue
+                lines += ["[CHAPTER]", "TIMEBASE=1/1000",
+                          f"START={int(chapter['start_time'] * 1000)}",
+                          f"END={int(chapter['end_time'] * 1000)}"]
+                if chapter.get('title'):
+                    lines.append(f"title={ffmetadata_escape(chapter['title'])}")
+            return "\n".join(lines) + "\n" if len(lines) > 1 else None
+
+        def ffmpeg_args(self, info, plan, metadata_file):
+            """生成 real_run_ffmpeg 的输入和输出参数"""
+            inputs = [(info['filepath'], [])]
+            # 只取源文件的视频（不含封面）和音频流，源文件中已有的字幕等不一定能放进目标容器
+            opts = ['-map', '0:V?', '-map', '0:a?', '-c', 'copy']
+            if plan['video'] not in ('copy', None):
+                opts += ['-c:v:0', plan['video']]
+            if plan['audio'] not in ('copy', None):
+                opts += ['-c:a', plan['audio']]
+                if not plan['video'] and self.extract_audio and self.extract_audio.get('quality'):
+                    opts += ['-b:a', f"{self.extract_audio['quality']}k"]
+            if metadata_file:
+                inputs.append((metadata_file, []))
+                opts += ['-map_metadata', str(len(inputs) - 1)]
+                if self.chapters:
+                    opts += ['-map_chapters', str(len(inputs) - 1)]
+            if plan['thumbnail'] and plan['target'] == 'mkv':
+                # mkv 以附件形式保存封面
+                mimetype = mimetypes.guess_type(plan['thumbnail'])[0] or 'image/jpeg'
+                opts += ['-attach', plan['thumbnail'], '-metadata:s:t', f'mimetype={mimetype}']
+            elif plan['thumbnail']:
+                inputs.append((plan['thumbnail'], []))
+                # 封面是视频流之后的一个 attached_pic 流，不是 jpg/png 时在同一次调用中转成 jpg
+                cover = 1 if plan['video'] else 0
+                is_jpeg_or_png = os.path.splitext(plan['thumbnail'])[1].lower() in ('.jpg', '.jpeg', '.png')
+                opts += ['-map', str(len(inputs) - 1), f'-c:v:{cover}', 'copy' if is_jpeg_or_png else 'mjpeg',
+                         f'-disposition:v:{cover}', 'attached_pic']
+                if plan['target'] == 'mp3':
+                    opts += ['-id3v2_version', '3', f'-metadata:s:v:{cover}', 'comment=Cover (front)']
+            for number, (lang, path) in enumerate(plan['subtitles']):
+                inputs.append((path, []))
+                opts += ['-map', str(len(inputs) - 1), f'-metadata:s:s:{number}', f'language={lang}']
+            if plan['subtitles']:
+                opts += ['-c:s', plan['subtitle_codec']]
+            outputs = [(yt_dlp.utils.prepend_extension(plan['output'], 'temp'), opts)]
+            if plan['audio_output']:
+                audio_path, codec, quality = plan['audio_output']
+                audio_opts = ['-map', '0:a:0', '-vn', '-c:a', codec]
+                if codec != 'copy' and quality:
+                    audio_opts += ['-b:a', f"{quality}k"]
+                outputs.append((yt_dlp.utils.prepend_extension(audio_path, 'temp'), audio_opts))
+            return inputs, outputs
+
+        def run(self, info):
+            if not self.available:
+                self.report_warning("未找到 ffmpeg，跳过后处理")
+                return [], info
+            started = time.perf_counter()
+            plan = self.plan(info, self.source_codecs(info))
+            planned = time.perf_counter()
+            if plan is None:
+                return [], info
+
+            metadata_file = None
+            if plan['metadata']:
+                metadata_file = yt_dlp.utils.replace_extension(info['filepath'], 'meta.txt', info['ext'])
+                with open(metadata_file, 'w', encoding='utf-8') as f:
+                    f.write(plan['metadata'])
+            inputs, outputs = self.ffmpeg_args(info, plan, metadata_file)
+            try:
+                self.real_run_ffmpeg(inputs, outputs)
+            finally:
+                if metadata_file and os.path.exists(metadata_file):
+                    os.remove(metadata_file)
+            finished = time.perf_counter()
+
+            for (temp_path, _), final_path in zip(outputs, (plan['output'], (plan['audio_output'] or [None])[0])):
+                os.replace(temp_path, final_path)
+            # 已嵌入的缩略图和字幕直接删除，原文件交给 yt-dlp 按 keepvideo 决定是否保留
+            for path in [plan['thumbnail']] + [path for _, path in plan['subtitles']]:
+                if path and os.path.exists(path):
+                    os.remove(path)
+            files_to_delete = [info['filepath']] if plan['output'] != info['filepath'] else []
+            info['filepath'] = plan['output']
+            info['ext'] = plan['target']
+            logging.info("后处理：%s，视频 %s，音频 %s%s%s%s%s，分析 %.2f 秒，ffmpeg %.2f 秒",
+                         plan['target'], plan['video'], plan['audio'],
+                         "，元数据" if plan['metadata'] else "",
+                         "，缩略图" if plan['thumbnail'] else "",
+                         f"，{len(plan['subtitles'])} 个字幕" if plan['subtitles'] else "",
+                         "，提取音频" if plan['audio_output'] else "",
+                         planned - started, finished - planned)
+            return files_to_delete, info
+
+
+class PooledYoutubeDL:
+    """池中的 YoutubeDL 实例，进度回调和后处理回调转发给当前使用它的任务"""
+
+    def __init__(self, options):
+        self.hook = None
+        self.postprocessor_hook = None
+        media_plan = options.get('media_plan')
+        options = {key: value for key, value in options.items() if key != 'media_plan'}
+        options.update(progress_hooks=[self.progress_hook], postprocessor_hooks=[self.on_postprocessor])
+        self.ydl = yt_dlp.YoutubeDL(options)
+        if media_plan:
+            self.ydl.add_post_processor(MediaPostProcessor(self.ydl, **media_plan), when='post_process')
+
+    def progress_hook(self, d):
+        if self.hook:
+            self.hook(d)
+
+    def on_postprocessor(self, d):
+        if self.postprocessor_hook:
+            self.postprocessor_hook(d)
+
+
+class YoutubeDLPool:
+    """按站点配置复用 YoutubeDL 实例
+
+    创建 YoutubeDL 需要加载提取器和后处理器、读取 cookies，复用实例可以省去这些
+    开销，已初始化的提取器（例如获取过的签名函数）也能继续使用。配置中只有输出
+    路径、回调和低速重新提取的阈值随任务变化，借出时替换；其余配置相同的任务共用同一组实例。
+    """
+
+    JOB_OPTIONS = ('outtmpl', 'progress_hooks', 'postprocessor_hooks', 'throttledratelimit')
+
+    def __init__(self, size):
+        self.size = size
+        self.idle = {}  # 配置 -> 空闲实例列表
+        self.lock = threading.Lock()
+
+    def pool_key(self, options):
+        shared = {k: v for k, v in options.items() if k not in self.JOB_OPTIONS}
+        return json.dumps(shared, sort_keys=True, default=repr)
+
+    @contextlib.contextmanager
+    def borrow(self, options, progress_hook, postprocessor_hook=None):
+        """借出一个实例，用完后归还；出错的实例直接关闭，不再复用"""
+        key = self.pool_key(options)
+        with self.lock:
+            instances = self.idle.get(key)
+            pooled = instances.pop() if instances else None
+        if pooled is None:
+            pooled = PooledYoutubeDL(options)
+        else:
+            pooled.ydl.params['outtmpl'] = dict(pooled.ydl.params['outtmpl'], default=options['outtmpl'])
+            pooled.ydl.params['throttledratelimit'] = options.get('throttledratelimit')
+        pooled.hook = progress_hook
+        pooled.postprocessor_hook = postprocessor_hook
+        try:
+            yield pooled.ydl
+        except BaseException:
+            pooled.hook = pooled.postprocessor_hook = None
+            pooled.ydl.close()
+            raise
+        pooled.hook = pooled.postprocessor_hook = None
+        with self.lock:
+            instances = self.idle.setdefault(key, [])
+            if len(instances) < self.size:
+                instances.append(pooled)
+                pooled = None
+        if pooled is not None:
+            pooled.ydl.close()
+
+
+extraction_cache = ExtractionCache(Config.EXTRACT_CACHE_TTL, Config.EXTRACT_CACHE_SIZE)
+ytdlp_pool = YoutubeDLPool(Config.YTDLP_POOL_SIZE)
+
+
+class PlaylistEntry:
+    """播放列表中的一个视频及其下载进度"""
+
+    def __init__(self, index, info):
+        self.index = index
+        self.info = info
+        self.url = info.get('webpage_url') or info.get('url')
+        self.title = info.get('title') or self.url
+        self.archive_id = DownloadArchive.make_id(info)
+        self.status = "Queued"  # Queued/Downloading/Completed/Failed/Skipped/Cancelled
+        self.file_path = None
+        self.downloaded_bytes = 0
+        self.total_bytes = 0
+        self.speed = 0
+        self.error = None
+        self.stages = {}  # 下载和各后处理阶段的耗时（秒）
+
+    @property
+    def fraction(self):
+        """完成比例，结束（包括失败和跳过）的视频算作 1"""
+        if self.status in ("Completed", "Failed", "Skipped"):
+            return 1
+        if self.status == "Downloading" and self.total_bytes:
+            return min(self.downloaded_bytes / self.total_bytes, 1)
+        return 0
+
+    def to_dict(self):
+        return {
+            'index': self.index,
+            'title': self.title,
+            'url': self.url,
+            'status': self.status,
+            'percentage': self.fraction * 100,
+            'error': self.error,
+            'stages': self.stages,
+        }
+
+
 class VideoDownloader:
     """视频下载器类"""
 
@@ -419,17 +2369,39 @@ class VideoDownloader:
         self.cookies_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cookies.txt")
         # 初始化进度相关变量
         self.last_update_time = time.time()
+        self.last_log_time = 0
         self.last_downloaded_bytes = 0
         self.download_speed = 0
         self.total_bytes = 0
         self.downloaded_bytes = 0
+        self.progress = dict(DEFAULT_PROGRESS)
+        self.stages = {}  # 下载和各后处理阶段的耗时（秒）
+        self.playlist = None  # 播放列表中各视频的下载状态
+        self.playlist_started = 0
+        self.playlist_enumerating = False
+        self.last_playlist_update = 0
+        # 带宽限制：每个文件已计入令牌桶的字节数
+        self.host = urlparse(url).hostname
+        self.profile = url_classifier.classify(url).profile  # 站点配置
+        self.rate_bucket = TokenBucket(site_profiles.rate_limit(self.profile))
+        self.accounted_bytes = {}
 
     def is_bilibili_url(self, url):
         """检查是否为B站URL"""
-        return 'bilibili.com' in url or 'b23.tv' in url
-
-    def clean_temp_files(self, base_filename):
-        """清理临时文件和非mp4文件"""
+        return url_classifier.classify(url).profile == 'bilibili'
+
+    def sidecar_files(self, info):
+        """已写入磁盘、等待后处理嵌入的缩略图和字幕文件；站点配置不嵌入的不算在内"""
+        keys = {pp.get("key") for pp in site_profiles.spec(self.profile)["postprocessors"]}
+        files = set()
+        if "EmbedThumbnail" in keys:
+            files |= {thumbnail.get('filepath') for thumbnail in info.get('thumbnails') or []}
+        if "FFmpegEmbedSubtitle" in keys:
+            files |= {sub.get('filepath') for sub in (info.get('requested_subtitles') or {}).values()}
+        return {os.path.abspath(path) for path in files if path}
+
+    def clean_temp_files(self, base_filename, keep=()):
+        """清理临时文件和非mp4文件，keep 中的文件除外"""
         try:
             dir_path = os.path.dirname(base_filename)
             filename_without_ext = os.path.splitext(os.path.basename(base_filename))[0]
@@ -438,6 +2410,8 @@ class VideoDownloader:
             for file in os.listdir(dir_path):
                 if file.startswith(filename_without_ext):
                     filepath = os.path.join(dir_path, file)
+                    if os.path.abspath(filepath) in keep:
+                        continue
                     # 保留mp4文件，删除其他文件
                     if not file.endswith('.mp4'):
                         try:
@@ -477,43 +2451,62 @@ class VideoDownloader:
                     eta = remaining_bytes / current_speed
 
                 # 更新进度信息
-                with app.app_context():
-                    app.config['PROGRESS'] = {
-                        'percentage': progress_percentage,
-                        'downloaded': format_size(self.downloaded_bytes),
-                        'total': format_size(self.total_bytes),
-                        'speed': format_size(current_speed) + '/s',
-                        'eta': format_time(eta) if eta else '计算中...'
-                    }
-
-                # 记录日志
-                logging.info(
-                    f"下载进度: {progress_percentage:.1f}%, "
-                    f"速度: {format_size(current_speed)}/s, "
-                    f"已下载: {format_size(self.downloaded_bytes)}/{format_size(self.total_bytes)}"
-                )
+                self.progress = {
+                    'percentage': progress_percentage,
+                    'downloaded': format_size(self.downloaded_bytes),
+                    'total': format_size(self.total_bytes),
+                    'speed': format_size(current_speed) + '/s',
+                    'eta': format_time(eta) if eta else '计算中...'
+                }
+
+                # 进度日志按时间采样，且只在开启 DEBUG 级别时格式化输出
+                if (current_time - self.last_log_time >= app.config['PROGRESS_LOG_INTERVAL']
+                        and logging.getLogger().isEnabledFor(logging.DEBUG)):
+                    self.last_log_time = current_time
+                    logging.debug("下载进度: %.1f%%, 速度: %s/s, 已下载: %s/%s",
+                                  progress_percentage, format_size(current_speed),
+                                  format_size(self.downloaded_bytes), format_size(self.total_bytes))
 
         except Exception as e:
             logging.error("更新进度时出错：%s", e)
 
-    def progress_hook(self, d):
-        """处理下载进度回调"""
+    def progress_hook(self, d, entry=None):
+        """处理下载进度回调，entry 为播放列表中正在下载的视频"""
+        if self.cancelled:
+            # 在回调中抛出异常让 yt-dlp 停止下载
+            raise yt_dlp.utils.DownloadCancelled()
         try:
             if d['status'] == 'downloading':
-                self.current_filename = d.get('filename')
                 total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
                 downloaded_bytes = d.get('downloaded_bytes', 0)
                 speed = d.get('speed', 0)
                 eta = d.get('eta', 0)
 
-                # 使用update_progress方法更新进度
-                self.update_progress(downloaded_bytes, total_bytes, speed, eta)
+                if entry is None:
+                    self.current_filename = d.get('filename')
+                    # 使用update_progress方法更新进度
+                    self.update_progress(downloaded_bytes, total_bytes, speed, eta)
+                else:
+                    entry.file_path = d.get('filename')
+                    entry.downloaded_bytes = downloaded_bytes
+                    entry.total_bytes = total_bytes or entry.total_bytes
+                    entry.speed = speed or 0
+                    self.update_playlist_progress()
+
+                # 把新下载的字节计入共享的令牌桶，超出额度时在回调中等待
+                filename = d.get('filename')
+                delta = downloaded_bytes - self.accounted_bytes.get(filename, 0)
+                self.accounted_bytes[filename] = downloaded_bytes
+                if delta > 0:
+                    metrics.bytes_downloaded.inc(self.host, amount=delta)
+                    bandwidth_limiter.acquire(delta, self.host, self.rate_bucket)
 
             elif d['status'] == 'finished':
-                logging.info("视频下载完成：%s", self.current_filename)
-                # 在下载完成后清理临时文件
-                if self.current_filename:
-                    self.clean_temp_files(self.current_filename)
+                filename = d.get('filename') if entry is not None else self.current_filename
+                logging.info("视频下载完成：%s", filename)
+                # 在下载完成后清理临时文件，缩略图和字幕留给后处理嵌入
+                if filename:
+                    self.clean_temp_files(filename, keep=self.sidecar_files(d.get('info_dict') or {}))
 
             elif d['status'] == 'error':
                 error_message = d.get('error', '未知错误')
@@ -522,60 +2515,58 @@ class VideoDownloader:
         except Exception as e:
             logging.error("处理进度回调时出错：%s", e)
 
+    @staticmethod
+    def postprocessor_hook(d, stages):
+        """记录各后处理器的耗时"""
+        name = d.get('postprocessor')
+        if d.get('status') == 'started':
+            stages.setdefault('_started', {})[name] = time.perf_counter()
+        elif d.get('status') == 'finished':
+            started = stages.get('_started', {}).pop(name, None)
+            if started is not None:
+                stages[name] = stages.get(name, 0) + time.perf_counter() - started
+
+    def update_playlist_progress(self, force=False):
+        """汇总播放列表中各视频的进度，进度回调中最多每 PROGRESS_UPDATE_INTERVAL 秒汇总一次"""
+        current_time = time.time()
+        if not force and current_time - self.last_playlist_update < app.config['PROGRESS_UPDATE_INTERVAL']:
+            return
+        self.last_playlist_update = current_time
+        entries = self.playlist
+        if not entries:
+            return
+        fraction = sum(entry.fraction for entry in entries) / len(entries)
+        active = [entry for entry in entries if entry.status == "Downloading"]
+        speed = sum(entry.speed for entry in active)
+        elapsed = current_time - self.playlist_started
+        eta = elapsed * (1 - fraction) / fraction if fraction > 0 else None
+        self.progress = {
+            'percentage': fraction * 100,
+            'downloaded': format_size(sum(entry.downloaded_bytes for entry in entries)),
+            'total': format_size(sum(entry.total_bytes for entry in entries)),
+            'speed': format_size(speed) + '/s',
+            'eta': format_time(eta) if eta is not None else '计算中...',
+            'count': len(entries),
+            'enumerating': self.playlist_enumerating,
+            'completed': sum(1 for entry in entries if entry.status == "Completed"),
+            'failed': sum(1 for entry in entries if entry.status == "Failed"),
+            'skipped': sum(1 for entry in entries if entry.status == "Skipped"),
+            'entries': [entry.to_dict() for entry in entries if entry.status not in ("Queued", "Skipped")],
+        }
+
     def get_download_options(self) -> dict:
-        """获取下载配置"""
-        # 基础配置
-        options = {
-            'format': 'bestvideo*+bestaudio/best',
+        """获取下载配置：站点配置合并后的选项加上本任务相关的选项"""
+        options = site_profiles.options(self.profile)
+        options.update({
             'outtmpl': os.path.join(self.save_path, '%(title)s_%(id)s.%(ext)s'),
             'progress_hooks': [self.progress_hook],
             'http_headers': {'User-Agent': self.user_agent},
             'retries': app.config['MAX_RETRIES'],
-            'merge_output_format': 'mp4',
-            'writethumbnail': True,
-            'writesubtitles': True,
-            'writeautomaticsub': True,
-            'subtitleslangs': ['zh-CN', 'en'],
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4',
-            }, {
-                'key': 'FFmpegMetadata',
-                'add_metadata': True,
-            }, {
-                'key': 'EmbedThumbnail',
-            }],
-            'format_sort': [
-                'res:2160',
-                'res:1440',
-                'res:1080',
-                'res:720',
-                'res:480',
-            ],
-            'concurrent_fragment_downloads': 8,  # 并发下载片段数
-            'throttledratelimit': 100000,  # 限制下载速度（字节/秒）
-            'socket_timeout': 30,  # 连接超时时间
-            'extractor_retries': 3,  # 提取器重试次数
-            'fragment_retries': 10,  # 片段重试次数
-            'skip_unavailable_fragments': True,  # 跳过不可用片段
-            'overwrites': True,  # 覆盖已存在的文件
-        }
-
-        # B站视频特殊配置
-        if self.is_bilibili_url(self.url):
-            options.update(self._get_bilibili_options())
-        # 抖音/TikTok特殊配置
-        elif re.search(r'douyin\.com/|tiktok\.com/', self.url):
-            options.update(self._get_douyin_options())
-        # YouTube特殊配置
-        elif re.search(r'youtube\.com/|youtu\.be/', self.url):
-            options.update(self._get_youtube_options())
-        # 直播平台特殊配置
-        elif re.search(r'live\.|douyu\.com|huya\.com|twitch\.tv', self.url):
-            options.update(self._get_live_options())
-        # 音频平台特殊配置
-        elif re.search(r'music\.|\.com/track/|soundcloud\.com|ximalaya\.com', self.url):
-            options.update(self._get_audio_options())
+        })
+        # 限速只在进度回调中通过共用的令牌桶进行，不再交给 yt-dlp 的 ratelimit。
+        # 限速时速度会持续低于 throttledratelimit，yt-dlp 会误判为被限流而反复重新提取
+        if bandwidth_limiter.effective_rate(self.host, self.rate_bucket):
+            options.pop('throttledratelimit', None)
 
         # 添加cookies支持
         cookies_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cookies.txt")
@@ -584,104 +2575,214 @@ class VideoDownloader:
 
         return options
 
-    def _get_bilibili_options(self):
-        """B站特殊配置"""
-        return {
-            'format': 'bestvideo*+bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4',
-            }, {
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'aac',
-                'preferredquality': '192',
-            }],
-            'extractaudio': True,
-            'keepvideo': True,
-        }
-
-    def _get_douyin_options(self):
-        """抖音特殊配置"""
-        return {
-            'format': 'best',
-            'cookiesfrombrowser': ('chrome',),
-        }
+    def extract_info(self, ydl, url):
+        """提取视频信息，优先使用缓存
+
+        只运行提取器，不选择格式也不展开播放列表（process=False）：播放列表的
+        entries 是惰性的，遍历时才逐页获取。单个视频的结果写入缓存，下载时
+        再由 process_ie_result 处理。
+        """
+        info = extraction_cache.get(url)
+        if info is not None:
+            logging.info("使用缓存的视频信息：%s", url)
+            return info
+        info = ydl.extract_info(url, download=False, process=False)
+        while info.get('_type') == 'url':
+            # 跳转到其他提取器，例如短链接
+            info = ydl.extract_info(info['url'], download=False, process=False, ie_key=info.get('ie_key'))
+        if info.get('_type') in ('playlist', 'multi_video') or info.get('is_live'):
+            return info
+        # 与 --load-info-json 相同，去掉私有字段
+        info = ydl.sanitize_info(info, remove_private_keys=True)
+        extraction_cache.put(url, info)
+        return info
+
+    @staticmethod
+    def iter_entries(info):
+        """惰性遍历播放列表中的条目"""
+        entries = info.get('entries') or []
+        if isinstance(entries, yt_dlp.utils.PagedList):
+            # PagedList 按下标访问时逐页获取并缓存
+            index = 0
+            while True:
+                try:
+                    entry = entries[index]
+                except IndexError:
+                    return
+                index += 1
+                if entry:
+                    yield entry
+        else:
+            for entry in entries:
+                if entry:
+                    yield entry
 
-    def _get_youtube_options(self):
-        """YouTube特殊配置"""
-        return {
-            'format': 'bestvideo*+bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4',
-            }],
-            'writesubtitles': True,
-            'writeautomaticsub': True,
-            'subtitleslangs': ['zh-Hans', 'zh-Hant', 'en'],
-        }
+    def download_info(self, ydl, info, stages):
+        """按已提取的信息下载，不再重新提取；返回下载后的文件路径
 
-    def _get_live_options(self):
-        """直播平台特殊配置"""
-        return {
-            'format': 'best',
-            'live_from_start': True,
-            'retry_sleep': 5,
-            'concurrent_fragment_downloads': 5,
-        }
-
-    def _get_audio_options(self):
-        """音频平台特殊配置"""
-        return {
-            'format': 'bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '320',
-            }, {
-                'key': 'FFmpegMetadata',
-                'add_metadata': True,
-            }, {
-                'key': 'EmbedThumbnail',
-            }],
-            'writethumbnail': True,
-        }
+        stages 由后处理回调填入各后处理器的耗时，这里补上下载阶段的耗时并记录指标。
+        """
+        url = info.get('webpage_url') or self.url
+        started = time.perf_counter()
+        try:
+            result = ydl.process_ie_result(info, download=True)
+        except yt_dlp.utils.ReExtractInfo:
+            # 视频地址已失效，重新提取
+            extraction_cache.invalidate(url)
+            stages.clear()
+            started = time.perf_counter()
+            result = ydl.process_ie_result(self.extract_info(ydl, url), download=True)
+        stages.pop('_started', None)
+        stages['download'] = max(time.perf_counter() - started - sum(stages.values()), 0)
+        for stage, seconds in stages.items():
+            metrics.video_stages.observe(seconds, stage)
+        logging.info("视频处理耗时：%s", "，".join(f"{stage} {seconds:.2f} 秒" for stage, seconds in stages.items()))
+        downloads = result.get('requested_downloads') or [{}]
+        return downloads[-1].get('filepath') or self.current_filename
+
+    def download_entry(self, ydl, entry, expand):
+        """下载播放列表中的一个视频并写入历史记录和归档
+
+        条目提取后是播放列表（例如频道的各个标签页）时，由 expand 把其中的视频加入队列。
+        """
+        entry.status = "Downloading"
+        try:
+            info = entry.info
+            if info.get('_type') in ('url', 'playlist', 'multi_video'):
+                # 枚举时只得到了地址，这时才提取
+                info = info if info.get('_type') != 'url' else self.extract_info(ydl, entry.url)
+                if info.get('_type') in ('playlist', 'multi_video'):
+                    expand(info)
+                    entry.status = "Skipped"
+                    return
+            archive_id = entry.archive_id or DownloadArchive.make_id(info)
+            if entry.archive_id is None and download_archive.contains(archive_id):
+                entry.status = "Skipped"
+                return
+            entry.file_path = self.download_info(ydl, info, entry.stages) or entry.file_path
+            entry.status = "Completed"
+            download_history.add_record(entry.url, entry.file_path, file_type="video")
+            download_archive.add(archive_id, entry.url, entry.file_path)
+        except yt_dlp.utils.DownloadCancelled:
+            entry.status = "Cancelled"
+            download_history.add_record(entry.url, entry.file_path or "", file_type="video", status="cancelled")
+        except Exception as e:
+            entry.status = "Failed"
+            entry.error = str(e)
+            logging.error("下载视频失败：%s，%s", entry.url, e)
+            download_history.add_record(entry.url, entry.file_path or "", file_type="video", status="failed")
+        finally:
+            self.update_playlist_progress(force=True)
+
+    def download_playlist(self, info, ydl_opts):
+        """并发下载播放列表
+
+        当前线程边翻页边把视频加入队列，已在归档中的视频直接跳过，不再提取；
+        PLAYLIST_CONCURRENCY 个线程共用同一份下载配置，各自从池中借用 YoutubeDL，
+        取出视频后提取并下载。单个视频失败不影响其他视频。
+        """
+        self.playlist = []
+        self.playlist_started = time.time()
+        self.playlist_enumerating = True
+        pending = collections.deque()
+        condition = threading.Condition()
+        producers = [1]  # 正在向队列添加视频的线程数
+
+        def add(entry_info):
+            """加入一个视频，已下载过时返回 False"""
+            entry = PlaylistEntry(len(self.playlist), entry_info)
+            self.playlist.append(entry)
+            if entry.archive_id and download_archive.contains(entry.archive_id):
+                entry.status = "Skipped"
+                return False
+            with condition:
+                pending.append(entry)
+                condition.notify()
+            return True
+
+        def expand(playlist_info):
+            with condition:
+                producers[0] += 1
+            try:
+                for entry_info in self.iter_entries(playlist_info):
+                    if self.cancelled:
+                        break
+                    add(entry_info)
+            finally:
+                with condition:
+                    producers[0] -= 1
+                    condition.notify_all()
+
+        def take():
+            with condition:
+                while not pending and producers[0] and not self.cancelled:
+                    condition.wait(1)
+                return pending.popleft() if pending and not self.cancelled else None
+
+        def worker():
+            current = [None]
+            with ytdlp_pool.borrow(ydl_opts, lambda d: self.progress_hook(d, current[0]),
+                                   lambda d: self.postprocessor_hook(d, current[0].stages)) as ydl:
+                while True:
+                    current[0] = take()
+                    if current[0] is None:
+                        return
+                    self.download_entry(ydl, current[0], expand)
+
+        concurrency = max(1, app.config['PLAYLIST_CONCURRENCY'])
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        archived_in_row = 0
+        break_after = app.config['ARCHIVE_BREAK_AFTER']
+        try:
+            for entry_info in self.iter_entries(info):
+                if self.cancelled:
+                    break
+                archived_in_row = 0 if add(entry_info) else archived_in_row + 1
+                if break_after and archived_in_row >= break_after:
+                    logging.info("连续%d个视频已下载过，停止枚举播放列表", archived_in_row)
+                    break
+        finally:
+            self.playlist_enumerating = False
+            logging.info("播放列表共%d个视频", len(self.playlist))
+            with condition:
+                producers[0] -= 1
+                condition.notify_all()
+            for thread in threads:
+                thread.join()
+        if self.cancelled:
+            logging.info("下载取消")
+        self.update_playlist_progress(force=True)
 
     def download(self):
         """下载视频"""
         ydl_opts = self.get_download_options()
 
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(self.url, download=False)
-                if info.get('_type') == 'playlist':
-                    logging.info("检测到播放列表，共%d个视频", len(info['entries']))
-                    for entry in info['entries']:
-                        if self.cancelled:
-                            logging.info("下载取消")
-                            return
-                        try:
-                            ydl.download([entry['webpage_url']])
-                            # 添加下载记录
-                            file_path = os.path.join(
-                                self.save_path,
-                                f"{entry.get('title', 'unknown')}_{entry.get('id', '')}.mp4"
-                            )
-                            download_history.add_record(
-                                entry['webpage_url'],
-                                file_path,
-                                file_type="video"
-                            )
-                        except Exception as e:
-                            logging.error("下载视频失败：%s", e)
-                else:
-                    ydl.download([self.url])
-                    # 添加下载记录
-                    if self.current_filename:
-                        download_history.add_record(
-                            self.url,
-                            self.current_filename,
-                            file_type="video"
-                        )
+            with ytdlp_pool.borrow(ydl_opts, self.progress_hook,
+                                   lambda d: self.postprocessor_hook(d, self.stages)) as ydl:
+                info = self.extract_info(ydl, self.url)
+                if info.get('_type') in ('playlist', 'multi_video'):
+                    # 枚举播放列表需要使用提取它的实例
+                    self.download_playlist(info, ydl_opts)
+                    return
+                try:
+                    file_path = self.download_info(ydl, info, self.stages)
+                except yt_dlp.utils.DownloadCancelled:
+                    logging.info("下载取消：%s", self.url)
+                    download_history.add_record(self.url, self.current_filename or "", file_type="video",
+                                                status="cancelled")
+                    return
+                self.progress = dict(self.progress, stages=self.stages)
+                # 添加下载记录
+                if file_path:
+                    download_history.add_record(
+                        self.url,
+                        file_path,
+                        file_type="video"
+                    )
+                    download_archive.add(DownloadArchive.make_id(info), self.url, file_path)
         except Exception as e:
             if self.is_bilibili_url(self.url):
                 logging.error("B站视频下载失败，可能需要登录或更新cookies：%s", e)
@@ -703,6 +2804,290 @@ class VideoDownloader:
         """取消视频下载"""
         self.cancelled = True
 
+    def set_rate_limit(self, rate):
+        """设置本任务的速度上限（字节/秒，0 表示不限制）"""
+        self.rate_bucket.set_rate(rate)
+
+
+class DownloadJob:
+    """下载任务"""
+
+    def __init__(self, job_id, downloader, priority=0):
+        self.job_id = job_id
+        self.downloader = downloader
+        self.priority = priority
+        self.status = "Queued"  # Queued/Downloading/Completed/Failed/Cancelled
+        self.error = None
+        self.created_time = time.time()
+        self.started_time = None
+        self.finished_time = None
+
+    @property
+    def is_finished(self):
+        """任务是否已结束"""
+        return self.status in ("Completed", "Failed", "Cancelled")
+
+    def to_dict(self):
+        """转换为状态字典"""
+        return {
+            'job_id': self.job_id,
+            'url': self.downloader.url,
+            'file': os.path.basename(self.downloader.save_path),
+            'type': "video" if isinstance(self.downloader, VideoDownloader) else "file",
+            'priority': self.priority,
+            'status': self.status,
+            'error': self.error,
+            'created_time': datetime.fromtimestamp(self.created_time).strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+
+class DownloadManager:
+    """下载任务管理器
+
+    使用优先级队列保存等待中的任务，由固定数量的工作线程并发执行。
+    priority 越大越先执行，相同优先级按提交顺序执行。已结束的任务保留
+    FINISHED_JOB_TTL 秒、最多 MAX_FINISHED_JOBS 个，供查询状态。
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or app.config['MAX_CONCURRENT_JOBS']
+        self.jobs = {}
+        self.job_queue = queue.PriorityQueue()
+        self.jobs_lock = threading.Lock()
+        self.counter = itertools.count()
+        self.workers = []
+
+    def start(self):
+        """启动工作线程"""
+        with self.jobs_lock:
+            if self.workers:
+                return
+            for i in range(self.max_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"download-worker-{i}", daemon=True)
+                self.workers.append(worker)
+                worker.start()
+
+    @staticmethod
+    def job_key(downloader):
+        """相同的下载请求：类型、URL、保存目录和期望的校验值都相同"""
+        return (type(downloader), downloader.url, downloader.save_path,
+                getattr(downloader, 'expected_checksum', None), getattr(downloader, 'checksum_url', None))
+
+    def submit(self, downloader, priority=0):
+        """提交下载任务，返回任务对象；相同的下载正在排队或进行时返回那个任务"""
+        self.start()
+        job = DownloadJob(uuid.uuid4().hex[:12], downloader, priority)
+        key = self.job_key(downloader)
+        with self.jobs_lock:
+            self._evict_finished()
+            for existing in self.jobs.values():
+                if not existing.is_finished and self.job_key(existing.downloader) == key:
+                    logging.info("相同的下载任务 %s 尚未结束：%s", existing.job_id, downloader.url)
+                    return existing
+            self.jobs[job.job_id] = job
+        self.job_queue.put((-priority, next(self.counter), job))
+        logging.info("任务 %s 已加入队列：%s", job.job_id, downloader.url)
+        return job
+
+    def get_job(self, job_id):
+        """获取任务"""
+        with self.jobs_lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        """获取所有任务（按提交时间倒序）"""
+        with self.jobs_lock:
+            jobs = list(self.jobs.values())
+        return sorted(jobs, key=lambda job: job.created_time, reverse=True)
+
+    def cancel(self, job_id):
+        """取消任务，排队中的任务直接标记取消，运行中的任务通知下载器停止"""
+        job = self.get_job(job_id)
+        if not job or job.is_finished:
+            return False
+        job.downloader.cancel_download()
+        if job.status == "Queued":
+            job.status = "Cancelled"
+            job.finished_time = time.time()
+        return True
+
+    def _evict_finished(self):
+        """移除过期和超出数量的已结束任务，调用方需持有 jobs_lock"""
+        finished = sorted((job for job in self.jobs.values() if job.is_finished),
+                          key=lambda job: job.finished_time or 0)
+        expire_before = time.time() - app.config['FINISHED_JOB_TTL']
+        excess = len(finished) - app.config['MAX_FINISHED_JOBS']
+        for i, job in enumerate(finished):
+            if i < excess or (job.finished_time or 0) < expire_before:
+                del self.jobs[job.job_id]
+
+    def _worker_loop(self):
+        """工作线程：不断从队列中取出任务执行"""
+        while True:
+            _, _, job = self.job_queue.get()
+            try:
+                if job.status == "Cancelled":
+                    continue
+                self._run_job(job)
+            finally:
+                self.job_queue.task_done()
+
+    def _run_job(self, job):
+        """执行单个任务"""
+        job.status = "Downloading"
+        job.started_time = time.time()
+        try:
+            job.downloader.start_download()
+            job.status = "Cancelled" if job.downloader.cancelled else "Completed"
+        except Exception as e:
+            logging.error("任务 %s 失败：%s", job.job_id, e)
+            job.status = "Failed"
+            job.error = str(e)
+        finally:
+            job.finished_time = time.time()
+            metrics.jobs_finished.inc(job.to_dict()['type'], job.status)
+            with self.jobs_lock:
+                self._evict_finished()
+
+
+# 创建全局下载任务管理器
+download_manager = DownloadManager()
+
+
+class ProgressSubscriber:
+    """一个进度流连接
+
+    尚未发送的事件按 key（任务ID 或 "batch"）合并，客户端读取较慢时
+    只会收到合并后的最新状态，不会积压。
+    """
+
+    def __init__(self, keys=None):
+        self.keys = keys  # None 表示订阅全部任务和批量下载
+        self.condition = threading.Condition()
+        self.pending = {}
+
+    def wants(self, key):
+        return self.keys is None or key in self.keys
+
+    def push(self, event, key, delta):
+        with self.condition:
+            current = self.pending.get(key)
+            if current is None or current[1].get('batch_id') != delta.get('batch_id'):
+                self.pending[key] = (event, dict(delta))
+            else:
+                merged = current[1]
+                if 'results' in merged and 'results' in delta:
+                    # 批量下载的结果是从 offset 开始的增量列表，需要拼接而不是覆盖
+                    merged['results'] = merged['results'][:delta['offset'] - merged['offset']] + delta['results']
+                    delta = {name: value for name, value in delta.items() if name != 'offset'}
+                merged.update(delta)
+            self.condition.notify()
+
+    def pop(self, timeout):
+        """等待并取出所有待发送的事件，超时返回空列表"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending, timeout)
+            events = list(self.pending.values())
+            self.pending.clear()
+        return events
+
+
+class ProgressBroadcaster:
+    """进度推送
+
+    一个后台线程每 PROGRESS_STREAM_INTERVAL 秒对所有未结束的任务和批量下载
+    取一次快照，与上次推送的快照比较，只把变化的字段推送给订阅者。
+    无论有多少个连接，每个周期只采样一次；没有订阅者时线程退出。
+    """
+
+    ID_FIELDS = {'job': 'job_id', 'batch': 'batch_id'}
+
+    def __init__(self, interval=None):
+        self.interval = interval or app.config['PROGRESS_STREAM_INTERVAL']
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.thread = None
+        self.last = {}
+
+    def subscribe(self, keys=None):
+        """添加订阅者并先推送一次完整状态"""
+        subscriber = ProgressSubscriber(keys)
+        for event, key, snapshot in self.snapshots(include_finished=True):
+            if subscriber.wants(key):
+                subscriber.push(event, key, snapshot)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="progress-broadcaster", daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def snapshots(self, include_finished=False):
+        """生成 (事件名, key, 快照)"""
+        for job in download_manager.list_jobs():
+            previous = self.last.get(job.job_id)
+            if (not include_finished and job.is_finished and previous
+                    and previous['status'] == job.status):
+                continue
+            snapshot = job.to_dict()
+            snapshot['progress'] = job.downloader.progress
+            yield 'job', job.job_id, snapshot
+        if 'BATCH_ID' in app.config:
+            results = app.config['BATCH_RESULTS']
+            yield 'batch', 'batch', {
+                'batch_id': app.config['BATCH_ID'],
+                'status': 'running' if batch_thread and batch_thread.is_alive() else 'completed',
+                'total': app.config['BATCH_TOTAL'],
+                'finished': len(results),
+                'offset': 0,
+                'results': list(results)
+            }
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                subscribers = list(self.subscribers)
+                if not subscribers:
+                    self.thread = None
+                    return
+            try:
+                self.broadcast(subscribers)
+            except Exception as e:
+                logging.error("推送下载进度失败：%s", e)
+
+    def broadcast(self, subscribers):
+        # 任务被管理器移除后不再保留它的上次快照
+        for key in [key for key in self.last if key != 'batch' and download_manager.get_job(key) is None]:
+            del self.last[key]
+        for event, key, snapshot in self.snapshots():
+            previous = self.last.get(key, {})
+            if event == 'batch' and previous.get('batch_id') != snapshot['batch_id']:
+                previous = {}
+            delta = {name: value for name, value in snapshot.items()
+                     if name != 'results' and previous.get(name) != value}
+            if event == 'batch':
+                # 批量下载只推送新增的结果，offset 为第一条新结果的序号
+                offset = previous.get('finished', 0)
+                if snapshot['results'][offset:]:
+                    delta['results'] = snapshot['results'][offset:]
+                    delta['offset'] = offset
+            self.last[key] = snapshot
+            if not delta:
+                continue
+            id_field = self.ID_FIELDS[event]
+            delta[id_field] = snapshot[id_field]
+            for subscriber in subscribers:
+                if subscriber.wants(key):
+                    subscriber.push(event, key, delta)
+
+
+progress_broadcaster = ProgressBroadcaster()
+
 
 def is_valid_url(url):
     """验证 URL 合法性"""
@@ -732,222 +3117,619 @@ def format_time(seconds):
         return f"{hours:.0f}小时{minutes:.0f}分钟"
 
 
+def file_hash(file_path, algorithm="sha256"):
+    """流式计算文件的哈希"""
+    hasher = StreamingHasher(algorithm)
+    hasher.advance(file_path, os.path.getsize(file_path))
+    hasher.close()
+    return hasher.hexdigest()
+
+
+def find_checksum_entry(text, names):
+    """从校验文件中找出 names 中某个文件的校验值
+
+    每行为 sha256sum 的 "<hex>  文件名"（二进制模式为 "<hex> *文件名"）或
+    BSD 风格的 "SHA256 (文件名) = <hex>"。只有一个校验值时不检查文件名；
+    有多行但没有匹配的文件名时抛出 ValueError。
+    """
+    entries = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        match = re.fullmatch(r'(\w[\w-]*) \((.+)\) = ([0-9a-fA-F]+)', line)
+        if match:
+            entries.append((match.group(2), f"{match.group(1)}:{match.group(3)}"))
+            continue
+        value, _, name = line.partition(' ')
+        entries.append((name.strip().lstrip('*'), value))
+    if not entries:
+        raise ValueError("校验文件为空")
+    if len(entries) == 1:
+        return entries[0][1]
+    for name, value in entries:
+        if os.path.basename(name.replace('\\', '/')) in names:
+            return value
+    raise ValueError(f"校验文件中没有 {'、'.join(sorted(name for name in names if name))} 的校验值")
+
+
+def parse_checksum(text, default_algorithm=None):
+    """解析 "sha256:<hex>" 或 "<hex>" 格式的校验值，返回 (算法, 十六进制值)
+
+    没有指定算法时按长度判断（32 位 md5、40 位 sha1、64 位 sha256）。
+    """
+    algorithm, _, value = text.strip().rpartition(':')
+    value = value.strip().lower()
+    algorithm = algorithm.strip().lower() or default_algorithm or CHECKSUM_LENGTHS.get(len(value))
+    if algorithm not in CHECKSUM_ALGORITHMS or not re.fullmatch(r'[0-9a-f]+', value) \
+            or len(value) != hashlib.new(algorithm).digest_size * 2:
+        raise ValueError(f"无效的校验值：{text}")
+    return algorithm, value
+
+
 @app.route('/')
 def index():
     """渲染主页面"""
     return render_template('index.html')
 
 
+# 由 yt-dlp 下载的网站：(域名, 路径正则)，域名同时匹配其子域名，
+# 路径正则从路径开头匹配（包括查询字符串），为 None 时匹配该域名下的所有地址
+VIDEO_SITES = (
+    # 国内视频平台
+    ("bilibili.com", r"/video/"),
+    ("b23.tv", None),
+    ("douyin.com", None),
+    ("ixigua.com", None),
+    ("kuaishou.com", None),
+    ("weibo.com", None),
+    ("qq.com", r"/x/cover/"),
+    ("v.qq.com", None),
+    ("mgtv.com", None),
+    ("iqiyi.com", None),
+    ("youku.com", None),
+    ("acfun.cn", None),
+    ("huya.com", None),
+    ("douyu.com", None),
+    ("haokan.baidu.com", None),
+    ("pan.baidu.com", None),
+    ("zhihu.com", r"/zvideo/"),
+    ("xiaohongshu.com", None),
+    ("pipix.com", None),
+    ("ximalaya.com", None),
+    ("music.163.com", None),
+    ("y.qq.com", None),
+    ("kugou.com", None),
+    ("kuwo.cn", None),
+    ("dongchedi.com", None),
+    ("live.bilibili.com", None),
+    ("live.douyin.com", None),
+    ("panda.tv", None),
+    ("yy.com", None),
+
+    # 国外视频平台
+    ("youtube.com", r"/watch\?v="),
+    ("youtu.be", None),
+    ("vimeo.com", None),
+    ("dailymotion.com", None),
+    ("facebook.com", r"/.*?/videos/"),
+    ("fb.watch", None),
+    ("instagram.com", r"/.*?/video/"),
+    ("twitter.com", r"/.*/status/"),
+    ("x.com", r"/.*/status/"),
+    ("tiktok.com", None),
+    ("twitch.tv", None),
+    ("nicovideo.jp", r"/watch/"),
+    ("reddit.com", r"/r/.*/comments/"),
+    ("pornhub.com", None),
+    ("xvideos.com", None),
+    ("xhamster.com", None),
+    ("soundcloud.com", None),
+    ("spotify.com", r"/track/"),
+    ("mixcloud.com", None),
+    ("vk.com", r"/video"),
+    ("ok.ru", r"/video/"),
+    ("rutube.ru", None),
+    ("metacafe.com", None),
+    ("vlive.tv", None),
+    ("naver.com", r"/video/"),
+    ("line.me", r"/share/video/"),
+    ("linkedin.com", r"/posts/"),
+    ("tumblr.com", r"/post/"),
+    ("pinterest.com", r"/pin/"),
+    ("flickr.com", r"/photos/"),
+    ("streamable.com", None),
+    ("streamja.com", None),
+    ("streamye.com", None),
+    ("streamvi.com", None),
+    ("clippituser.tv", None),
+    ("gfycat.com", None),
+    ("imgur.com", None),
+    ("9gag.com", None),
+    ("bitchute.com", None),
+    ("odysee.com", None),
+    ("rumble.com", None),
+    ("archive.org", r"/details/"),
+
+    # 教育平台
+    ("coursera.org", None),
+    ("edx.org", r"/course/"),
+    ("udemy.com", r"/course/"),
+    ("skillshare.com", None),
+    ("lynda.com", None),
+    ("pluralsight.com", None),
+    ("brilliant.org", None),
+    ("masterclass.com", None),
+)
+
+# 地址以这些扩展名结尾时也交给 yt-dlp 下载
+VIDEO_EXTENSIONS = (
+    "mp4", "m3u8", "flv", "mkv", "webm", "avi", "mov", "wmv", "m4v", "mpg", "mpeg", "3gp",
+    "ts", "vob", "ogv", "mxf", "f4v", "rmvb", "rm", "asf", "divx",
+)
+
+# 内置的站点配置，按匹配优先级排列。default 是所有站点共用的基础配置，其他配置在其基础上覆盖：
+#   domains             匹配的域名（包括子域名），可以写成 "域名/路径正则" 只匹配特定路径
+#   host_prefixes       匹配以这些前缀开头的主机名，例如 "live."
+#   format/format_sort  yt-dlp 的格式选择
+#   concurrent_fragments 分片并发下载数
+#   rate_limit          该站点任务默认的速度上限（字节/秒，0 表示不限制），可通过 /rate_limit 按任务修改
+#   postprocessors      后处理器列表，整体替换基础配置中的列表
+#   cookies_from_browser 从浏览器读取 cookies，例如 ["chrome"]
+#   options             其他 yt-dlp 选项，按键合并
+#   video_site          为 true 时 domains 匹配的地址也交给 yt-dlp 下载（用于 VIDEO_SITES 中没有的新站点）
+DEFAULT_SITE_PROFILES = {
+    "default": {
+        "format": "bestvideo*+bestaudio/best",
+        "format_sort": ["res:2160", "res:1440", "res:1080", "res:720", "res:480"],
+        "concurrent_fragments": 8,
+        "rate_limit": 0,
+        "postprocessors": [
+            {"key": "FFmpegVideoConvertor", "preferedformat": "mp4"},
+            {"key": "FFmpegMetadata", "add_metadata": True},
+            {"key": "EmbedThumbnail"},
+        ],
+        "cookies_from_browser": None,
+        "options": {
+            "merge_output_format": "mp4",
+            "writethumbnail": True,
+            "writesubtitles": True,
+            "writeautomaticsub": True,
+            "subtitleslangs": ["zh-CN", "en"],
+            "socket_timeout": 30,  # 连接超时时间
+            "extractor_retries": 3,  # 提取器重试次数
+            "fragment_retries": 10,  # 片段重试次数
+            "skip_unavailable_fragments": True,  # 跳过不可用片段
+            "overwrites": True,  # 覆盖已存在的文件
+        },
+    },
+    "bilibili": {
+        "domains": ["bilibili.com", "b23.tv"],
+        "postprocessors": [
+            {"key": "FFmpegVideoConvertor", "preferedformat": "mp4"},
+            {"key": "FFmpegExtractAudio", "preferredcodec": "aac", "preferredquality": "192"},
+        ],
+        "options": {"extractaudio": True, "keepvideo": True},
+    },
+    "douyin": {
+        "domains": ["douyin.com", "tiktok.com"],
+        "format": "best",
+        "cookies_from_browser": ["chrome"],
+    },
+    "youtube": {
+        "domains": ["youtube.com", "youtu.be"],
+        "postprocessors": [{"key": "FFmpegVideoConvertor", "preferedformat": "mp4"}],
+        "options": {"subtitleslangs": ["zh-Hans", "zh-Hant", "en"]},
+    },
+    "live": {
+        "domains": ["douyu.com", "huya.com", "twitch.tv"],
+        "host_prefixes": ["live."],
+        "format": "best",
+        "concurrent_fragments": 5,
+        "options": {"live_from_start": True, "retry_sleep": 5},
+    },
+    "audio": {
+        "domains": ["soundcloud.com", "ximalaya.com", "com/track/"],
+        "host_prefixes": ["music."],
+        "format": "bestaudio/best",
+        "postprocessors": [
+            {"key": "FFmpegExtractAudio", "preferredcodec": "mp3", "preferredquality": "320"},
+            {"key": "FFmpegMetadata", "add_metadata": True},
+            {"key": "EmbedThumbnail"},
+        ],
+    },
+}
+
+
+class SiteProfileRegistry:
+    """站点配置注册表
+
+    由内置配置、Config.SITE_PROFILES 和 SITE_PROFILES_FILE 依次合并而成，
+    不修改代码即可调整各平台的分片并发数、速度上限、格式、后处理器和 cookies，
+    或者添加新的站点。每个站点合并后的 yt-dlp 选项只生成一次。
+    """
+
+    def __init__(self, *sources):
+        self.profiles = {}
+        for source in sources:
+            self.update(source)
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def update(self, source):
+        """合并一组站点配置，options 按键合并，其他字段整体替换"""
+        for name, spec in source.items():
+            merged = dict(self.profiles.get(name, {}))
+            for field, value in spec.items():
+                if field == "options":
+                    merged["options"] = {**merged.get("options", {}), **value}
+                else:
+                    merged[field] = value
+            self.profiles[name] = merged
+        self.cache = {}
+
+    def spec(self, name):
+        """返回在 default 基础上合并后的站点配置"""
+        spec = copy.deepcopy(self.profiles["default"])
+        for field, value in self.profiles.get(name, {}).items():
+            if field == "options":
+                spec["options"].update(value)
+            else:
+                spec[field] = value
+        return spec
+
+    def rules(self):
+        """生成 URLClassifier 使用的 (配置名, 域名, 主机名前缀, 路径正则) 规则，按配置顺序排列"""
+        rules = []
+        for name, spec in self.profiles.items():
+            if name == "default":
+                continue
+            prefixes = tuple(spec.get("host_prefixes", ()))
+            by_path = collections.defaultdict(list)
+            for item in spec.get("domains", ()):
+                domain, slash, path = item.partition("/")
+                by_path[slash + path if slash else None].append(domain)
+            if not by_path and prefixes:
+                rules.append((name, (), prefixes, None))
+            for path, domains in by_path.items():
+                rules.append((name, tuple(domains), prefixes, path))
+                prefixes = ()
+        return rules
+
+    def video_sites(self):
+        """标记了 video_site 的配置中的 (域名, 路径正则)，补充到 VIDEO_SITES"""
+        return [
+            (domain, slash + path if slash else None)
+            for spec in self.profiles.values() if spec.get("video_site")
+            for domain, slash, path in (item.partition("/") for item in spec.get("domains", ()))
+        ]
+
+    def options(self, name):
+        """返回站点的 yt-dlp 选项（副本），没有对应配置时使用 default"""
+        name = name if name in self.profiles else "default"
+        with self.lock:
+            options = self.cache.get(name)
+            if options is None:
+                spec = self.spec(name)
+                options = dict(spec["options"])
+                options.update({
+                    'format': spec["format"],
+                    'format_sort': list(spec["format_sort"]),
+                    'concurrent_fragment_downloads': spec["concurrent_fragments"],
+                    'postprocessors': spec["postprocessors"],
+                })
+                if app.config['MEDIA_PLANNER']:
+                    options['postprocessors'], media_plan = plan_postprocessors(spec["postprocessors"])
+                    if media_plan:
+                        options['media_plan'] = media_plan
+                if spec.get("cookies_from_browser"):
+                    options['cookiesfrombrowser'] = tuple(spec["cookies_from_browser"])
+                self.cache[name] = options
+        return copy.deepcopy(options)
+
+    def rate_limit(self, name):
+        """站点的速度上限（字节/秒），0 表示不限制"""
+        return self.spec(name if name in self.profiles else "default").get("rate_limit") or 0
+
+
+def load_site_profiles():
+    """创建站点配置注册表，配置文件有误时忽略该文件"""
+    sources = [DEFAULT_SITE_PROFILES, app.config['SITE_PROFILES']]
+    profiles_file = app.config['SITE_PROFILES_FILE']
+    if profiles_file and os.path.exists(profiles_file):
+        try:
+            with open(profiles_file, 'r', encoding='utf-8') as f:
+                sources.append(json.load(f))
+            logging.info("已加载站点配置文件：%s", profiles_file)
+        except (OSError, ValueError) as e:
+            logging.error("读取站点配置文件失败：%s", e)
+    return SiteProfileRegistry(*sources)
+
+
+site_profiles = load_site_profiles()
+
+URLClass = collections.namedtuple("URLClass", ["is_video", "profile"])
+
+
+class URLClassifier:
+    """URL 分类器，判断地址是否交给 yt-dlp 下载以及使用哪个站点配置
+
+    规则在创建时编译：按域名建立索引，同一域名的路径规则合并为一个正则，
+    所有扩展名合并为一个正则。分类时只解析一次主机名，依次用主机名的各级
+    后缀（a.b.com、b.com、com）查索引，不需要逐条尝试规则。
+    """
+
+    def __init__(self, video_sites, extensions, profile_rules):
+        self.video_index = self._build_index((domain, path, True) for domain, path in video_sites)
+        self.extension_pattern = re.compile(
+            r"\.(?:" + "|".join(re.escape(ext) for ext in extensions) + r")$", re.I)
+        self.profile_index = self._build_index(
+            (domain, path, (priority, name))
+            for priority, (name, domains, _, path) in enumerate(profile_rules)
+            for domain in domains
+        )
+        self.profile_prefixes = [
+            (prefix, (priority, name))
+            for priority, (name, _, prefixes, _) in enumerate(profile_rules)
+            for prefix in prefixes
+        ]
+
+    @staticmethod
+    def _build_index(rules):
+        """生成 {域名: [(合并后的路径正则或 None, 值)]}，路径规则相同的值合并为一条"""
+        grouped = collections.defaultdict(lambda: collections.defaultdict(list))
+        for domain, path, value in rules:
+            grouped[domain.lower()][value].append(path)
+        index = {}
+        for domain, values in grouped.items():
+            entries = []
+            for value, paths in values.items():
+                if None in paths:
+                    entries.append((None, value))
+                else:
+                    entries.append((re.compile("|".join(f"(?:{path})" for path in paths), re.I), value))
+            index[domain] = entries
+        return index
+
+    @staticmethod
+    def _lookup(index, suffixes, path):
+        """返回所有匹配的值"""
+        for suffix in suffixes:
+            for pattern, value in index.get(suffix, ()):
+                if pattern is None or pattern.match(path):
+                    yield value
+
+    def classify(self, url):
+        """返回 URLClass(是否为视频地址, 站点配置名或 None)"""
+        parsed = urlparse(url if "//" in url else "//" + url)
+        host = (parsed.hostname or "").rstrip(".")
+        path = parsed.path or "/"
+        if parsed.query:
+            path = f"{path}?{parsed.query}"
+        labels = host.split(".")
+        suffixes = [".".join(labels[i:]) for i in range(len(labels))] if host else []
+
+        is_video = (any(self._lookup(self.video_index, suffixes, path))
+                    or bool(self.extension_pattern.search(url)))
+        candidates = list(self._lookup(self.profile_index, suffixes, path))
+        candidates += [value for prefix, value in self.profile_prefixes if host.startswith(prefix)]
+        profile = min(candidates)[1] if candidates else None
+        return URLClass(is_video, profile)
+
+
+url_classifier = URLClassifier(VIDEO_SITES + tuple(site_profiles.video_sites()), VIDEO_EXTENSIONS,
+                               site_profiles.rules())
+
+
 def is_video_url(url):
     """检测是否为视频URL"""
     if not YTDLP_AVAILABLE:
         return False
-    video_patterns = [
-        # 国内视频平台
-        r'bilibili\.com/video/',
-        r'b23\.tv/',
-        r'douyin\.com/',
-        r'ixigua\.com/',
-        r'kuaishou\.com/',
-        r'weibo\.com/',
-        r'qq\.com/x/cover/',
-        r'v\.qq\.com/',
-        r'mgtv\.com/',
-        r'iqiyi\.com/',
-        r'youku\.com/',
-        r'acfun\.cn/',
-        r'huya\.com/',
-        r'douyu\.com/',
-        r'haokan\.baidu\.com/',
-        r'pan\.baidu\.com/',
-        r'zhihu\.com/zvideo/',
-        r'xiaohongshu\.com/',
-        r'pipix\.com/',
-        r'ximalaya\.com/',
-        r'music\.163\.com/',
-        r'y\.qq\.com/',
-        r'kugou\.com/',
-        r'kuwo\.cn/',
-        r'dongchedi\.com/',
-        r'live\.bilibili\.com/',
-        r'live\.douyin\.com/',
-        r'panda\.tv/',
-        r'yy\.com/',
-
-        # 国外视频平台
-        r'youtube\.com/watch\?v=',
-        r'youtu\.be/',
-        r'vimeo\.com/',
-        r'dailymotion\.com/',
-        r'facebook\.com/.*?/videos/',
-        r'fb\.watch/',
-        r'instagram\.com/.*?/video/',
-        r'twitter\.com/.*/status/',
-        r'x\.com/.*/status/',
-        r'tiktok\.com/',
-        r'twitch\.tv/',
-        r'nicovideo\.jp/watch/',
-        r'reddit\.com/r/.*/comments/',
-        r'pornhub\.com/',
-        r'xvideos\.com/',
-        r'xhamster\.com/',
-        r'soundcloud\.com/',
-        r'spotify\.com/track/',
-        r'mixcloud\.com/',
-        r'vk\.com/video',
-        r'ok\.ru/video/',
-        r'rutube\.ru/',
-        r'metacafe\.com/',
-        r'vlive\.tv/',
-        r'naver\.com/video/',
-        r'line\.me/share/video/',
-        r'linkedin\.com/posts/',
-        r'tumblr\.com/post/',
-        r'pinterest\.com/pin/',
-        r'flickr\.com/photos/',
-        r'streamable\.com/',
-        r'streamja\.com/',
-        r'streamye\.com/',
-        r'streamvi\.com/',
-        r'clippituser\.tv/',
-        r'gfycat\.com/',
-        r'imgur\.com/',
-        r'9gag\.com/',
-        r'bitchute\.com/',
-        r'odysee\.com/',
-        r'rumble\.com/',
-        r'archive\.org/details/',
-
-        # 教育平台
-        r'coursera\.org/',
-        r'edx\.org/course/',
-        r'udemy\.com/course/',
-        r'skillshare\.com/',
-        r'lynda\.com/',
-        r'pluralsight\.com/',
-        r'brilliant\.org/',
-        r'masterclass\.com/',
-
-        # 通用视频格式
-        r'\.mp4$',
-        r'\.m3u8$',
-        r'\.flv$',
-        r'\.mkv$',
-        r'\.webm$',
-        r'\.avi$',
-        r'\.mov$',
-        r'\.wmv$',
-        r'\.m4v$',
-        r'\.mpg$',
-        r'\.mpeg$',
-        r'\.3gp$',
-        r'\.ts$',
-        r'\.vob$',
-        r'\.ogv$',
-        r'\.mxf$',
-        r'\.f4v$',
-        r'\.rmvb$',
-        r'\.rm$',
-        r'\.asf$',
-        r'\.divx$'
-    ]
-    return any(re.search(pattern, url, re.I) for pattern in video_patterns)
+    return url_classifier.classify(url).is_video
 
 
 @app.route('/start_download', methods=['POST'])
 def start_download():
     """统一的下载入口"""
-    global download_thread, downloader
-    with lock:
-        if download_thread and download_thread.is_alive():
-            return jsonify({'status': 'Error', 'message': '已有下载任务正在进行'}), 409
-        try:
-            url = request.json.get('url')
-            user_path = request.json.get('path')
-            save_path = os.path.abspath(user_path) if user_path else app.config["SAVE_PATH"]
-
-            if not is_valid_url(url):
-                return jsonify({'status': 'Error', 'message': '无效的URL'}), 400
-
-            # 根据URL类型选择下载器
-            if is_video_url(url):
-                if not YTDLP_AVAILABLE:
-                    return jsonify({
-                        'status': 'Error',
-                        'message': '未安装yt-dlp模块，无法下载视频。请运行: pip install yt-dlp'
-                    }), 400
-                downloader = VideoDownloader(url, save_path)
-            else:
-                downloader = Downloader(url, save_path)
+    try:
+        url = request.json.get('url')
+        user_path = request.json.get('path')
+        priority = int(request.json.get('priority', 0))
+        mirrors = request.json.get('mirrors') or []  # 同一文件的其他下载地址
+        checksum = request.json.get('checksum')  # 例如 "sha256:<hex>"
+        checksum_url = request.json.get('checksum_url')  # 例如 .sha256 校验文件的地址
+        save_path = os.path.abspath(user_path) if user_path else app.config["SAVE_PATH"]
 
-            download_thread = threading.Thread(target=downloader.start_download, daemon=True)
-            download_thread.start()
-            return jsonify({'status': 'Download started', 'file': os.path.basename(save_path)})
-        except Exception as e:
-            logging.error("启动下载失败：%s", e)
-            return jsonify({'status': 'Error', 'message': str(e)}), 500
+        if not is_valid_url(url):
+            return jsonify({'status': 'Error', 'message': '无效的URL'}), 400
+        if checksum:
+            try:
+                parse_checksum(checksum)
+            except ValueError as e:
+                return jsonify({'status': 'Error', 'message': str(e)}), 400
+        if checksum_url and not is_valid_url(checksum_url):
+            return jsonify({'status': 'Error', 'message': '无效的校验文件URL'}), 400
+        invalid_mirrors = [mirror for mirror in mirrors if not is_valid_url(mirror)]
+        if invalid_mirrors:
+            return jsonify({
+                'status': 'Error',
+                'message': '存在无效的镜像URL',
+                'invalid_urls': invalid_mirrors
+            }), 400
+
+        # 根据URL类型选择下载器
+        if is_video_url(url):
+            if not YTDLP_AVAILABLE:
+                return jsonify({
+                    'status': 'Error',
+                    'message': '未安装yt-dlp模块，无法下载视频。请运行: pip install yt-dlp'
+                }), 400
+            downloader = VideoDownloader(url, save_path)
+        else:
+            downloader = Downloader(url, save_path, mirrors=mirrors,
+                                    checksum=checksum, checksum_url=checksum_url)
+
+        job = download_manager.submit(downloader, priority)
+        return jsonify({
+            'status': 'Download started',
+            'job_id': job.job_id,
+            'file': os.path.basename(save_path)
+        })
+    except Exception as e:
+        logging.error("启动下载失败：%s", e)
+        return jsonify({'status': 'Error', 'message': str(e)}), 500
 
 
 @app.route('/start_video_download', methods=['POST'])
 def start_video_download():
     """启动视频下载"""
-    global download_thread, downloader
-    with lock:
-        if download_thread and download_thread.is_alive():
-            return jsonify({
-                'status': 'Error',
-                'message': 'A download is already in progress'
-            }), 409
-        try:
-            video_url = request.json.get('videoUrl')
-            save_path = app.config["SAVE_PATH"]
-            user_agent = app.config["USER_AGENT"]
+    try:
+        video_url = request.json.get('videoUrl')
+        priority = int(request.json.get('priority', 0))
+        save_path = app.config["SAVE_PATH"]
+        user_agent = app.config["USER_AGENT"]
 
-            if not is_valid_url(video_url):
-                return jsonify({'status': 'Error', 'message': 'Invalid URL'}), 400
+        if not is_valid_url(video_url):
+            return jsonify({'status': 'Error', 'message': 'Invalid URL'}), 400
 
-            downloader = VideoDownloader(video_url, save_path, user_agent)
-            download_thread = threading.Thread(target=downloader.start_download, daemon=True)
-            download_thread.start()
-            return jsonify({'status': 'Download started', 'file': os.path.basename(save_path)})
-        except Exception as e:
-            logging.error("启动视频下载失败：%s", e)
-            return jsonify({'status': 'Error', 'message': str(e)}), 500
+        downloader = VideoDownloader(video_url, save_path, user_agent)
+        job = download_manager.submit(downloader, priority)
+        return jsonify({
+            'status': 'Download started',
+            'job_id': job.job_id,
+            'file': os.path.basename(save_path)
+        })
+    except Exception as e:
+        logging.error("启动视频下载失败：%s", e)
+        return jsonify({'status': 'Error', 'message': str(e)}), 500
 
 
-@app.route('/cancel_download', methods=['POST'])
-def cancel_download():
+@app.route('/cancel_download/<job_id>', methods=['POST'])
+def cancel_download(job_id):
     """取消下载任务"""
-    global download_thread, downloader
-
-    if downloader:
-        downloader.cancel_download()
-        if download_thread.is_alive():
-            download_thread.join()  # 等待线程结束
-        return jsonify({'status': 'Download cancelled'})
-    return jsonify({'status': 'No active download'})
+    if download_manager.get_job(job_id) is None:
+        return jsonify({'status': 'Error', 'message': '任务不存在'}), 404
+    if download_manager.cancel(job_id):
+        return jsonify({'status': 'Download cancelled', 'job_id': job_id})
+    return jsonify({'status': 'No active download', 'job_id': job_id})
 
 
 @app.route('/download_status', methods=['GET'])
 def download_status():
-    """查询下载状态"""
-    global downloader
-    if downloader and not downloader.cancelled:
-        file_name = os.path.basename(downloader.save_path)
-        status = "Downloading" if download_thread and download_thread.is_alive() else "Completed"
-        progress = app.config.get('PROGRESS', {
-            'percentage': 0,
-            'downloaded': '0B',
-            'total': '0B',
-            'speed': '0B/s',
-            'eta': '未知'
-        })
-        return jsonify({
-            'status': status,
-            'file': file_name,
-            'progress': progress
-        })
-    return jsonify({'status': 'No download started'})
+    """查询所有下载任务的状态"""
+    jobs = [job.to_dict() for job in download_manager.list_jobs()]
+    return jsonify({
+        'active': sum(1 for job in jobs if job['status'] == "Downloading"),
+        'queued': sum(1 for job in jobs if job['status'] == "Queued"),
+        'jobs': jobs
+    })
+
+
+@app.route('/download_status/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """查询单个下载任务的状态"""
+    job = download_manager.get_job(job_id)
+    if job is None:
+        return jsonify({'status': 'Error', 'message': '任务不存在'}), 404
+    result = job.to_dict()
+    result['progress'] = job.downloader.progress
+    return jsonify(result)
+
+
+@app.route('/download_progress/<job_id>', methods=['GET'])
+def job_progress(job_id):
+    """查询单个下载任务的进度"""
+    job = download_manager.get_job(job_id)
+    if job is None:
+        return jsonify({'status': 'Error', 'message': '任务不存在'}), 404
+    return jsonify({
+        'job_id': job_id,
+        'status': job.status,
+        'progress': job.downloader.progress
+    })
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """以 Prometheus 文本格式导出运行指标"""
+    counts = collections.Counter(job.status for job in download_manager.list_jobs())
+    metrics.jobs.set("active", value=counts["Downloading"])
+    metrics.jobs.set("queued", value=counts["Queued"])
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/progress_stream', methods=['GET'])
+def progress_stream():
+    """以 Server-Sent Events 推送下载进度
+
+    查询参数 job_id（可重复）只订阅指定任务，batch=1 订阅批量下载，都不提供时订阅全部。
+    连接建立后先推送一次完整状态，之后只推送变化的字段。
+    """
+    job_ids = request.args.getlist('job_id')
+    keys = set(job_ids)
+    if request.args.get('batch'):
+        keys.add('batch')
+    subscriber = progress_broadcaster.subscribe(keys or None)
+    keepalive = app.config['PROGRESS_STREAM_KEEPALIVE']
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                events = subscriber.pop(keepalive)
+                if not events:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield "".join(
+                    f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                    for event, data in events
+                )
+        finally:
+            progress_broadcaster.unsubscribe(subscriber)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@app.route('/rate_limit', methods=['GET'])
+def get_rate_limit():
+    """查询当前的速度上限"""
+    return jsonify({'status': 'success', 'limits': bandwidth_limiter.get_limits()})
+
+
+@app.route('/rate_limit', methods=['POST'])
+def set_rate_limit():
+    """调整速度上限
+
+    scope 为 global、host 或 job；host 和 job 需要通过 target 指定主机名或任务ID；
+    limit 单位为字节/秒，0 表示不限制。
+    """
+    try:
+        scope = request.json.get('scope', 'global')
+        target = request.json.get('target')
+        limit = int(request.json.get('limit', 0))
+        if limit < 0:
+            return jsonify({'status': 'Error', 'message': '速度上限不能为负数'}), 400
+
+        if scope == 'global':
+            bandwidth_limiter.set_global_limit(limit)
+        elif scope == 'host':
+            if not target:
+                return jsonify({'status': 'Error', 'message': '未指定主机'}), 400
+            bandwidth_limiter.set_host_limit(target.lower(), limit)
+        elif scope == 'job':
+            job = download_manager.get_job(target)
+            if job is None:
+                return jsonify({'status': 'Error', 'message': '任务不存在'}), 404
+            job.downloader.set_rate_limit(limit)
+        else:
+            return jsonify({'status': 'Error', 'message': '无效的scope'}), 400
+
+        return jsonify({'status': 'success', 'limits': bandwidth_limiter.get_limits()})
+    except (TypeError, ValueError) as e:
+        return jsonify({'status': 'Error', 'message': str(e)}), 400
 
 
 def open_browser():
@@ -979,15 +3761,19 @@ def start_batch_download():
         if not os.path.exists(save_path):
             os.makedirs(save_path, exist_ok=True)
 
-        # 创建批量下载线程
+        # 创建批量下载线程，每个文件完成后立即写入结果
         def batch_download_task():
-            results = Downloader.batch_download(urls, save_path)
-            with app.app_context():
-                app.config['BATCH_RESULTS'] = results
-
-        global download_thread
-        download_thread = threading.Thread(target=batch_download_task, daemon=True)
-        download_thread.start()
+            Downloader.batch_download(urls, save_path, on_result=app.config['BATCH_RESULTS'].append)
+
+        global batch_thread
+        with lock:
+            if batch_thread and batch_thread.is_alive():
+                return jsonify({'status': 'Error', 'message': '已有批量下载任务正在进行'}), 409
+            app.config['BATCH_RESULTS'] = []
+            app.config['BATCH_TOTAL'] = len(urls)
+            app.config['BATCH_ID'] = uuid.uuid4().hex[:12]
+            batch_thread = threading.Thread(target=batch_download_task, daemon=True)
+            batch_thread.start()
 
         return jsonify({
             'status': 'Batch download started',
@@ -1003,10 +3789,12 @@ def start_batch_download():
 def batch_download_status():
     """获取批量下载状态"""
     results = app.config.get('BATCH_RESULTS', [])
-    is_running = download_thread and download_thread.is_alive() if download_thread else False
+    is_running = batch_thread.is_alive() if batch_thread else False
 
     return jsonify({
         'status': 'running' if is_running else 'completed',
+        'total': app.config.get('BATCH_TOTAL', len(results)),
+        'finished': len(results),
         'results': results
     })
 
@@ -1014,35 +3802,94 @@ def batch_download_status():
 
 
 class DownloadHistory:
-    """下载历史记录管理"""
+    """下载历史记录管理
 
-    def __init__(self):
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        self.history_file = os.path.join(base_dir, Config.HISTORY_FILE)
-        self.load_history()
+    记录保存在 SQLite 数据库中（WAL 模式），url、file_path、status 和
+    download_time 都建有索引：添加记录是一次插入，删除记录走索引，
+    不再需要每次重写整个文件。首次启动时会把旧版 JSON 文件中的记录迁移过来。
+    """
 
-    def load_history(self):
-        """加载下载历史"""
-        try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, 'r', encoding='utf-8') as f:
-                    self.history = json.load(f)
-            else:
-                self.history = []
-        except Exception as e:
-            logging.error("加载历史记录失败：%s", e)
-            self.history = []
+    COLUMNS = ("url", "file_path", "file_name", "file_type", "file_size", "download_time", "status",
+               "checksum", "checksum_verified")
 
-    def save_history(self):
-        """保存下载历史"""
+    def __init__(self, db_file=None):
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.db_file = db_file or os.path.join(base_dir, Config.HISTORY_DB)
+        self.history_file = os.path.join(os.path.dirname(self.db_file), Config.HISTORY_FILE)
+        self.lock = threading.Lock()
+        # 每次写入都会改变版本号，用作 /download_history 的 ETag
+        self.instance_id = uuid.uuid4().hex[:8]
+        self.revision = 0
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.create_tables()
+        if db_file is None:
+            # 只有默认数据库才迁移旧版 JSON 文件
+            self.migrate_json()
+
+    def create_tables(self):
+        """创建数据表和索引"""
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    file_name TEXT,
+                    file_type TEXT,
+                    file_size INTEGER DEFAULT 0,
+                    download_time TEXT,
+                    status TEXT,
+                    checksum TEXT,
+                    checksum_verified INTEGER
+                )
+            """)
+            # 旧数据库没有校验值相关的列
+            existing = {row[1] for row in self.conn.execute("PRAGMA table_info(history)")}
+            for column, column_type in (("checksum", "TEXT"), ("checksum_verified", "INTEGER")):
+                if column not in existing:
+                    self.conn.execute(f"ALTER TABLE history ADD COLUMN {column} {column_type}")
+            for column in ("url", "file_path", "status", "download_time"):
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_history_{column} ON history ({column})")
+
+    def migrate_json(self):
+        """把旧版 JSON 历史记录导入数据库，导入后把 JSON 文件重命名为 .bak"""
+        if not os.path.exists(self.history_file):
+            return
         try:
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(self.history, f, ensure_ascii=False, indent=2)
+            with open(self.history_file, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+            # JSON 中最新的记录在最前面，倒序插入以保持 id 递增即时间递增
+            rows = [tuple(record.get(column) for column in self.COLUMNS) for record in reversed(records)]
+            with self.lock, self.conn:
+                self.conn.executemany(
+                    f"INSERT INTO history ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                    rows
+                )
+                self.touch()
+            os.replace(self.history_file, self.history_file + ".bak")
+            logging.info("已将 %d 条历史记录迁移到数据库", len(rows))
         except Exception as e:
-            logging.error("保存历史记录失败：%s", e)
+            logging.error("迁移历史记录失败：%s", e)
+
+    @property
+    def version(self):
+        """历史记录版本号，进程重启或任何写入后都会变化"""
+        return f"{self.instance_id}-{self.revision}"
 
-    def add_record(self, url, file_path, file_type="file", status="completed"):
-        """添加下载记录"""
+    def touch(self):
+        """更新版本号，调用方需持有 self.lock"""
+        self.revision += 1
+
+    def add_record(self, url, file_path, file_type="file", status="completed",
+                   checksum=None, checksum_verified=None):
+        """添加下载记录，checksum 为 "算法:十六进制值"，checksum_verified 表示是否与期望值核对过"""
+        with metrics.history_latency.time("add"):
+            self._add_record(url, file_path, file_type, status, checksum, checksum_verified)
+
+    def _add_record(self, url, file_path, file_type, status, checksum, checksum_verified):
         try:
             record = {
                 "url": url,
@@ -1051,18 +3898,25 @@ class DownloadHistory:
                 "file_type": file_type,
                 "file_size": os.path.getsize(file_path) if os.path.exists(file_path) else 0,
                 "download_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "status": status
+                "status": status,
+                "checksum": checksum,
+                "checksum_verified": None if checksum_verified is None else int(checksum_verified)
             }
-            self.history.insert(0, record)  # 新记录插入到最前面
-            self.save_history()
+            with self.lock, self.conn:
+                self.conn.execute(
+                    f"INSERT INTO history ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                    tuple(record[column] for column in self.COLUMNS)
+                )
+                self.touch()
         except Exception as e:
             logging.error("添加下载记录失败：%s", e)
 
     def remove_record(self, file_path, delete_file=False):
         """删除下载记录"""
         try:
-            self.history = [h for h in self.history if h["file_path"] != file_path]
-            self.save_history()
+            with metrics.history_latency.time("remove"), self.lock, self.conn:
+                self.conn.execute("DELETE FROM history WHERE file_path = ?", (file_path,))
+                self.touch()
             if delete_file and os.path.exists(file_path):
                 os.remove(file_path)
                 return True
@@ -1072,20 +3926,316 @@ class DownloadHistory:
         return True
 
     def get_history(self, limit=50):
-        """获取下载历史"""
-        return self.history[:limit]
+        """获取下载历史（最新的在前）"""
+        records, _ = self.query(limit=limit)
+        return records
+
+    def query(self, limit=50, cursor=None, status=None, file_type=None,
+              date_from=None, date_to=None, search=None):
+        """分页查询下载历史
+
+        按 id 倒序返回，cursor 为上一页最后一条记录的 id。
+        date_from/date_to 为 "YYYY-MM-DD" 或 "YYYY-MM-DD HH:MM:SS"（包含边界），
+        search 在文件名和 URL 中做子串匹配。返回 (records, next_cursor)，没有下一页时
+        next_cursor 为 None。
+        """
+        conditions = []
+        params = []
+        if cursor is not None:
+            conditions.append("id < ?")
+            params.append(cursor)
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if file_type:
+            conditions.append("file_type = ?")
+            params.append(file_type)
+        if date_from:
+            conditions.append("download_time >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("download_time <= ?")
+            params.append(date_to + " 23:59:59" if len(date_to) == 10 else date_to)
+        if search:
+            pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            conditions.append("(file_name LIKE ? ESCAPE '\\' OR url LIKE ? ESCAPE '\\')")
+            params.extend([pattern, pattern])
+
+        sql = f"SELECT id, {', '.join(self.COLUMNS)} FROM history"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        # 多取一条用来判断是否还有下一页
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        with metrics.history_latency.time("query"), self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        records = [dict(row) for row in rows[:limit]]
+        next_cursor = records[-1]["id"] if len(rows) > limit else None
+        return records, next_cursor
 
 
 # 创建全局下载历史管理器
 download_history = DownloadHistory()
 
 
+class DedupIndex:
+    """已下载文件的内容索引
+
+    与下载历史使用同一个数据库。按 (url, validator, size) 查找远程文件未变化的
+    已下载文件；开启 DEDUP_HASH 时还按 (sha256, size) 查找内容相同的文件。
+    """
+
+    def __init__(self, db_file):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS content_index (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL,
+                    validator TEXT,
+                    size INTEGER NOT NULL,
+                    file_path TEXT NOT NULL,
+                    sha256 TEXT
+                )
+            """)
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_content_url ON content_index (url, validator, size)")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_content_sha256 ON content_index (sha256, size)")
+
+    def add(self, url, validator, size, file_path, sha256=None):
+        """记录一个下载完成的文件"""
+        try:
+            with self.lock, self.conn:
+                self.conn.execute(
+                    "INSERT INTO content_index (url, validator, size, file_path, sha256) VALUES (?, ?, ?, ?, ?)",
+                    (url, validator, size, file_path, sha256)
+                )
+        except sqlite3.Error as e:
+            logging.error("写入去重索引失败：%s", e)
+
+    def lookup(self, url, validator, size):
+        """查找远程文件未变化的已下载文件"""
+        return self._first_existing(
+            "SELECT id, file_path FROM content_index WHERE url = ? AND validator = ? AND size = ? ORDER BY id DESC",
+            (url, validator, size), size
+        )
+
+    def find_by_hash(self, sha256, size):
+        """查找内容相同的已下载文件"""
+        return self._first_existing(
+            "SELECT id, file_path FROM content_index WHERE sha256 = ? AND size = ? ORDER BY id DESC",
+            (sha256, size), size
+        )
+
+    def _first_existing(self, sql, params, size):
+        """返回第一个仍然存在且大小一致的文件，顺便清理失效的记录"""
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        stale = []
+        found = None
+        for row_id, file_path in rows:
+            if os.path.isfile(file_path) and os.path.getsize(file_path) == size:
+                found = file_path
+                break
+            stale.append((row_id,))
+        if stale:
+            with self.lock, self.conn:
+                self.conn.executemany("DELETE FROM content_index WHERE id = ?", stale)
+        return found
+
+
+dedup_index = DedupIndex(download_history.db_file)
+
+
+class DownloadArchive:
+    """已下载视频的归档
+
+    与下载历史使用同一个数据库，以 "提取器 视频ID"（与 yt-dlp --download-archive
+    的格式相同）为主键。枚举播放列表时先查归档，已下载的视频不再提取，
+    定期同步频道时只需处理新增的视频。记录的文件被删除后视为未下载。
+    """
+
+    def __init__(self, db_file):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS download_archive (
+                    archive_id TEXT PRIMARY KEY,
+                    url TEXT,
+                    file_path TEXT,
+                    download_time TEXT
+                )
+            """)
+
+    @staticmethod
+    def make_id(info):
+        """由提取结果生成归档ID，缺少提取器或视频ID时返回 None"""
+        extractor = info.get('extractor_key') or info.get('ie_key')
+        video_id = info.get('id')
+        if not extractor or not video_id:
+            return None
+        return f"{extractor.lower()} {video_id}"
+
+    def add(self, archive_id, url, file_path):
+        """记录一个下载完成的视频"""
+        if not archive_id:
+            return
+        try:
+            with self.lock, self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO download_archive (archive_id, url, file_path, download_time) "
+                    "VALUES (?, ?, ?, ?)",
+                    (archive_id, url, file_path, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                )
+        except sqlite3.Error as e:
+            logging.error("写入下载归档失败：%s", e)
+
+    def contains(self, archive_id):
+        """视频是否已下载且文件仍然存在"""
+        if not archive_id:
+            return False
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT file_path FROM download_archive WHERE archive_id = ?", (archive_id,)
+            ).fetchone()
+        return row is not None and (not row[0] or os.path.exists(row[0]))
+
+
+download_archive = DownloadArchive(download_history.db_file)
+
+
+class DuplicateScanner:
+    """在后台查找保存目录中内容重复的文件
+
+    先按文件大小分组，再比较开头 64KB 的哈希，最后只对仍然相同的候选文件
+    计算完整的 SHA-256，避免读取所有文件。
+    """
+
+    HEAD_SIZE = 64 * 1024
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.status = "Idle"
+        self.scanned = 0
+        self.duplicates = []
+        self.error = None
+
+    def start(self, path):
+        """启动扫描，已有扫描在进行时返回 False"""
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return False
+            self.status = "Scanning"
+            self.scanned = 0
+            self.duplicates = []
+            self.error = None
+            self.thread = threading.Thread(target=self.scan, args=(path,), daemon=True)
+            self.thread.start()
+        return True
+
+    def scan(self, path):
+        try:
+            by_size = collections.defaultdict(list)
+            for root, _, files in os.walk(path):
+                for name in files:
+                    file_path = os.path.join(root, name)
+                    if os.path.islink(file_path):
+                        continue
+                    try:
+                        stat = os.stat(file_path)
+                    except OSError:
+                        continue
+                    self.scanned += 1
+                    if stat.st_size > 0:
+                        by_size[stat.st_size].append((file_path, (stat.st_dev, stat.st_ino)))
+
+            duplicates = []
+            for size, entries in by_size.items():
+                # 硬链接到同一 inode 的文件不算重复
+                unique = list({inode: file_path for file_path, inode in entries}.values())
+                if len(unique) < 2:
+                    continue
+                for group in self.group_by(unique, self.head_hash):
+                    for files in self.group_by(group, file_hash):
+                        duplicates.append({"size": size, "files": sorted(files)})
+            with self.lock:
+                self.duplicates = duplicates
+                self.status = "Completed"
+            logging.info("重复文件扫描完成：%d 个文件，%d 组重复", self.scanned, len(duplicates))
+        except Exception as e:
+            logging.error("重复文件扫描失败：%s", e)
+            with self.lock:
+                self.error = str(e)
+                self.status = "Failed"
+
+    def head_hash(self, file_path):
+        with open(file_path, 'rb') as f:
+            return hashlib.md5(f.read(self.HEAD_SIZE)).hexdigest()
+
+    def group_by(self, files, key):
+        """按 key 分组，只返回包含多个文件的组"""
+        groups = collections.defaultdict(list)
+        for file_path in files:
+            try:
+                groups[key(file_path)].append(file_path)
+            except OSError:
+                continue
+        return [group for group in groups.values() if len(group) > 1]
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'status': self.status,
+                'scanned': self.scanned,
+                'duplicates': self.duplicates,
+                'wasted': sum(item['size'] * (len(item['files']) - 1) for item in self.duplicates),
+                'error': self.error
+            }
+
+
+duplicate_scanner = DuplicateScanner()
+
+
 @app.route('/download_history', methods=['GET'])
 def get_download_history():
-    """获取下载历史"""
+    """获取下载历史
+
+    查询参数：limit、cursor（上一页返回的 next_cursor）、status、file_type、
+    date_from、date_to、search。历史记录未变化时根据 If-None-Match 返回 304。
+    """
     try:
-        history = download_history.get_history()
-        return jsonify({'status': 'success', 'history': history})
+        args = request.args
+        etag = hashlib.md5(
+            f"{download_history.version}?{request.query_string.decode()}".encode()
+        ).hexdigest()
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+
+        try:
+            limit = min(max(int(args.get('limit', Config.HISTORY_PAGE_SIZE)), 1), Config.HISTORY_MAX_PAGE_SIZE)
+            cursor = int(args['cursor']) if args.get('cursor') else None
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'limit 和 cursor 必须是整数'}), 400
+
+        history, next_cursor = download_history.query(
+            limit=limit,
+            cursor=cursor,
+            status=args.get('status'),
+            file_type=args.get('file_type'),
+            date_from=args.get('date_from'),
+            date_to=args.get('date_to'),
+            search=args.get('search')
+        )
+        response = jsonify({'status': 'success', 'history': history, 'next_cursor': next_cursor})
+        response.set_etag(etag)
+        return response
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -1108,6 +4258,20 @@ def delete_download():
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+@app.route('/duplicate_scan', methods=['POST'])
+def start_duplicate_scan():
+    """在后台扫描保存目录中的重复文件"""
+    if not duplicate_scanner.start(app.config['SAVE_PATH']):
+        return jsonify({'status': 'Error', 'message': '已有扫描正在进行'}), 409
+    return jsonify({'status': 'Scan started'})
+
+
+@app.route('/duplicate_scan', methods=['GET'])
+def duplicate_scan_status():
+    """获取重复文件扫描的状态和结果"""
+    return jsonify(duplicate_scanner.to_dict())
+
+
 @app.route('/cookies')
 def cookies_page():
     """渲染cookies管理页面"""
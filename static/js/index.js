@@ -1,3 +1,6 @@
+// 当前页面跟踪的下载任务ID
+let currentJobId = null;
+
 function updateProgress(progressData) {
     const progressBar = document.getElementById('progress-bar');
     const progressContainer = document.getElementById('progress-container');
@@ -57,18 +60,8 @@ function startDownload() {
     .then(data => {
         status.innerText = `下载状态：${data.status}，文件名：${data.file}`;
         if (data.status === 'Download started') {
-            const interval = setInterval(() => {
-                fetch('/download_status')
-                    .then(response => response.json())
-                    .then(statusData => {
-                        if (statusData.status === 'Downloading') {
-                            updateProgress(statusData.progress);
-                        } else {
-                            clearInterval(interval);
-                            progressContainer.style.display = 'none';
-                        }
-                    });
-            }, 1000);
+            currentJobId = data.job_id;
+            watchJob(data.job_id, job => updateProgress(job.progress));
         }
     })
     .catch(err => {
@@ -79,9 +72,13 @@ function startDownload() {
 
 function cancelDownload() {
     const status = document.getElementById('status');
+    if (!currentJobId) {
+        status.innerText = "下载状态：没有正在进行的下载";
+        return;
+    }
     status.innerText = "下载状态：正在取消下载...";
     status.classList.remove('error');
-    fetch('/cancel_download', { method: 'POST' })
+    fetch(`/cancel_download/${currentJobId}`, { method: 'POST' })
         .then(response => response.json())
         .then(data => {
             status.innerText = `下载状态：${data.status}`;
@@ -116,18 +113,8 @@ function startVideoDownload() {
     .then(data => {
         status.innerText = `下载状态：${data.status}，文件名：${data.file}`;
         if (data.status === 'Download started') {
-            const interval = setInterval(() => {
-                fetch('/download_status')
-                    .then(response => response.json())
-                    .then(statusData => {
-                        if (statusData.status === 'Downloading') {
-                            updateProgress(statusData);
-                        } else {
-                            clearInterval(interval);
-                            progressContainer.style.display = 'none';
-                        }
-                    });
-            }, 1000);
+            currentJobId = data.job_id;
+            watchJob(data.job_id, job => updateProgress(job.progress));
         }
     })
     .catch(err => {
@@ -136,6 +123,27 @@ function startVideoDownload() {
     });
 }
 
+function watchJob(jobId, onProgress) {
+    // 通过 Server-Sent Events 接收任务进度，服务器只推送变化的字段
+    const status = document.getElementById('status');
+    const progressContainer = document.getElementById('progress-container');
+    const source = new EventSource(`/progress_stream?job_id=${encodeURIComponent(jobId)}`);
+    const job = {};
+
+    source.addEventListener('job', event => {
+        Object.assign(job, JSON.parse(event.data));
+        if (job.status === 'Queued') {
+            status.innerText = "下载状态：排队中...";
+        } else if (job.status === 'Downloading') {
+            onProgress(job);
+        } else if (job.status) {
+            source.close();
+            progressContainer.style.display = 'none';
+            loadDownloadHistory();
+        }
+    });
+}
+
 function startBatchDownload() {
     const urlsText = document.getElementById('batch-urls').value;
     const path = document.getElementById('path').value || "";
@@ -178,48 +186,103 @@ function startBatchDownload() {
 }
 
 function checkBatchStatus() {
-    const interval = setInterval(() => {
-        fetch('/batch_download_status')
-            .then(response => response.json())
-            .then(data => {
-                const batchResults = document.getElementById('batch-results');
-                const status = document.getElementById('status');
-                
-                if (data.status === 'completed') {
-                    clearInterval(interval);
-                    status.innerText = "批量下载已完成";
-                    
-                    // 显示详细结果
-                    let resultsHtml = '<h3>下载结果：</h3><ul>';
-                    data.results.forEach(result => {
-                        resultsHtml += `<li>${result.url}: ${result.status}`;
-                        if (result.error) {
-                            resultsHtml += ` - ${result.error}`;
-                        }
-                        resultsHtml += '</li>';
-                    });
-                    resultsHtml += '</ul>';
-                    
-                    batchResults.innerHTML = resultsHtml;
-                    batchResults.style.display = 'block';
+    // 通过 Server-Sent Events 接收批量下载进度，新结果以 offset 开始的增量推送
+    const source = new EventSource('/progress_stream?batch=1');
+    const batch = { results: [] };
+
+    source.addEventListener('batch', event => {
+        const data = JSON.parse(event.data);
+        if (data.batch_id !== batch.batch_id) {
+            batch.results = [];
+        }
+        if (data.results) {
+            batch.results.splice(data.offset, batch.results.length - data.offset, ...data.results);
+        }
+        Object.assign(batch, data, { results: batch.results });
+
+        const batchResults = document.getElementById('batch-results');
+        const status = document.getElementById('status');
+
+        if (batch.status === 'completed') {
+            source.close();
+            status.innerText = "批量下载已完成";
+            loadDownloadHistory();
+        } else {
+            status.innerText = `批量下载中：已完成 ${batch.finished}/${batch.total}`;
+        }
+
+        // 显示已完成文件的结果
+        if (batch.results.length > 0) {
+            let resultsHtml = '<h3>下载结果：</h3><ul>';
+            batch.results.forEach(result => {
+                resultsHtml += `<li>${result.url}: ${result.status}`;
+                if (result.error) {
+                    resultsHtml += ` - ${result.error}`;
                 }
+                resultsHtml += '</li>';
             });
-    }, 1000);
+            resultsHtml += '</ul>';
+
+            batchResults.innerHTML = resultsHtml;
+            batchResults.style.display = 'block';
+        }
+    });
 }
 
-function loadDownloadHistory() {
-    fetch('/download_history')
-        .then(response => response.json())
+// 下载历史分页状态
+let historyCursor = null;
+let historyEtag = null;
+let historyItems = [];
+let historyFilterTimer = null;
+
+function historyQuery(cursor) {
+    const params = new URLSearchParams();
+    const filters = {
+        search: document.getElementById('history-search').value.trim(),
+        status: document.getElementById('history-status').value,
+        file_type: document.getElementById('history-type').value,
+        date_from: document.getElementById('history-date-from').value,
+        date_to: document.getElementById('history-date-to').value
+    };
+    Object.entries(filters).forEach(([key, value]) => {
+        if (value) params.set(key, value);
+    });
+    if (cursor) params.set('cursor', cursor);
+    return '/download_history?' + params.toString();
+}
+
+function loadDownloadHistory(append = false) {
+    // 刷新第一页时带上 ETag，历史记录没有变化时服务器返回 304
+    const headers = {};
+    if (!append && historyEtag) headers['If-None-Match'] = historyEtag;
+
+    fetch(historyQuery(append ? historyCursor : null), { headers, cache: 'no-store' })
+        .then(response => {
+            if (response.status === 304) return null;
+            if (!append) historyEtag = response.headers.get('ETag');
+            return response.json();
+        })
         .then(data => {
-            if (data.status === 'success') {
-                displayHistory(data.history);
-            }
+            if (!data || data.status !== 'success') return;
+            historyItems = append ? historyItems.concat(data.history) : data.history;
+            historyCursor = data.next_cursor;
+            displayHistory(historyItems);
+            document.getElementById('history-more').style.display = historyCursor ? 'inline-block' : 'none';
         })
         .catch(err => {
             console.error('加载历史记录失败:', err);
         });
 }
 
+function onHistoryFilterChange() {
+    // 输入时稍作延迟，避免每个按键都请求一次
+    clearTimeout(historyFilterTimer);
+    historyFilterTimer = setTimeout(() => {
+        historyEtag = null;
+        loadDownloadHistory();
+    }, 300);
+}
+
 function displayHistory(history) {
     const container = document.getElementById('history-container');
     if (!history || history.length === 0) {
@@ -290,7 +353,8 @@ document.addEventListener('DOMContentLoaded', function() {
     loadDownloadHistory();
 });
 
-function updateProgress(data) {
+// 旧版的详细进度（依赖 jQuery，页面没有引入），改名以免覆盖上面的 updateProgress
+function updateDetailedProgress(data) {
     if (data.status === 'Downloading') {
         $('#progress').show();
         const progress = data.progress;
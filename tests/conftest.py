@@ -0,0 +1,51 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# download 在导入时就会打开历史记录数据库，测试使用临时数据库
+os.environ.setdefault("MIAOBOX_HISTORY_DB", os.path.join(tempfile.mkdtemp(prefix="miaobox-test-"), "history.db"))
+
+import benchmark  # noqa: E402
+import download  # noqa: E402
+
+
+class RecordingHandler(benchmark.FixtureHandler):
+    """记录每个请求的 Range 头，没有 Range 时记为 None"""
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.ranges.append(self.headers.get("Range"))
+        super().do_GET()
+
+
+@pytest.fixture
+def fixture_server():
+    """启动测试服务器，返回 serve(files, **profile)，可多次调用更换文件"""
+    servers = []
+
+    def serve(files, **profile):
+        server = benchmark.FixtureServer(files)
+        server.RequestHandlerClass = RecordingHandler
+        server.ranges = []
+        server.configure(profile)
+        server.start()
+        servers.append(server)
+        return server
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def save_path(tmp_path, monkeypatch):
+    """临时保存目录，关闭去重，避免不同测试之间互相影响"""
+    monkeypatch.setitem(download.app.config, "SAVE_PATH", str(tmp_path))
+    monkeypatch.setitem(download.app.config, "DEDUP_ENABLED", False)
+    return str(tmp_path)
@@ -0,0 +1,199 @@
+import collections
+import hashlib
+import os
+import random
+import threading
+import tracemalloc
+
+import pytest
+
+import benchmark
+import download
+
+
+def make_file(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def read(save_path, name):
+    with open(os.path.join(save_path, name), "rb") as f:
+        return f.read()
+
+
+def test_multi_thread_download_fetches_start_once(fixture_server, save_path):
+    data = make_file(4 * 1024 * 1024)
+    server = fixture_server({"big.bin": data})
+
+    name = download.Downloader(f"{server.base_url}/big.bin", save_path).download()
+
+    assert read(save_path, name) == data
+    probe = f"bytes=0-{download.app.config['PROBE_SIZE'] - 1}"
+    assert server.ranges[0] == probe
+    # 只有探测请求从文件开头开始，没有请求完整内容
+    assert None not in server.ranges
+    assert [r for r in server.ranges if r.startswith("bytes=0-")] == [probe]
+
+
+@pytest.mark.parametrize("size", [5000, 100 * 1024])
+def test_small_file_continues_after_probe(fixture_server, save_path, size):
+    data = make_file(size)
+    server = fixture_server({"small.bin": data})
+
+    name = download.Downloader(f"{server.base_url}/small.bin", save_path).download()
+
+    assert read(save_path, name) == data
+    assert server.stats["bytes_sent"] == size
+    assert all(r is None or not r.startswith("bytes=0-") for r in server.ranges[1:])
+
+
+@pytest.mark.parametrize("size", [100 * 1024, 3 * 1024 * 1024])
+def test_server_without_ranges_sends_body_once(fixture_server, save_path, size):
+    data = make_file(size)
+    server = fixture_server({"file.bin": data}, accept_ranges=False)
+
+    name = download.Downloader(f"{server.base_url}/file.bin", save_path).download()
+
+    assert read(save_path, name) == data
+    assert server.stats["requests"] == 1
+    assert server.stats["bytes_sent"] == size
+
+
+def test_failed_single_thread_attempts_leave_no_files(fixture_server, save_path):
+    data = make_file(100 * 1024)
+    # 探测之后的请求每次都在传输一半时断开
+    server = fixture_server({"flaky.bin": data}, fail_every=1)
+
+    with pytest.raises(download.requests.RequestException):
+        download.Downloader(f"{server.base_url}/flaky.bin", save_path).download()
+
+    assert server.stats["failures_injected"] == 3
+    assert os.listdir(save_path) == []
+
+
+def test_single_thread_retry_keeps_only_the_finished_file(fixture_server, save_path):
+    data = make_file(100 * 1024)
+    server = fixture_server({"flaky.bin": data}, fail_every=2)
+    server.segment_requests = 1  # 第一次请求失败，第二次成功
+
+    name = download.Downloader(f"{server.base_url}/flaky.bin", save_path).download()
+
+    assert server.stats["failures_injected"] == 1
+    assert os.listdir(save_path) == [name]
+    assert read(save_path, name) == data
+
+
+def test_empty_remote_file_is_downloaded(fixture_server, save_path):
+    server = fixture_server({"empty.txt": b""})
+
+    name = download.Downloader(f"{server.base_url}/empty.txt", save_path).download()
+
+    assert read(save_path, name) == b""
+    assert server.ranges[0] == f"bytes=0-{download.app.config['PROBE_SIZE'] - 1}"
+
+
+def test_single_thread_download_memory_is_bounded(fixture_server, save_path):
+    # 文件大小是内存预算的数倍，整个响应读入内存时必然超出预算
+    size = 48 * 1024 * 1024
+    budget = 8 * 1024 * 1024
+    data = make_file(size)
+    server = fixture_server({"large.bin": data})
+
+    tracemalloc.start()
+    try:
+        name = download.Downloader(f"{server.base_url}/large.bin", save_path).single_thread_download()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert peak < budget
+    assert benchmark.file_sha256(os.path.join(save_path, name)) == hashlib.sha256(data).hexdigest()
+
+
+@pytest.mark.parametrize("size", [100 * 1024, 4 * 1024 * 1024])
+def test_concurrent_downloads_of_same_url_get_distinct_files(fixture_server, save_path, size):
+    data = make_file(size)
+    server = fixture_server({"same.bin": data}, bandwidth=8 * 1024 * 1024)
+    names = []
+
+    def run():
+        names.append(download.Downloader(f"{server.base_url}/same.bin", save_path).download())
+
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(names)) == 3
+    for name in names:
+        assert read(save_path, name) == data
+
+
+def test_reserved_file_is_not_executable(fixture_server, save_path):
+    server = fixture_server({"plain.bin": make_file(5000)})
+
+    name = download.Downloader(f"{server.base_url}/plain.bin", save_path).download()
+
+    umask = os.umask(0)
+    os.umask(umask)
+    mode = os.stat(os.path.join(save_path, name)).st_mode & 0o777
+    # 与 open(..., 'wb') 创建的文件权限一致
+    assert mode == 0o666 & ~umask
+    assert not mode & 0o111
+
+
+@pytest.mark.parametrize("state, expected", [
+    ({"etag": '"abc"', "last_modified": "Mon, 01 Jan 2024 00:00:00 GMT"}, '"abc"'),
+    ({"etag": 'W/"abc"', "last_modified": "Mon, 01 Jan 2024 00:00:00 GMT"}, "Mon, 01 Jan 2024 00:00:00 GMT"),
+    ({"etag": 'W/"abc"', "last_modified": None}, None),
+])
+def test_resume_if_range_never_uses_weak_etag(state, expected):
+    assert download.ResumeJournal.validator(state) == expected
+
+
+def test_segment_retries_are_counted_against_the_failing_mirror(fixture_server, save_path, monkeypatch):
+    data = make_file(8 * 1024 * 1024)
+    primary = fixture_server({"file.bin": data})
+    flaky = fixture_server({"file.bin": data}, fail_every=1)
+    # 两个服务器都在本机，用不同的主机名区分
+    mirror_url = f"http://localhost:{flaky.server_address[1]}/file.bin"
+    monkeypatch.setitem(download.app.config, "MAX_THREADS", 4)
+    monkeypatch.setattr(download.metrics.segment_retries, "values", collections.defaultdict(float))
+
+    downloader = download.Downloader(f"{primary.base_url}/file.bin", save_path, mirrors=[mirror_url])
+    name = downloader.download()
+
+    assert read(save_path, name) == data
+    retries = download.metrics.segment_retries.values
+    assert retries[("localhost",)] > 0
+    assert retries[("127.0.0.1",)] == 0
+
+
+def test_checksum_is_taken_from_the_matching_entry(fixture_server, save_path):
+    data = make_file(5000)
+    other = make_file(5000, seed=1)
+    sums = "".join(f"{hashlib.sha256(content).hexdigest()}  {name}\n"
+                   for name, content in [("other.bin", other), ("file.bin", data), ("more.bin", b"x")])
+    server = fixture_server({"file.bin": data, "SHA256SUMS": sums.encode()})
+
+    downloader = download.Downloader(f"{server.base_url}/file.bin", save_path,
+                                     checksum_url=f"{server.base_url}/SHA256SUMS")
+    name = downloader.download()
+
+    assert read(save_path, name) == data
+    assert downloader.expected_checksum == ("sha256", hashlib.sha256(data).hexdigest())
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("a" * 64, "a" * 64),
+    ("a" * 64 + "  renamed.bin\n", "a" * 64),
+    ("a" * 64 + "  other.bin\n" + "b" * 64 + " *file.bin\n", "b" * 64),
+    ("SHA256 (other.bin) = " + "a" * 64 + "\nSHA256 (file.bin) = " + "b" * 64, "SHA256:" + "b" * 64),
+])
+def test_find_checksum_entry(text, expected):
+    assert download.find_checksum_entry(text, {"file.bin"}) == expected
+
+
+def test_find_checksum_entry_without_matching_name():
+    with pytest.raises(ValueError):
+        download.find_checksum_entry("a" * 64 + "  one.bin\n" + "b" * 64 + "  two.bin\n", {"file.bin"})